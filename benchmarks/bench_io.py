@@ -0,0 +1,50 @@
+"""
+Write benchmark: json.dump with default separators against the chunked writer used by save_coco_file.
+
+Run from the repository root:
+    python -m benchmarks.bench_io --annotations 1000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import make_coco
+from coco_toolkit.helper import writer
+
+
+def timed(function, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def json_dump(coco: dict, path: str):
+    with open(path, "w") as f:
+        json.dump(coco, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark coco json writers")
+    parser.add_argument("--annotations", type=int, default=200000, help="annotation count of synthetic dataset")
+    parser.add_argument("--precision", type=int, default=2, help="digits kept by the rounded run")
+    args = parser.parse_args()
+
+    coco = make_coco(args.annotations)
+    print(f"annotations: {args.annotations}, writer backend: {writer.backend()}")
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [
+            ("json.dump", json_dump, {}),
+            ("save_coco", writer.save_coco, {}),
+            (f"save_coco precision={args.precision}", writer.save_coco, {"precision": args.precision}),
+        ]
+        for index, (name, function, kwargs) in enumerate(runs):
+            path = os.path.join(tmp, f"{index}.json")
+            seconds = timed(function, coco, path, **kwargs)
+            size = os.path.getsize(path) / 1024**2
+            print(f"{name:<28} {seconds:8.2f} s {size:10.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
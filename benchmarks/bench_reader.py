@@ -0,0 +1,41 @@
+"""
+Reader benchmark: PreProcess.reader returning addict Dict against plain=True.
+
+Run from the repository root:
+    python -m benchmarks.bench_reader --annotations 1000000
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks.bench_io import timed
+from benchmarks.synthetic import make_coco
+from coco_toolkit.helper import writer
+from coco_toolkit.helper.preprocess import PreProcess
+
+
+def touch_bboxes(coco: dict):
+    total = 0.0
+    for ann in coco["annotations"]:
+        total += ann["bbox"][2] * ann["bbox"][3]
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark coco json reader modes")
+    parser.add_argument("--annotations", type=int, default=1000000, help="annotation count of synthetic dataset")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "coco.json")
+        writer.save_coco(make_coco(args.annotations), path)
+        print(f"annotations: {args.annotations}")
+        for name, plain in [("addict Dict", False), ("plain dict", True)]:
+            result = {}
+            load = timed(lambda: result.update(coco=PreProcess.reader(path, cache=False, plain=plain)))
+            access = timed(touch_bboxes, result["coco"])
+            print(f"{name:<12} load {load:8.2f} s   bbox access {access:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
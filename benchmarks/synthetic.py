@@ -0,0 +1,35 @@
+import random
+
+
+def make_coco(n_annotations: int, annotations_per_image: int = 10, n_categories: int = 30, seed: int = 0) -> dict:
+    """
+    This function creates a random coco json file with float bboxes and polygons.
+
+        @param n_annotations: Annotation count
+        @param annotations_per_image: Average annotation count per image
+        @param n_categories: Category count
+        @param seed: Random seed
+        @return: Coco json file as a dictionary
+    """
+    rng = random.Random(seed)
+    n_images = max(1, n_annotations // annotations_per_image)
+    images = [
+        {"id": i, "file_name": f"frame_{i:08d}.jpg", "width": 1920, "height": 1080} for i in range(1, n_images + 1)
+    ]
+    categories = [{"id": i, "name": f"class_{i}", "supercategory": ""} for i in range(1, n_categories + 1)]
+    annotations = []
+    for i in range(1, n_annotations + 1):
+        x, y = rng.uniform(0, 1800), rng.uniform(0, 1000)
+        w, h = rng.uniform(1, 120), rng.uniform(1, 80)
+        annotations.append(
+            {
+                "id": i,
+                "image_id": rng.randint(1, n_images),
+                "category_id": rng.randint(1, n_categories),
+                "bbox": [x, y, w, h],
+                "area": w * h,
+                "iscrowd": 0,
+                "segmentation": [[x, y, x, y + h, x + w, y + h, x + w, y]],
+            }
+        )
+    return {"info": {}, "licenses": [], "images": images, "annotations": annotations, "categories": categories}
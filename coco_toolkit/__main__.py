@@ -0,0 +1,23 @@
+import argparse
+import sys
+
+from coco_toolkit.helper import diff, validate
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m coco_toolkit", description="Coco toolkit commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    validate.add_arguments(
+        commands.add_parser("validate", help="check that coco json file agrees with its image folder")
+    )
+    diff.add_arguments(commands.add_parser("diff", help="report added, removed and modified records of two versions"))
+    args = parser.parse_args(argv)
+    if args.command == "validate":
+        return validate.run(args)
+    if args.command == "diff":
+        return diff.run(args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,9 @@ import shutil
 
 from tqdm import tqdm
 
+from coco_toolkit.helper.compression import open_file
+from coco_toolkit.helper.index import CocoIndex
+
 
 def convert_bbox_coco2yolo(img_width, img_height, bbox):
     """
@@ -54,7 +57,7 @@ def make_folders(path="output"):
 def coco_to_yolo(json_file, output_path="output"):
     path = make_folders(output_path)
 
-    with open(json_file) as f:
+    with open_file(json_file) as f:
         json_data = json.load(f)
 
     # write _darknet.labels, which holds names of all classes (one class per line)
@@ -64,13 +67,14 @@ def coco_to_yolo(json_file, output_path="output"):
             category_name = category["name"]
             f.write(f"{category_name}\n")
 
+    index = CocoIndex(json_data)
     for image in tqdm(json_data["images"], desc="Annotation txt for each iamge"):
         img_id = image["id"]
         img_name = image["file_name"]
         img_width = image["width"]
         img_height = image["height"]
 
-        anno_in_image = [anno for anno in json_data["annotations"] if anno["image_id"] == img_id]
+        anno_in_image = index.annotations_of_image(img_id)
         anno_txt = os.path.join(output_path, img_name.split(".")[0] + ".txt")
         with open(anno_txt, "w") as f:
             for anno in anno_in_image:
@@ -6,8 +6,9 @@ import xml.etree.ElementTree as ET
 from typing import Dict, List
 import datetime
 import logging
-import shutil
 from pathlib import Path
+from coco_toolkit.helper.compression import open_file
+from coco_toolkit.helper.copier import copy_images
 from coco_toolkit.helper.preprocess import PreProcess
 from tqdm import tqdm
 
@@ -163,7 +164,7 @@ def convert_xmls_to_cocojson(
         }
         output_json_dict["categories"].append(category_info)
 
-    with open(output_jsonpath, "w") as f:
+    with open_file(output_jsonpath, "w") as f:
         output_json = json.dumps(output_json_dict)
         f.write(output_json)
 
@@ -226,12 +227,17 @@ def main(xml_path, output_path, time):
     )
 
 
-def voc_to_coco(data_xml_folder_path: str, output_path: str, image_path: str):
+def voc_to_coco(
+    data_xml_folder_path: str, output_path: str, image_path: str, workers: int = None, materialize: str = "copy"
+):
     """
     This function return converted coco json file and saves coco data set in given output path
         @param data_xml_folder_path: Directory of folder that obtain datas in format xml
         @param output_path: Directory of folder that created coco json
         @param image_path: Data set's images path
+        @param workers: Thread count of image copy, DEFAULT_WORKERS if it's None
+        @param materialize: "copy", "hardlink", "symlink", "reflink" or "manifest" (only list images in
+         manifest.tsv)
         @return: Converted coco json file as dictionary and saves coco data set in given output path
     """
 
@@ -240,17 +246,17 @@ def voc_to_coco(data_xml_folder_path: str, output_path: str, image_path: str):
 
     main(data_xml_folder_path, output_path, time)
     json_path = output_path + f"/converted_coco_{time}/annotations/coco.json"
-    coco = PreProcess.reader(json_path)
+    coco = PreProcess.reader(json_path, plain=True)
     preprocess = PreProcess(coco)
-    preprocess.set_unique_image_id(first_id=1)
-    preprocess.set_unique_annotation_id(first_id=1)
-    preprocess.set_unique_class_id(first_id=0, back_grounds=True)
+    preprocess.renumber(image_first_id=1, annotation_first_id=1, class_first_id=0, back_grounds=True)
     list_dir_img = os.listdir(image_path)
-    for image in list_dir_img:
-        shutil.copy(
-            image_path + f"/{image}",
-            output_path + f"/converted_coco_{time}/images/{image}",
-        )
+    copy_images(
+        list_dir_img,
+        image_path,
+        output_path + f"/converted_coco_{time}/images",
+        workers=workers,
+        materialize=materialize,
+    ).check()
     path = Path(json_path)
     preprocess.save_coco_file(directory=str(path.parent.absolute()), file_name="coco")
     logging.getLogger().setLevel(logging.INFO)
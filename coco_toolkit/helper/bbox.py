@@ -0,0 +1,83 @@
+from itertools import chain
+
+import numpy as np
+
+BBOX_RULES = ("malformed", "not_finite", "non_positive_size", "out_of_image")
+BBOX_ACTIONS = ("report", "remove", "repair")
+
+
+def _is_coordinate(value) -> bool:
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_))
+
+
+def bbox_array(annotations: list) -> tuple:
+    """
+    This function gathers annotation bboxes into a contiguous Nx4 float array.
+
+        @param annotations: List of coco annotations
+        @return: Tuple of (Nx4 float64 array, NaN rows for malformed bboxes; boolean mask of malformed bboxes, i.e.
+         missing or not a list of 4 numbers, numeric strings and booleans included)
+    """
+    values = [ann.get("bbox") for ann in annotations]
+    try:
+        # Only plain ints and floats take the fast path, numpy would silently convert strings and booleans
+        if set(map(type, chain.from_iterable(values))) <= {int, float}:
+            bboxes = np.array(values, dtype=np.float64)
+            if bboxes.shape == (len(values), 4):
+                return bboxes, np.zeros(len(values), dtype=bool)
+    except (TypeError, ValueError):
+        pass
+    # Slow path for files with missing, ragged or non numeric bboxes
+    bboxes = np.full((len(values), 4), np.nan)
+    malformed = np.ones(len(values), dtype=bool)
+    for i, bbox in enumerate(values):
+        if isinstance(bbox, (list, tuple)) and len(bbox) == 4 and all(_is_coordinate(p) for p in bbox):
+            bboxes[i] = [float(p) for p in bbox]
+            malformed[i] = False
+    return bboxes, malformed
+
+
+def check_bboxes(bboxes: np.ndarray, malformed: np.ndarray, widths=None, heights=None) -> dict:
+    """
+    This function checks every bbox against every rule with array operations. A bbox may break several rules.
+
+        @param bboxes: Nx4 [x, y, width, height] array
+        @param malformed: Boolean mask of malformed bboxes
+        @param widths: Width of the image of every bbox, NaN if unknown
+        @param heights: Height of the image of every bbox, NaN if unknown
+        @return: Dictionary of {rule: boolean mask} for BBOX_RULES
+    """
+    finite = np.isfinite(bboxes).all(axis=1)
+    x, y, w, h = bboxes.T
+    with np.errstate(invalid="ignore"):
+        outside = (x < 0) | (y < 0)
+        if widths is not None:
+            outside |= x + w > widths
+        if heights is not None:
+            outside |= y + h > heights
+        non_positive = (w <= 0) | (h <= 0)
+    valid = ~malformed & finite
+    return {
+        "malformed": malformed,
+        "not_finite": ~malformed & ~finite,
+        "non_positive_size": valid & non_positive,
+        "out_of_image": valid & outside,
+    }
+
+
+def clip_bboxes(bboxes: np.ndarray, widths=None, heights=None) -> np.ndarray:
+    """
+    @param bboxes: Nx4 [x, y, width, height] array
+    @param widths: Image width per bbox, NaN if unknown
+    @param heights: Image height per bbox, NaN if unknown
+    @return: Bboxes clipped to [0, width] x [0, height], sizes may become zero or negative
+    """
+    x1 = np.maximum(bboxes[:, 0], 0)
+    y1 = np.maximum(bboxes[:, 1], 0)
+    x2 = bboxes[:, 0] + bboxes[:, 2]
+    y2 = bboxes[:, 1] + bboxes[:, 3]
+    if widths is not None:
+        x2 = np.fmin(x2, widths)
+    if heights is not None:
+        y2 = np.fmin(y2, heights)
+    return np.stack([x1, y1, x2 - x1, y2 - y1], axis=1)
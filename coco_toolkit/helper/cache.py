@@ -0,0 +1,217 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from coco_toolkit.helper.compression import open_file
+from coco_toolkit.helper.table import AnnotationTable
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".cache"
+
+# Files smaller than this parse faster than the sidecar pays off, so they are never cached
+MIN_CACHE_SIZE = 32 * 1024 * 1024
+
+# Set COCO_TOOLKIT_CACHE=0 to turn the sidecar cache off everywhere
+CACHE_ENV = "COCO_TOOLKIT_CACHE"
+
+TABLE_COLUMNS = (
+    "ids",
+    "image_ids",
+    "category_ids",
+    "bboxes",
+    "areas",
+    "iscrowd",
+    "flags",
+    "segmentation_values",
+    "polygon_offsets",
+    "segmentation_offsets",
+)
+
+
+def cache_enabled(cache: bool = True) -> bool:
+    """
+    @param cache: Caller's choice
+    @return: True if the caller and COCO_TOOLKIT_CACHE environment variable both allow caching
+    """
+    return cache and os.environ.get(CACHE_ENV, "1").lower() not in ("0", "false", "no", "off")
+
+
+def cache_dir(path: str) -> str:
+    """
+    @param path: Coco json file path
+    @return: Sidecar directory of given json file
+    """
+    return path + CACHE_SUFFIX
+
+
+def file_hash(path: str) -> str:
+    """
+    @param path: File path
+    @return: blake2b hex digest of file content
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_meta(directory: str):
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_valid(path: str) -> bool:
+    """
+    This function checks the sidecar of given json file. A sidecar is valid when its version and the json file size
+    match and either the modification time matches or, if only the modification time changed (touch, copy), the
+    content hash still matches. In the latter case the recorded time is refreshed.
+
+        @param path: Coco json file path
+        @return: True if the sidecar can be used instead of parsing the json file
+    """
+    directory = cache_dir(path)
+    meta = _read_meta(directory)
+    if meta is None:
+        return False
+    stat = os.stat(path)
+    if meta.get("version") != CACHE_VERSION or meta.get("size") != stat.st_size:
+        return False
+    if meta.get("mtime_ns") == stat.st_mtime_ns:
+        return True
+    if meta.get("hash") != file_hash(path):
+        return False
+    meta["mtime_ns"] = stat.st_mtime_ns
+    meta_path = os.path.join(directory, "meta.json")
+    tmp_path = f"{meta_path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def clear_cache(path: str):
+    """
+    This function removes the sidecar of given json file if there is any.
+
+        @param path: Coco json file path
+    """
+    shutil.rmtree(cache_dir(path), ignore_errors=True)
+
+
+def write_cache(path: str, coco: dict, stat: os.stat_result = None):
+    """
+    This function writes the sidecar of given json file. Annotations are stored as .npy columns, everything else
+    in a small json file. Failures (read only directory, non integer ids ...) are logged and ignored. Nothing is
+    written if the json file changed since given stat.
+
+        @param path: Coco json file path
+        @param coco: Parsed content of json file
+        @param stat: os.stat of json file taken before it was parsed, taken now if it's None
+    """
+    directory = cache_dir(path)
+    tmp_directory = f"{directory}.tmp-{os.getpid()}"
+    try:
+        if stat is None:
+            stat = os.stat(path)
+        table = AnnotationTable.from_annotations(coco.get("annotations", []))
+        os.makedirs(tmp_directory, exist_ok=True)
+        for column in TABLE_COLUMNS:
+            np.save(os.path.join(tmp_directory, f"{column}.npy"), getattr(table, column))
+
+        rest = {key: value for key, value in coco.items() if key != "annotations"}
+        extras = {str(i): extra for i, extra in enumerate(table.extras) if extra}
+        with open(os.path.join(tmp_directory, "rest.json"), "w") as f:
+            json.dump({"coco": rest, "extras": extras}, f, separators=(",", ":"))
+
+        meta = {
+            "version": CACHE_VERSION,
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": file_hash(path),
+        }
+        current = os.stat(path)
+        if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            raise ValueError("json file changed while it was read")
+        with open(os.path.join(tmp_directory, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        clear_cache(path)
+        os.replace(tmp_directory, directory)
+    except (OSError, ValueError) as e:
+        logging.getLogger().warning(f"Could not write cache for {path}: {e}")
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def load_table(path: str):
+    """
+    This function opens a valid sidecar. Annotation columns are memory mapped, so this is cheap for any size. A
+    sidecar with missing or damaged files is removed.
+
+        @param path: Coco json file path
+        @return: Tuple of (coco json file without annotations, annotation table) or None if there is no valid sidecar
+    """
+    if not is_valid(path):
+        return None
+    directory = cache_dir(path)
+    try:
+        columns = [np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r") for column in TABLE_COLUMNS]
+        with open(os.path.join(directory, "rest.json")) as f:
+            rest = json.load(f)
+        table = dict(zip(TABLE_COLUMNS, columns))
+        n = len(table["ids"])
+        if (
+            any(len(table[column]) != n for column in TABLE_COLUMNS[:7])
+            or table["bboxes"].shape != (n, 4)
+            or len(table["segmentation_offsets"]) != n + 1
+            or table["segmentation_offsets"][-1] >= len(table["polygon_offsets"])
+            or table["polygon_offsets"][-1] != len(table["segmentation_values"])
+        ):
+            raise ValueError("column lengths do not match")
+        extras: list = [None] * n
+        for i, extra in rest["extras"].items():
+            extras[int(i)] = extra
+        return rest["coco"], AnnotationTable(*columns, extras)
+    except (OSError, ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        logging.getLogger().warning(f"Removing damaged cache of {path}: {e}")
+        clear_cache(path)
+        return None
+
+
+def load_coco(path: str, cache: bool = True, min_size: int = MIN_CACHE_SIZE) -> dict:
+    """
+    This function reads coco json file through its sidecar cache. A valid sidecar is used instead of parsing the
+    json file; otherwise the json file is parsed and, if it is big enough, a new sidecar is written next to it.
+
+        @param path: Coco json file path
+        @param cache: If it's False always parse the json file and never touch the sidecar
+        @param min_size: Files smaller than this size in bytes are not cached
+        @return: Coco json file as a dictionary
+    """
+    # Stat before parsing, so a file changed meanwhile never gets a sidecar of its new size and time
+    stat = os.stat(path)
+    use_cache = cache_enabled(cache) and stat.st_size >= min_size
+    if use_cache:
+        cached = load_table(path)
+        if cached is not None:
+            coco, table = cached
+            coco["annotations"] = table.to_annotations()
+            return coco
+
+    with open_file(path) as f:
+        coco = json.load(f)
+    if use_cache:
+        write_cache(path, coco, stat)
+    return coco
@@ -0,0 +1,139 @@
+import numbers
+
+import numpy as np
+
+# Marks a category id in remap tables whose annotations are dropped
+DROP = None
+
+
+def _target(value) -> tuple:
+    """
+    @param value: Mapping value: None (drop), new name, new integer id, (id, name) tuple or {"id", "name"} dict
+    @return: Tuple of (new id or None, new name or None)
+    """
+    if isinstance(value, dict):
+        return value.get("id"), value.get("name")
+    if isinstance(value, (tuple, list)):
+        return value[0], value[1]
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return int(value), None
+    if isinstance(value, str):
+        return None, value
+    raise ValueError(f"Invalid category mapping value {value!r}")
+
+
+def remap_table(categories: list, mapping: dict) -> tuple:
+    """
+    This function resolves a taxonomy mapping into new categories and an old id -> new id table.
+
+    Mapping keys are old category ids or names, values are None to drop the category with its annotations, a new
+    name, a new integer id, an (id, name) tuple or an {"id": ..., "name": ...} dict. Categories that end up with the
+    same id are merged, so is a category given a name that another category ends up with, even under a different
+    explicit id (the id that comes first wins). A category given only a new name keeps its id, one given only a new
+    id takes the name of the category already holding that id. A merged category keeps the fields and position of
+    the category that already had its id, otherwise of its first source. Unmapped categories are kept as they are.
+
+        @param categories: Coco categories
+        @param mapping: Dictionary of {old id or name: target}
+        @return: Tuple of (new categories, dictionary of {old id: new id or DROP})
+    """
+    by_id = {cat["id"]: cat for cat in categories}
+    unknown = [key for key in mapping if key not in by_id and all(cat["name"] != key for cat in categories)]
+    if unknown:
+        raise KeyError(f"Categories not found: {unknown[:5]}")
+
+    targets = []
+    for cat in categories:
+        if cat["id"] in mapping:
+            value = mapping[cat["id"]]
+        elif cat["name"] in mapping:
+            value = mapping[cat["name"]]
+        else:
+            targets.append((cat["id"], cat["name"], False))
+            continue
+        if value is None:
+            targets.append(DROP)
+            continue
+        new_id, new_name = _target(value)
+        targets.append((new_id, new_name, new_name is not None))
+
+    # Id of every name that already has one
+    id_of_name = {}
+    for target in targets:
+        if target is not DROP and target[0] is not None and target[1] is not None:
+            id_of_name.setdefault(target[1], target[0])
+
+    # A new name joins the category holding it, otherwise the category keeps its own id
+    resolved = []
+    for cat, target in zip(categories, targets):
+        if target is DROP:
+            resolved.append(DROP)
+            continue
+        new_id, new_name, explicit_name = target
+        if new_id is None:
+            new_id = id_of_name.setdefault(new_name, cat["id"])
+        resolved.append((new_id, new_name, explicit_name))
+
+    # An explicit name joins the first category holding that name even if their ids differ, the earlier id wins
+    first_seen, merged_into = {}, {}
+    for target in resolved:
+        if target is not DROP:
+            first_seen.setdefault(target[0], len(first_seen))
+
+    def merged(new_id):
+        while new_id in merged_into:
+            new_id = merged_into[new_id]
+        return new_id
+
+    for new_id, new_name, explicit_name in (target for target in resolved if target is not DROP):
+        if explicit_name:
+            root, other = sorted((merged(new_id), merged(id_of_name[new_name])), key=first_seen.get)
+            if root != other:
+                merged_into[other] = root
+
+    # Group sources by new id. The category that already had the id (the holder) gives fields and position,
+    # otherwise the first source does. The last explicit name wins, then the holder's name.
+    groups, id_map = {}, {}
+    for position, (cat, target) in enumerate(zip(categories, resolved)):
+        if target is DROP:
+            id_map[cat["id"]] = DROP
+            continue
+        new_id, new_name, explicit_name = target
+        new_id = id_map[cat["id"]] = merged(new_id)
+        group = groups.setdefault(new_id, {"base": cat, "position": position, "name": None})
+        if cat["id"] == new_id and group["base"]["id"] != new_id:
+            group["base"], group["position"] = cat, position
+        if explicit_name:
+            group["name"] = new_name
+
+    new_categories = []
+    for new_id, group in sorted(groups.items(), key=lambda item: item[1]["position"]):
+        new_categories.append(dict(group["base"], id=new_id, name=group["name"] or group["base"]["name"]))
+    return new_categories, id_map
+
+
+def remap_category_ids(values: list, id_map: dict) -> tuple:
+    """
+    This function applies an old id -> new id table to a category id column in one pass. Integer columns are
+    remapped with a sorted lookup table, ids that are not in the table are kept.
+
+        @param values: Category id per annotation
+        @param id_map: Dictionary of {old id: new id or DROP}
+        @return: Tuple of (new category id per annotation, boolean keep mask)
+    """
+    old = np.asarray(values)
+    integer_table = all(
+        isinstance(key, numbers.Integral) and (value is DROP or isinstance(value, numbers.Integral))
+        for key, value in id_map.items()
+    )
+    if old.dtype.kind not in "iu" or not integer_table or not id_map:
+        new = [id_map.get(value, value) for value in values]
+        keep = np.array([not (value in id_map and id_map[value] is DROP) for value in values], dtype=bool)
+        return new, keep
+
+    keys = np.array(sorted(id_map), dtype=np.int64)
+    dropped = np.array([id_map[key] is DROP for key in keys.tolist()])
+    targets = np.array([-1 if id_map[key] is DROP else id_map[key] for key in keys.tolist()], dtype=np.int64)
+    position = np.minimum(np.searchsorted(keys, old), len(keys) - 1)
+    found = keys[position] == old
+    return np.where(found, targets[position], old).tolist(), ~(found & dropped[position])
@@ -0,0 +1,52 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+SUFFIXES = {".gz": "gz", ".bz2": "bz2", ".xz": "xz", ".zst": "zst"}
+
+
+def compression_of(path: str):
+    """
+    @param path: File path
+    @return: Compression name ("gz", "bz2", "xz", "zst") from file suffix, None for plain files
+    """
+    return SUFFIXES.get(os.path.splitext(str(path))[1].lower())
+
+
+def open_file(path: str, mode: str = "r"):
+    """
+    This function opens a file and transparently (de)compresses it according to its suffix. Data is streamed,
+    no temporary file is created.
+
+        @param path: File path, e.g. coco.json, coco.json.gz, coco.json.xz or coco.json.zst
+        @param mode: "r", "w", "rb" or "wb"
+        @return: File object, utf-8 text mode unless "b" is in mode
+    """
+    compression = compression_of(path)
+    binary = "b" in mode
+    raw_mode = mode.replace("t", "").replace("b", "")
+    if compression is None:
+        return open(path, mode) if binary else open(path, mode, encoding="utf-8")
+
+    if compression == "gz":
+        f = gzip.open(path, raw_mode + "b")
+    elif compression == "bz2":
+        f = bz2.open(path, raw_mode + "b")
+    elif compression == "xz":
+        f = lzma.open(path, raw_mode + "b")
+    else:
+        if zstandard is None:
+            raise ImportError(f"zstandard package is needed to open {path}. Please run: pip install zstandard")
+        fh = open(path, raw_mode + "b")
+        if raw_mode == "r":
+            f = zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+        else:
+            f = zstandard.ZstdCompressor().stream_writer(fh, closefd=True)
+    return f if binary else io.TextIOWrapper(f, encoding="utf-8")
@@ -0,0 +1,241 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+class CopyReport:
+    """
+    Result of a copy run.
+    """
+
+    def __init__(self):
+        self.copied = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.errors: list = []
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return (
+            f"CopyReport(copied={self.copied}, skipped={self.skipped}, errors={len(self.errors)}, "
+            f"bytes={self.bytes}, bytes_per_second={self.bytes_per_second:.0f})"
+        )
+
+    def check(self) -> "CopyReport":
+        """
+        This function raises CopyError if any file could not be copied, so datasets are not saved pointing at
+        missing images.
+
+            @return: Report itself
+        """
+        if self.errors:
+            raise CopyError(self)
+        return self
+
+
+class CopyError(OSError):
+    """
+    Raised after a copy run in which some files could not be copied. The report lists every failed file.
+    """
+
+    def __init__(self, report: CopyReport):
+        src, dst, error = report.errors[0]
+        super().__init__(f"{len(report.errors)} files could not be copied, first: {src} -> {dst}: {error}")
+        self.report = report
+
+
+def is_up_to_date(src: str, dst: str) -> bool:
+    """
+    @param src: Source file path
+    @param dst: Destination file path
+    @return: True if destination is a regular file (not a link left by symlink mode) with the size and
+     modification time of source
+    """
+    try:
+        src_stat, dst_stat = os.stat(src), os.lstat(dst)
+    except OSError:
+        return False
+    if os.path.islink(dst):
+        return False
+    return src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+
+MATERIALIZE_MODES = ("copy", "hardlink", "symlink", "reflink", "manifest")
+MANIFEST_NAME = "manifest.tsv"
+
+# Linux ioctl that clones file extents (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+
+def reflink(src: str, dst: str):
+    """
+    This function clones src to dst sharing data blocks when the filesystem supports it, otherwise copies it.
+
+        @param src: Source file path
+        @param dst: Destination file path
+    """
+    try:
+        import fcntl
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+    except (ImportError, OSError):
+        shutil.copy2(src, dst)
+
+
+def materialize_file(src: str, dst: str, materialize: str = "copy") -> int:
+    """
+    This function places src at dst as a copy, hard link, symbolic link or reflink.
+
+        @param src: Source file path
+        @param dst: Destination file path
+        @param materialize: One of "copy", "hardlink", "symlink", "reflink"
+        @return: Count of bytes written
+    """
+    # A link left by an earlier run would make copy write through it into the source
+    if os.path.islink(dst) or (materialize in ("hardlink", "symlink") and os.path.lexists(dst)):
+        os.remove(dst)
+    if materialize == "copy":
+        shutil.copy2(src, dst)
+    elif materialize == "reflink":
+        reflink(src, dst)
+    elif materialize == "hardlink":
+        os.link(src, dst)
+        return 0
+    elif materialize == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+        return 0
+    else:
+        raise ValueError(f"Unknown materialize mode {materialize}, choose one of {MATERIALIZE_MODES}")
+    return os.path.getsize(dst)
+
+
+def write_manifest(pairs: list) -> list:
+    """
+    This function writes "destination file name<TAB>absolute source path" lines to a manifest.tsv in every
+    destination folder instead of creating the files. Rows already in the manifest are kept unless the same file
+    name is given again, so reruns do not duplicate rows. The manifest is written to a temporary file that
+    atomically replaces it.
+
+        @param pairs: List of (source path, destination path) tuples
+        @return: Paths of written manifest files
+    """
+    by_folder: dict = {}
+    for src, dst in pairs:
+        folder, name = os.path.split(dst)
+        by_folder.setdefault(folder, {})[name] = os.path.abspath(src)
+    manifests = []
+    for folder, sources in by_folder.items():
+        manifest = os.path.join(folder, MANIFEST_NAME)
+        rows = {}
+        if os.path.isfile(manifest):
+            with open(manifest, encoding="utf-8") as f:
+                rows = dict(line.rstrip("\n").split("\t", 1) for line in f if "\t" in line)
+        rows.update(sources)
+        tmp_path = f"{manifest}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(f"{name}\t{src}\n" for name, src in rows.items())
+            os.replace(tmp_path, manifest)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        manifests.append(manifest)
+    return manifests
+
+
+def copy_files(
+    pairs: list,
+    workers: int = None,
+    skip_existing: bool = True,
+    progress: bool = True,
+    desc: str = "Copying images",
+    materialize: str = "copy",
+    on_done=None,
+) -> CopyReport:
+    """
+    This function copies files with a thread pool. Files whose destination already has the same size and modification
+    time are skipped. Errors are collected in the report instead of stopping the run.
+
+        @param pairs: List of (source path, destination path) tuples
+        @param workers: Thread count, DEFAULT_WORKERS if it's None
+        @param skip_existing: If it's False copy even up to date files
+        @param progress: If it's True show a progress bar in bytes per second
+        @param desc: Progress bar description
+        @param materialize: "copy", "hardlink", "symlink", "reflink" (copy if the filesystem can not clone) or
+         "manifest" to only list the files in a manifest.tsv per destination folder
+        @param on_done: Function called with (source path, destination path) of every file that is in place,
+         copied or up to date. Calls are serialized, e.g. to append to a journal.
+        @return: Copy report
+    """
+    if materialize not in MATERIALIZE_MODES:
+        raise ValueError(f"Unknown materialize mode {materialize}, choose one of {MATERIALIZE_MODES}")
+    report = CopyReport()
+    start = time.perf_counter()
+    if materialize == "manifest":
+        write_manifest(pairs)
+        report.copied = len(pairs)
+        if on_done is not None:
+            for src, dst in pairs:
+                on_done(src, dst)
+        report.seconds = time.perf_counter() - start
+        return report
+
+    lock = threading.Lock()
+    bar = tqdm(unit="B", unit_scale=True, desc=desc, disable=not progress)
+
+    def copy(pair):
+        src, dst = pair
+        try:
+            if skip_existing and is_up_to_date(src, dst):
+                with lock:
+                    report.skipped += 1
+                    if on_done is not None:
+                        on_done(src, dst)
+                return
+            size = materialize_file(src, dst, materialize)
+            with lock:
+                report.copied += 1
+                report.bytes += size
+                bar.update(size)
+                if on_done is not None:
+                    on_done(src, dst)
+        except OSError as e:
+            with lock:
+                report.errors.append((src, dst, str(e)))
+
+    with ThreadPoolExecutor(max_workers=workers or DEFAULT_WORKERS) as executor:
+        for _ in executor.map(copy, pairs):
+            pass
+    bar.close()
+    report.seconds = time.perf_counter() - start
+
+    if report.errors:
+        logging.getLogger().error(f"{len(report.errors)} files could not be copied, first: {report.errors[0]}")
+    return report
+
+
+def copy_images(file_names: list, image_path: str, out_path: str, workers: int = None, **kwargs) -> CopyReport:
+    """
+    This function copies given image files from one folder to another with copy_files.
+
+        @param file_names: Image file names
+        @param image_path: Source images folder
+        @param out_path: Destination images folder
+        @param workers: Thread count, DEFAULT_WORKERS if it's None
+        @return: Copy report
+    """
+    pairs = [(os.path.join(image_path, name), os.path.join(out_path, name)) for name in file_names]
+    return copy_files(pairs, workers=workers, **kwargs)
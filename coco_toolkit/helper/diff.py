@@ -0,0 +1,331 @@
+import json
+import time
+from array import array
+
+import numpy as np
+
+from coco_toolkit.helper.stream import iter_coco
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional fast backend
+    orjson = None
+
+DIFF_KEYS = ("content", "id")
+CHANGES = ("added", "removed", "modified")
+
+_SECTIONS = ("images", "annotations", "categories")
+# Fields that refer to other records, annotations are hashed with the referred file and category names instead
+_REFERENCES = ("id", "image_id", "category_id")
+# Odd 64 bit constants that mix image and category name hashes into annotation hashes
+_IMAGE_MIX = np.uint64(0x9E3779B97F4A7C15)
+_CATEGORY_MIX = np.uint64(0xC2B2AE3D27D4EB4F)
+_RANK_MIX = np.uint64(0x165667B19E3779F9)
+
+_json_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+if orjson is not None:
+
+    def _encode(value) -> bytes:
+        return orjson.dumps(value, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+else:  # pragma: no cover
+
+    def _encode(value) -> bytes:
+        return _json_encoder.encode(value).encode("utf-8")
+
+
+def digest(value) -> int:
+    """
+    @param value: Json serializable value, key order of dicts does not matter
+    @return: Signed 64 bit hash of value. It is stable within one process only, snapshots to be compared are
+     built in the same process.
+    """
+    return hash(_encode(value))
+
+
+def _items(source):
+    """
+    @param source: Coco json dictionary or json file path to be streamed
+    @return: Generator of (section, item) tuples of images, annotations and categories
+    """
+    if isinstance(source, dict):
+        for section in _SECTIONS:
+            for item in source.get(section) or []:
+                yield section, item
+    else:
+        yield from iter_coco(source, keys=_SECTIONS)
+
+
+class _References:
+    """
+    Dense positions of referred ids (image ids, category ids) in first seen order with the value each one resolves to.
+    """
+
+    def __init__(self):
+        self.positions: dict = {}
+        self.values: list = []
+
+    def position(self, ref) -> int:
+        position = self.positions.get(ref)
+        if position is None:
+            position = self.positions[ref] = len(self.values)
+            self.values.append(None)
+        return position
+
+    def define(self, ref, value):
+        self.values[self.position(ref)] = value
+
+    def hashes(self) -> np.ndarray:
+        """
+        @return: Hash of resolved value per position, ids that are never defined hash as themselves
+        """
+        refs = list(self.positions)
+        return np.array(
+            [digest(value if value is not None else ["undefined", ref]) for ref, value in zip(refs, self.values)],
+            dtype=np.int64,
+        ).view(np.uint64)
+
+
+def _unique_keys(keys: np.ndarray, contents: np.ndarray) -> np.ndarray:
+    """
+    This function makes repeated keys unique by mixing in their rank among equal keys. Records with equal keys are
+    ranked by content hash, so identical duplicates pair up between versions.
+
+        @param keys: Key hash per record
+        @param contents: Content hash per record
+        @return: Unique key hash per record
+    """
+    order = np.lexsort((contents, keys))
+    sorted_keys = keys[order]
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    if starts.all():
+        return keys
+    positions = np.arange(len(keys))
+    ranks = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    unique = np.empty_like(keys)
+    unique[order] = sorted_keys + ranks.astype(np.uint64) * _RANK_MIX
+    return unique
+
+
+class Snapshot:
+    """
+    Key and content hashes of every image and annotation of one coco version, built in a single pass. Annotations
+    take 24 bytes each, so a streamed file of any size is held as a few arrays.
+    """
+
+    def __init__(self, source, key: str = "content", precision: int = None):
+        """
+        @param source: Coco json dictionary (indexed mode) or json file path (streaming mode)
+        @param key: "content" keys images by file_name and annotations by (file name, category name, bbox),
+         "id" keys both by id
+        @param precision: Digits after the decimal point of bbox values in annotation keys, None for exact values
+        """
+        if key not in DIFF_KEYS:
+            raise ValueError(f"Unknown diff key {key}, choose one of {DIFF_KEYS}")
+        self.source = source
+        self.key = key
+        self.images = _References()
+        self.categories = _References()
+        self.category_records: dict = {}
+
+        image_keys, image_contents = array("q"), array("q")
+        ann_keys, ann_contents, ann_images, ann_categories = array("q"), array("q"), array("I"), array("I")
+        for section, item in _items(source):
+            if section == "annotations":
+                if key == "id":
+                    ann_keys.append(digest(item.get("id")))
+                else:
+                    bbox = item.get("bbox")
+                    if precision is not None and isinstance(bbox, list):
+                        bbox = [round(value, precision) if isinstance(value, float) else value for value in bbox]
+                    ann_keys.append(digest(bbox))
+                ann_contents.append(digest({k: v for k, v in item.items() if k not in _REFERENCES}))
+                ann_images.append(self.images.position(item.get("image_id")))
+                ann_categories.append(self.categories.position(item.get("category_id")))
+            elif section == "images":
+                self.images.define(item["id"], item.get("file_name"))
+                image_keys.append(digest(item["id"] if key == "id" else item.get("file_name")))
+                image_contents.append(digest({k: v for k, v in item.items() if k != "id"}))
+            else:
+                self.categories.define(item["id"], item.get("name"))
+                self.category_records[item.get("name")] = item
+
+        def hashes(values: array) -> np.ndarray:
+            return np.frombuffer(values, dtype=np.int64).view(np.uint64)
+
+        self.image_contents = hashes(image_contents)
+        self.image_keys = _unique_keys(hashes(image_keys), self.image_contents)
+
+        self.ann_category_positions = np.frombuffer(ann_categories, dtype=np.uint32)
+        image_hashes = self.images.hashes()[np.frombuffer(ann_images, dtype=np.uint32)]
+        category_hashes = self.categories.hashes()[self.ann_category_positions]
+        references = image_hashes * _IMAGE_MIX ^ category_hashes * _CATEGORY_MIX
+        self.ann_contents = hashes(ann_contents) ^ references
+        ann_keys = hashes(ann_keys) ^ references if key == "content" else hashes(ann_keys)
+        self.ann_keys = _unique_keys(ann_keys, self.ann_contents)
+
+    def category_names(self) -> list:
+        """
+        @return: Category name per category position, the id itself for ids without a category
+        """
+        return [
+            value if value is not None else ref for ref, value in zip(self.categories.positions, self.categories.values)
+        ]
+
+    def records(self, section: str, positions) -> dict:
+        """
+        This function fetches records by their position in the section, streaming the file again in streaming mode.
+
+            @param section: "images" or "annotations"
+            @param positions: Record positions
+            @return: Dictionary of {position: record}
+        """
+        wanted = set(int(position) for position in positions)
+        if not wanted:
+            return {}
+        if isinstance(self.source, dict):
+            items = self.source[section]
+            return {position: items[position] for position in wanted}
+        found = {}
+        for position, (_, item) in enumerate(iter_coco(self.source, keys=(section,))):
+            if position in wanted:
+                found[position] = item
+                if len(found) == len(wanted):
+                    break
+        return found
+
+
+def _compare(old_keys: np.ndarray, old_contents: np.ndarray, new_keys: np.ndarray, new_contents: np.ndarray) -> dict:
+    """
+    @return: Dictionary of {"added": new positions, "removed": old positions, "modified": (old positions,
+     new positions)} and "unchanged" count
+    """
+    _, old_common, new_common = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+    modified = old_contents[old_common] != new_contents[new_common]
+    order = np.argsort(old_common[modified])
+    removed = np.ones(len(old_keys), dtype=bool)
+    removed[old_common] = False
+    added = np.ones(len(new_keys), dtype=bool)
+    added[new_common] = False
+    return {
+        "added": np.flatnonzero(added),
+        "removed": np.flatnonzero(removed),
+        "modified": (old_common[modified][order], new_common[modified][order]),
+        "unchanged": int(len(old_common) - modified.sum()),
+    }
+
+
+def _changed_records(old: Snapshot, new: Snapshot, section: str, changes: dict) -> dict:
+    old_modified, new_modified = changes["modified"]
+    old_records = old.records(section, np.concatenate([changes["removed"], old_modified]))
+    new_records = new.records(section, np.concatenate([changes["added"], new_modified]))
+    return {
+        "added": [new_records[position] for position in changes["added"].tolist()],
+        "removed": [old_records[position] for position in changes["removed"].tolist()],
+        "modified": [[old_records[o], new_records[n]] for o, n in zip(old_modified.tolist(), new_modified.tolist())],
+    }
+
+
+def _category_summary(old: Snapshot, new: Snapshot, annotations: dict) -> dict:
+    summary: dict = {}
+    for change, snapshot, positions in (
+        ("added", new, annotations["added"]),
+        ("removed", old, annotations["removed"]),
+        ("modified", new, annotations["modified"][1]),
+    ):
+        names = snapshot.category_names()
+        counts = np.bincount(snapshot.ann_category_positions[positions], minlength=len(names))
+        for name, count in zip(names, counts.tolist()):
+            if count:
+                summary.setdefault(name, dict.fromkeys(CHANGES, 0))[change] += count
+    return summary
+
+
+def diff_cocos(old, new, key: str = "content", details: bool = False, precision: int = None) -> dict:
+    """
+    This function compares two coco versions record by record. Images are keyed by file_name and annotations by
+    (image file name, category name, bbox), or both by id, so renumbered ids do not count as changes. Every record
+    is hashed once; records with the same key and a different hash are modified. Json file paths are streamed in
+    bounded memory, dictionaries are compared as they are.
+
+        @param old: Old coco json dictionary or json file path
+        @param new: New coco json dictionary or json file path
+        @param key: "content" or "id", see above
+        @param details: If it's True also return the changed records, file paths are streamed once more for them
+        @param precision: Digits after the decimal point of bbox values in annotation keys, None for exact values
+        @return: Json serializable report with added, removed, modified and unchanged counts of images and
+         annotations, added, removed and modified category names and per category annotation changes
+    """
+    start = time.perf_counter()
+    old_snapshot = Snapshot(old, key, precision)
+    new_snapshot = Snapshot(new, key, precision)
+    images = _compare(
+        old_snapshot.image_keys, old_snapshot.image_contents, new_snapshot.image_keys, new_snapshot.image_contents
+    )
+    annotations = _compare(
+        old_snapshot.ann_keys, old_snapshot.ann_contents, new_snapshot.ann_keys, new_snapshot.ann_contents
+    )
+
+    old_categories, new_categories = old_snapshot.category_records, new_snapshot.category_records
+    report = {
+        "key": key,
+        "images": {change: len(images[change]) for change in ("added", "removed")},
+        "annotations": {change: len(annotations[change]) for change in ("added", "removed")},
+        "categories": {
+            "added": [name for name in new_categories if name not in old_categories],
+            "removed": [name for name in old_categories if name not in new_categories],
+            "modified": [
+                name for name, cat in new_categories.items() if name in old_categories and old_categories[name] != cat
+            ],
+        },
+        "per_category": _category_summary(old_snapshot, new_snapshot, annotations),
+    }
+    for section, changes in (("images", images), ("annotations", annotations)):
+        report[section]["modified"] = len(changes["modified"][0])
+        report[section]["unchanged"] = changes["unchanged"]
+    if details:
+        report["changes"] = {
+            "images": _changed_records(old_snapshot, new_snapshot, "images", images),
+            "annotations": _changed_records(old_snapshot, new_snapshot, "annotations", annotations),
+        }
+    changed = [report[section][change] for section in ("images", "annotations", "categories") for change in CHANGES]
+    report["identical"] = not any(changed)
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def add_arguments(parser):
+    """
+    @param parser: argparse parser of diff command
+    """
+    parser.add_argument("old", type=str, help="path to old coco json file")
+    parser.add_argument("new", type=str, help="path to new coco json file")
+    parser.add_argument("--key", choices=DIFF_KEYS, default="content", help="match records by content or by id")
+    parser.add_argument("--details", action="store_true", help="also list changed records")
+    parser.add_argument("--precision", type=int, default=None, help="round bbox values in keys to this many digits")
+    parser.add_argument("--indexed", action="store_true", help="load both files instead of streaming them")
+    parser.add_argument("--output", type=str, default=None, help="write json report to this file instead of stdout")
+
+
+def run(args) -> int:
+    """
+    This function compares two coco json files from parsed command line arguments and prints or writes the report.
+
+        @param args: Parsed arguments, see add_arguments
+        @return: Exit code, 0 if versions are identical else 1
+    """
+    from coco_toolkit.helper.preprocess import PreProcess
+
+    report = PreProcess.compare_two_annotations(
+        args.old, args.new, key=args.key, details=args.details, streaming=not args.indexed, precision=args.precision
+    )
+    text = json.dumps(report, indent=2, default=str)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+    return 0 if report["identical"] else 1
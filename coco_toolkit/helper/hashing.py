@@ -0,0 +1,151 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from coco_toolkit.helper.cache import file_hash
+from coco_toolkit.helper.copier import DEFAULT_WORKERS
+
+CONTENT_HASH_CACHE = "content_hashes"
+
+# Set COCO_TOOLKIT_CACHE_DIR to keep hash caches somewhere else than the user cache folder
+CACHE_DIR_ENV = "COCO_TOOLKIT_CACHE_DIR"
+
+
+def cache_dir() -> str:
+    """
+    @return: Folder of hash caches, COCO_TOOLKIT_CACHE_DIR or coco_toolkit inside XDG_CACHE_HOME (~/.cache)
+    """
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "coco_toolkit")
+
+
+def hash_cache_path(image_path: str, name: str = CONTENT_HASH_CACHE) -> str:
+    """
+    Caches are kept out of the image folder so listing or copying the folder never picks them up.
+
+    @param image_path: Image folder path
+    @param name: Cache kind
+    @return: Hash cache file path of given image folder inside cache_dir
+    """
+    folder = hashlib.blake2b(os.path.abspath(image_path).encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir(), f"{name}-{folder}.json")
+
+
+class HashCache:
+    """
+    Json file of {absolute path: [size, mtime_ns, hash]} so unchanged files are never hashed twice.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        @param path: Cache file path, an in memory cache if it's None
+        """
+        self.path = path
+        self.entries: dict = {}
+        self.changed = False
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                logging.getLogger().warning(f"Ignoring unreadable hash cache {path}")
+
+    def get(self, path: str, stat: os.stat_result):
+        """
+        @param path: File path
+        @param stat: Current stat of file
+        @return: Cached hash if file size and modification time did not change, else None
+        """
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def put(self, path: str, stat: os.stat_result, value):
+        self.entries[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, value]
+        self.changed = True
+
+    def save(self):
+        """
+        This function writes the cache atomically if it changed. Failures are logged and ignored.
+        """
+        if self.path is None or not self.changed:
+            return
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.changed = False
+        except OSError as e:
+            logging.getLogger().warning(f"Could not write hash cache {self.path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def cached_hashes(
+    paths: list,
+    hash_function,
+    cache: HashCache,
+    executor_class=ThreadPoolExecutor,
+    workers: int = None,
+    progress: bool = True,
+    desc: str = "Hashing images",
+) -> dict:
+    """
+    This function hashes files in parallel. Files whose size and modification time match the cache are not read.
+    Missing or unreadable files are left out of the result.
+
+        @param paths: File paths
+        @param hash_function: Picklable function taking a path and returning its hash
+        @param cache: Hash cache, saved at the end
+        @param executor_class: ThreadPoolExecutor for I/O bound hashes, ProcessPoolExecutor for CPU bound ones
+        @param workers: Worker count, DEFAULT_WORKERS if it's None
+        @param progress: If it's True show a progress bar
+        @param desc: Progress bar description
+        @return: Dictionary of {path: hash}
+    """
+    hashes, todo = {}, []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        value = cache.get(path, stat)
+        if value is None:
+            todo.append((path, stat))
+        else:
+            hashes[path] = value
+
+    if todo:
+        with executor_class(max_workers=workers or DEFAULT_WORKERS) as executor:
+            futures = [(path, stat, executor.submit(hash_function, path)) for path, stat in todo]
+            for path, stat, future in tqdm(futures, desc=desc, disable=not progress):
+                try:
+                    value = future.result()
+                except (OSError, ValueError) as e:
+                    logging.getLogger().error(f"Could not hash {path}: {e}")
+                    continue
+                hashes[path] = value
+                cache.put(path, stat, value)
+    cache.save()
+    return hashes
+
+
+def content_hashes(paths: list, cache_path: str = None, workers: int = None, progress: bool = True) -> dict:
+    """
+    This function computes blake2b digests of file contents with a thread pool.
+
+        @param paths: File paths
+        @param cache_path: Hash cache file, no cache if it's None
+        @param workers: Thread count, DEFAULT_WORKERS if it's None
+        @param progress: If it's True show a progress bar
+        @return: Dictionary of {path: hex digest}
+    """
+    return cached_hashes(paths, file_hash, HashCache(cache_path), workers=workers, progress=progress)
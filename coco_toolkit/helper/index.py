@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+
+class CocoIndex:
+    """
+    Lookup tables over a coco json dictionary, built once in a single pass.
+    """
+
+    def __init__(self, coco: dict):
+        """
+        @param coco: Coco json file to be indexed
+        """
+        self.coco = coco
+        self.fingerprint = CocoIndex.make_fingerprint(coco)
+
+        self.image_annotations: dict = defaultdict(list)
+        self.category_annotations: dict = defaultdict(list)
+        self.images_by_id: dict = {}
+        self.images_by_file_name: dict = {}
+        self.categories_by_id: dict = {}
+
+        for position, ann in enumerate(coco.get("annotations", [])):
+            self.image_annotations[ann["image_id"]].append(position)
+            self.category_annotations[ann["category_id"]].append(position)
+        for img in coco.get("images", []):
+            self.images_by_id[img["id"]] = img
+            self.images_by_file_name[img["file_name"]] = img
+        for cat in coco.get("categories", []):
+            self.categories_by_id[cat["id"]] = cat
+
+    @staticmethod
+    def make_fingerprint(coco: dict) -> tuple:
+        """
+        This function returns a cheap identity of the indexed lists. A list replaced by a new one or
+        grown/shrunk in place changes the fingerprint.
+
+            @param coco: Coco json file
+            @return: Tuple of (id, length) pairs for images, annotations and categories
+        """
+        fingerprint = []
+        for key in ("images", "annotations", "categories"):
+            items = coco.get(key, [])
+            fingerprint += [id(items), len(items)]
+        return tuple(fingerprint)
+
+    def is_stale(self, coco: dict) -> bool:
+        """
+        This function checks whether the index no longer describes the given coco json file.
+
+            @param coco: Coco json file
+            @return: True if the index must be rebuilt
+        """
+        return coco is not self.coco or CocoIndex.make_fingerprint(coco) != self.fingerprint
+
+    def annotations_of_image(self, image_id) -> list:
+        """
+        @param image_id: Image id
+        @return: Annotations of given image
+        """
+        annotations = self.coco["annotations"]
+        return [annotations[position] for position in self.image_annotations.get(image_id, [])]
+
+    def annotations_of_category(self, category_id) -> list:
+        """
+        @param category_id: Category id
+        @return: Annotations of given category
+        """
+        annotations = self.coco["annotations"]
+        return [annotations[position] for position in self.category_annotations.get(category_id, [])]
+
+    def image_of_annotation(self, ann: dict):
+        """
+        @param ann: Annotation
+        @return: Image of given annotation or None if image id does not exist
+        """
+        return self.images_by_id.get(ann["image_id"])
+
+
+def get_index(owner, coco: dict) -> CocoIndex:
+    """
+    This function returns the index cached on owner, rebuilding it when the coco json file changed.
+
+        @param owner: Object that keeps the index in its "_index" attribute
+        @param coco: Coco json file
+        @return: Up to date index of coco json file
+    """
+    index = getattr(owner, "_index", None)
+    if index is None or index.is_stale(coco):
+        index = CocoIndex(coco)
+        owner._index = index
+    return index
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+
+from coco_toolkit.helper.cache import load_coco
+from coco_toolkit.helper.writer import encode, save_coco
+
+JOURNAL_VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_SECTIONS = ("images", "annotations", "categories")
+JOURNAL_OPS = ("add", "remove", "modify")
+
+# Annotation fields that refer to removed images and categories
+_CASCADES = {"images": "image_id", "categories": "category_id"}
+
+
+def journal_path(path: str) -> str:
+    """
+    @param path: Coco json file path
+    @return: Journal file path of given json file
+    """
+    return path + JOURNAL_SUFFIX
+
+
+def _base_identity(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class Journal:
+    """
+    Append only log of edits next to a coco json file, one json line per operation. The first line records the size
+    and modification time of the base file, a journal whose base file changed afterwards is refused. A last line cut
+    by a crash is ignored.
+    """
+
+    def __init__(self, path: str):
+        """
+        @param path: Coco json file path, the journal is path + ".journal"
+        """
+        self.path = path
+        self.journal_path = journal_path(path)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.journal_path)
+
+    def append(self, ops: list):
+        """
+        This function appends operations with a single write, the base file is not read.
+
+            @param ops: List of operation dicts, see add, remove and modify
+        """
+        for op in ops:
+            if op.get("op") not in JOURNAL_OPS or op.get("section") not in JOURNAL_SECTIONS:
+                raise ValueError(f"Invalid journal operation {op}")
+            if (op["item"] if op["op"] == "add" else op).get("id") is None:
+                raise ValueError(f"Journal operation without id {op}")
+        lines = [encode(op) + b"\n" for op in ops]
+        if not self.exists():
+            header = dict(_base_identity(self.path), journal=JOURNAL_VERSION)
+            lines.insert(0, encode(header) + b"\n")
+        with open(self.journal_path, "ab") as f:
+            f.write(b"".join(lines))
+
+    def add(self, section: str, item: dict):
+        """
+        @param section: "images", "annotations" or "categories"
+        @param item: New record, a record with the same id is replaced
+        """
+        self.append([{"op": "add", "section": section, "item": item}])
+
+    def remove(self, section: str, item_id):
+        """
+        @param section: "images", "annotations" or "categories"
+        @param item_id: Id of record to be removed, annotations of a removed image or category are removed too
+        """
+        self.append([{"op": "remove", "section": section, "id": item_id}])
+
+    def modify(self, section: str, item_id, fields: dict):
+        """
+        @param section: "images", "annotations" or "categories"
+        @param item_id: Id of record to be modified
+        @param fields: Dictionary of {field: new value}
+        """
+        self.append([{"op": "modify", "section": section, "id": item_id, "fields": fields}])
+
+    def read(self) -> list:
+        """
+        @return: List of operations in order, empty if there is no journal
+        """
+        if not self.exists():
+            return []
+        with open(self.journal_path, "rb") as f:
+            lines = f.read().split(b"\n")
+        # Text after the last newline is an unfinished append
+        if lines[-1]:
+            logging.getLogger().warning(f"Ignoring unfinished last line of {self.journal_path}")
+        lines = [line for line in lines[:-1] if line.strip()]
+        if not lines:
+            return []
+        header = json.loads(lines[0])
+        if header.get("journal") != JOURNAL_VERSION:
+            raise ValueError(f"Unknown journal version in {self.journal_path}")
+        if {key: header.get(key) for key in ("size", "mtime_ns")} != _base_identity(self.path):
+            raise ValueError(
+                f"{self.path} changed after {self.journal_path} was started, compact or remove the journal first"
+            )
+        return [json.loads(line) for line in lines[1:]]
+
+    def discard(self):
+        """
+        This function removes the journal without applying it.
+        """
+        if self.exists():
+            os.remove(self.journal_path)
+
+
+class Patch:
+    """
+    Operations of a journal folded into their final effect per record, so they are applied in one pass over any
+    record stream.
+    """
+
+    def __init__(self, ops: list):
+        """
+        @param ops: Journal operations in order
+        """
+        # {section: {id: ("add", item) | ("modify", fields) | ("remove", None)}}, dicts keep first operation order
+        self.changes: dict = {section: {} for section in JOURNAL_SECTIONS}
+        for op in ops:
+            changes = self.changes[op["section"]]
+            if op["op"] == "add":
+                item_id = op["item"]["id"]
+                changes.pop(item_id, None)
+                changes[item_id] = ("add", dict(op["item"]))
+                continue
+            previous = changes.get(op["id"])
+            if op["op"] == "remove":
+                changes[op["id"]] = ("remove", None)
+            elif previous is None:
+                changes[op["id"]] = ("modify", dict(op["fields"]))
+            elif previous[0] != "remove":
+                previous[1].update(op["fields"])
+        self.removed = {
+            section: {item_id for item_id, (kind, _) in self.changes[section].items() if kind == "remove"}
+            for section in _CASCADES
+        }
+        self.unmatched = 0
+
+    def patch(self, section: str, item: dict, seen: set):
+        """
+        @param section: Section of item
+        @param item: Record of base file
+        @param seen: Ids of given section patched so far
+        @return: Patched record, None if it is removed
+        """
+        change = self.changes[section].get(item.get("id"))
+        if change is not None:
+            seen.add(item["id"])
+            kind, value = change
+            if kind == "remove":
+                return None
+            item = value if kind == "add" else dict(item, **value)
+        if section == "annotations" and self._cascaded(item):
+            return None
+        return item
+
+    def _cascaded(self, ann: dict) -> bool:
+        """
+        @return: True if annotation refers to an image or category removed by the journal
+        """
+        return any(ann.get(field) in self.removed[referred] for referred, field in _CASCADES.items())
+
+    def added(self, section: str, seen: set) -> list:
+        """
+        @param section: Section to be finished
+        @param seen: Ids of given section that were in base file
+        @return: Records added by the journal that were not in base file, in journal order
+        """
+        items = []
+        for item_id, (kind, value) in self.changes[section].items():
+            if item_id in seen:
+                continue
+            if kind == "add":
+                if not (section == "annotations" and self._cascaded(value)):
+                    items.append(value)
+            else:
+                self.unmatched += 1
+        return items
+
+    def apply(self, coco: dict) -> dict:
+        """
+        This function applies the patch to a loaded coco json file in place.
+
+            @param coco: Coco json file
+            @return: Given coco json file
+        """
+        for section in JOURNAL_SECTIONS:
+            cascades = section == "annotations" and any(self.removed.values())
+            if not self.changes[section] and not cascades:
+                continue
+            seen: set = set()
+            items = [self.patch(section, item, seen) for item in coco.get(section, [])]
+            coco[section] = [item for item in items if item is not None] + self.added(section, seen)
+        self._log()
+        return coco
+
+    def iter_items(self, stream, keys=None):
+        """
+        This function applies the patch to a (top level key, item) stream such as iter_coco. Added records follow
+        the last record of their section, or come at the end if the section is not in the stream.
+
+            @param stream: Generator of (top level key, item) tuples
+            @param keys: Top level keys of the stream, None for all keys
+            @return: Generator of patched (top level key, item) tuples
+        """
+        pending = [section for section in JOURNAL_SECTIONS if keys is None or section in keys]
+        current, seen = None, set()
+        for key, item in stream:
+            if key != current:
+                if current in pending:
+                    pending.remove(current)
+                    yield from ((current, added) for added in self.added(current, seen))
+                current, seen = key, set()
+            if key in JOURNAL_SECTIONS:
+                item = self.patch(key, item, seen)
+                if item is None:
+                    continue
+            yield key, item
+        if current in pending:
+            pending.remove(current)
+            yield from ((current, added) for added in self.added(current, seen))
+        for section in pending:
+            yield from ((section, added) for added in self.added(section, set()))
+        self._log()
+
+    def _log(self):
+        if self.unmatched:
+            logging.getLogger().warning(f"{self.unmatched} journal operations refer to records that do not exist")
+            self.unmatched = 0
+
+
+def compact(path: str, precision: int = None) -> int:
+    """
+    This function folds the journal into the base file: the base file is loaded, patched and written to a temporary
+    file that atomically replaces it, then the journal is removed.
+
+        @param path: Coco json file path
+        @param precision: If it's given round bbox and segmentation values to this many digits
+        @return: Count of folded operations
+    """
+    journal = Journal(path)
+    ops = journal.read()
+    if not ops:
+        journal.discard()
+        return 0
+    coco = Patch(ops).apply(load_coco(path))
+    tmp_path = f"{path}.tmp-{os.getpid()}{os.path.splitext(path)[1]}"
+    try:
+        save_coco(coco, tmp_path, precision=precision)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    journal.discard()
+    return len(ops)
@@ -1,14 +1,22 @@
 import datetime
 import os
-import shutil
 
 from tqdm import tqdm
 
+from coco_toolkit.helper.copier import copy_images
 from coco_toolkit.helper.preprocess import PreProcess
 from coco_toolkit.helper.report import AnalyzeCategories
 
 
-def merge_multiple_cocos(*args: list, merge_path: str, first_id: int, visualizer: bool):
+def merge_multiple_cocos(
+    *args: list,
+    merge_path: str,
+    first_id: int,
+    visualizer: bool,
+    compression: str = None,
+    workers: int = None,
+    materialize: str = "copy",
+):
     """
     This function merge all given datasets and save to a new folder with annotation and images.
         @param args:  This parameter contains lists which has two indexes.These lists contain json path
@@ -18,6 +26,10 @@ def merge_multiple_cocos(*args: list, merge_path: str, first_id: int, visualizer
         @param merge_path: Path of output folder directory
         @param first_id: Value of first id
         @param visualizer: If it's True visualize categories with pie chart
+        @param compression: If it's "gz", "bz2", "xz" or "zst" save merged json file compressed
+        @param workers: Thread count of image copy, DEFAULT_WORKERS if it's None
+        @param materialize: "copy", "hardlink", "symlink", "reflink" or "manifest" (only list images in
+         manifest.tsv)
         @return:  Merge data and save to given directory
     """
     merged = {
@@ -41,11 +53,10 @@ def merge_multiple_cocos(*args: list, merge_path: str, first_id: int, visualizer
     for index, path in enumerate(tqdm(args)):
         json_path = path[0]
         image_path = path[1]
-        coco = PreProcess.reader(json_path)
+        coco = PreProcess.reader(json_path, plain=True)
         preprocess = PreProcess(coco)
         preprocess.check_id_unique()
-        preprocess.set_unique_image_id(first_id=first_id * (index + 1))
-        preprocess.set_unique_annotation_id(first_id=first_id * (index + 1))
+        preprocess.renumber(image_first_id=first_id * (index + 1), annotation_first_id=first_id * (index + 1))
 
         list_dir.append(os.listdir(image_path))
 
@@ -71,13 +82,12 @@ def merge_multiple_cocos(*args: list, merge_path: str, first_id: int, visualizer
             merged["categories"] += categories
             categories = []
 
-        for image in list_dir[0]:
-            shutil.copy(image_path + f"/{image}", merged_path_img + f"/{image}")
+        copy_images(list_dir[0], image_path, merged_path_img, workers=workers, materialize=materialize).check()
         list_dir = []
 
     preprocess = PreProcess(merged)
     preprocess.set_unique_class_id(first_id=0, back_grounds=True)
-    preprocess.save_coco_file(directory=merged_path_ann, file_name="merge")
+    preprocess.save_coco_file(directory=merged_path_ann, file_name="merge", compression=compression)
     a = AnalyzeCategories(preprocess.coco)
     a.total_class_count()
     a.plot_class_pie_chart(visualizer)
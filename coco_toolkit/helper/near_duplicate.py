@@ -0,0 +1,141 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from coco_toolkit.helper.hashing import HashCache, cached_hashes, hash_cache_path
+
+HASH_SIZE = 8
+DEFAULT_RADIUS = 4
+
+
+def perceptual_hash_cache(image_path: str, hash_size: int = HASH_SIZE) -> str:
+    """
+    @param image_path: Image folder path
+    @param hash_size: Hash size the cache holds
+    @return: Perceptual hash cache file path of given image folder, outside of it
+    """
+    return hash_cache_path(image_path, f"dhash{hash_size}")
+
+
+def dhash(path: str, hash_size: int = HASH_SIZE) -> int:
+    """
+    This function computes the difference hash of an image: the image is shrunk to (hash_size + 1) x hash_size gray
+    pixels and every bit tells whether a pixel is brighter than its right neighbour. Jpeg images are decoded at a
+    reduced scale, so big frames cost a fraction of a full decode.
+
+        @param path: Image file path
+        @param hash_size: Hash is hash_size * hash_size bits
+        @return: Hash as integer
+    """
+    with Image.open(path) as img:
+        img.draft("L", ((hash_size + 1) * 4, hash_size * 4))
+        pixels = np.asarray(img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+class _SizedHash:
+    """
+    Picklable dhash with a fixed hash size.
+    """
+
+    def __init__(self, hash_size: int):
+        self.hash_size = hash_size
+
+    def __call__(self, path: str) -> int:
+        return dhash(path, self.hash_size)
+
+
+def hamming(a: int, b: int) -> int:
+    """
+    @return: Count of differing bits of two hashes
+    """
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of hashes under Hamming distance. A radius search only visits children whose edge distance
+    is within radius of the query distance, so it is far below a linear scan for small radii.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, item):
+        """
+        @param value: Hash
+        @param item: Payload returned by search
+        """
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, radius: int) -> list:
+        """
+        @param value: Hash to be searched
+        @param radius: Largest Hamming distance
+        @return: List of (item, distance) tuples within radius
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.append((node[1], distance))
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def image_hashes(paths: list, hash_size: int = HASH_SIZE, cache_path: str = None, workers: int = None) -> dict:
+    """
+    This function computes perceptual hashes of images with a process pool.
+
+        @param paths: Image file paths
+        @param hash_size: Hash is hash_size * hash_size bits
+        @param cache_path: Hash cache file, no cache if it's None
+        @param workers: Process count, os.cpu_count() if it's None
+        @return: Dictionary of {path: hash}
+    """
+    return cached_hashes(
+        paths,
+        _SizedHash(hash_size),
+        HashCache(cache_path),
+        executor_class=ProcessPoolExecutor,
+        workers=workers or os.cpu_count(),
+        desc="Perceptual hashing",
+    )
+
+
+def near_duplicates(hashes: list, radius: int = DEFAULT_RADIUS) -> dict:
+    """
+    This function finds near duplicates greedily in the given order. An item whose hash is within radius of an
+    already kept item is its duplicate, otherwise it is kept and indexed.
+
+        @param hashes: List of (item, hash) tuples, e.g. frames in capture order
+        @param radius: Largest Hamming distance of near duplicates
+        @return: Dictionary of {duplicate item: kept item}
+    """
+    tree = BKTree()
+    duplicates = {}
+    for item, value in hashes:
+        matches = tree.search(value, radius)
+        if matches:
+            duplicates[item] = min(matches, key=lambda match: match[1])[0]
+        else:
+            tree.add(value, item)
+    return duplicates
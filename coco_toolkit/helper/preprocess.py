@@ -1,16 +1,49 @@
 import datetime
 import glob
 import hashlib
-import json
 import logging
 import os
-import random
-import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 from addict import Dict
-from tqdm import tqdm
+
+from coco_toolkit.helper.bbox import BBOX_ACTIONS, bbox_array, check_bboxes, clip_bboxes
+from coco_toolkit.helper.cache import load_coco
+from coco_toolkit.helper.categories import remap_category_ids, remap_table
+from coco_toolkit.helper.compression import open_file
+from coco_toolkit.helper.copier import DEFAULT_WORKERS, MATERIALIZE_MODES, copy_files, copy_images
+from coco_toolkit.helper.diff import diff_cocos
+from coco_toolkit.helper.hashing import content_hashes, hash_cache_path
+from coco_toolkit.helper.index import CocoIndex, get_index
+from coco_toolkit.helper.journal import Journal, Patch, compact
+from coco_toolkit.helper.near_duplicate import (
+    DEFAULT_RADIUS,
+    HASH_SIZE,
+    image_hashes,
+    near_duplicates,
+    perceptual_hash_cache,
+)
+from coco_toolkit.helper.reduce import PairCounter, top_k_per_category
+from coco_toolkit.helper.split import (
+    SPLIT_NAMES,
+    build_subsets,
+    class_ratio_deviation,
+    group_assignment,
+    group_keys,
+    random_assignment,
+    split_sizes,
+    stratified_assignment,
+)
+from coco_toolkit.helper.stream import iter_coco
+from coco_toolkit.helper.table import AnnotationTable, renumber_map
+from coco_toolkit.helper.validate import scan_image_folder, validate_dataset
+from coco_toolkit.helper.writer import encode, save_coco
+
+
+RENAME_JOURNAL = "rename_journal.tsv"
 
 
 class PreProcess:
@@ -23,72 +56,168 @@ class PreProcess:
         @param coco: Coco json file to be processed
         """
         self.coco = coco.copy()
+        self._index = None
+
+    @property
+    def index(self) -> CocoIndex:
+        """
+        Annotation index of coco json file. It is rebuilt lazily when images, annotations or categories change.
+        """
+        return get_index(self, self.coco)
+
+    def invalidate_index(self):
+        """
+        This function drops the cached index. Call it after editing ids or file names in place.
+        """
+        self._index = None
 
     @staticmethod
-    def reader(path: str) -> Dict:
+    def reader(path: str, cache: bool = True, plain: bool = False, journal: bool = True) -> Dict:
         """
         This function read coco json file as a dictionary.
 
-            @param path: Coco json file path to be read
+            @param path: Coco json file path to be read, may be compressed (.gz, .bz2, .xz, .zst)
+            @param cache: If it's False do not use or write the binary sidecar cache of big json files
+            @param plain: If it's True return plain dicts and lists instead of wrapping every nested dict in addict
+             Dict. Plain dicts load and index several times faster, bulk pipelines use this.
+            @param journal: If it's True apply the edits of the patch journal next to json file, if there is any
             @return: Return coco json file as a dictionary
         """
         log = logging.getLogger()
         assert os.path.isfile(path), log.error(" Invalid json file path.Please check your directory")
 
-        with open(path) as f:
-            cfg = json.load(f)
-            return Dict(cfg)
+        cfg = load_coco(path, cache=cache)
+        ops = Journal(path).read() if journal else []
+        if ops:
+            cfg = Patch(ops).apply(cfg)
+        return cfg if plain else Dict(cfg)
 
-    def set_unique_image_id(self, first_id: int):
+    @staticmethod
+    def stream(path: str, keys=None, journal: bool = True):
         """
-        This function changes all images id.
+        This function reads coco json file incrementally with bounded memory, for one pass jobs.
 
-            @param first_id: First image id value
+            @param path: Coco json file path to be read
+            @param keys: Top level keys to be yielded such as ("annotations",), None for all keys
+            @param journal: If it's True apply the edits of the patch journal next to json file, if there is any
+            @return: Generator of (top level key, item) tuples, one per image, annotation, category ...
         """
+        log = logging.getLogger()
+        assert os.path.isfile(path), log.error(" Invalid json file path.Please check your directory")
 
-        old_dic: dict = {}
+        ops = Journal(path).read() if journal else []
+        if ops:
+            return Patch(ops).iter_items(iter_coco(path, keys=keys), keys=keys)
+        return iter_coco(path, keys=keys)
 
-        for img in self.coco["images"]:
-            old_dic[first_id] = img["id"]
-            first_id += 1
+    @staticmethod
+    def journal(path: str) -> Journal:
+        """
+        This function opens the append only patch journal of a coco json file. Adding, removing or modifying images,
+        annotations and categories appends a line to path + ".journal" and costs the size of the edit, the json file
+        is not read or written. reader and stream apply the journal, compact_journal folds it into the json file.
 
-        new_dict = dict([(value, key) for key, value in old_dic.items()])
+            @param path: Coco json file path
+            @return: Journal with add, remove, modify and append (a list of operations) functions
+        """
+        return Journal(path)
 
-        for img in self.coco["images"]:
-            img["id"] = new_dict[img["id"]]
-        for ann in self.coco["annotations"]:
-            ann["image_id"] = new_dict[ann["image_id"]]
+    @staticmethod
+    def compact_journal(path: str, precision: int = None) -> int:
+        """
+        This function folds the patch journal into the coco json file, which is rewritten once and atomically.
 
-    def set_unique_class_id(self, first_id: int, back_grounds: bool):
+            @param path: Coco json file path
+            @param precision: If it's given round bbox and segmentation values to this many digits
+            @return: Count of folded operations
         """
-        This function changes all class' id.
+        count = compact(path, precision=precision)
+        logging.getLogger().setLevel(logging.INFO)
+        logging.info(f"Folded {count} journal operations into {path}")
+        return count
 
-            @param first_id: First class id value
-            @param back_grounds: Boolean variable. İf it's True add background to class
+    def to_table(self) -> AnnotationTable:
         """
-        old_dic = {}
-        check_bg: list = []
+        This function returns annotations of coco json file in columnar form.
 
-        backgrounds = {"id": 0, "name": "Background", "supercategory": ""}
+            @return: Annotation table
+        """
+        return AnnotationTable.from_annotations(self.coco["annotations"])
 
-        if back_grounds:
-            for cat in self.coco["categories"]:
-                if cat["name"] == "Background" or cat["name"] == "background":
-                    check_bg.append(1)
-            if not check_bg:
-                self.coco["categories"].insert(0, backgrounds)
+    def from_table(self, table: AnnotationTable):
+        """
+        This function replaces annotations of coco json file with the rows of given table.
 
-        for cat in self.coco["categories"]:
-            old_dic[first_id] = cat["id"]
-            first_id += 1
+            @param table: Annotation table
+        """
+        self.coco["annotations"] = table.to_annotations()
 
-        new_dict = dict([(value, key) for key, value in old_dic.items()])
+    def renumber(
+        self,
+        image_first_id: int = None,
+        annotation_first_id: int = None,
+        class_first_id: int = None,
+        back_grounds: bool = False,
+    ):
+        """
+        This function gives images, annotations and classes consecutive ids in one call. Remap tables are built with
+        array operations and all annotation references are rewritten in a single pass. Id spaces whose first id is
+        None are left as they are.
+
+            @param image_first_id: First image id value
+            @param annotation_first_id: First annotation id value
+            @param class_first_id: First class id value
+            @param back_grounds: Boolean variable. İf it's True add background to class, used with class_first_id
+        """
+        annotations = self.coco["annotations"]
+        image_ids = category_ids = None
+
+        if image_first_id is not None:
+            images = self.coco["images"]
+            new_ids, remap_images = renumber_map([img["id"] for img in images], image_first_id)
+            for img, new_id in zip(images, new_ids):
+                img["id"] = new_id
+            image_ids = remap_images([ann["image_id"] for ann in annotations])
+
+        if class_first_id is not None:
+            if back_grounds:
+                names = [cat["name"] for cat in self.coco["categories"]]
+                if "Background" not in names and "background" not in names:
+                    self.coco["categories"].insert(0, {"id": 0, "name": "Background", "supercategory": ""})
+            categories = self.coco["categories"]
+            new_ids, remap_categories = renumber_map([cat["id"] for cat in categories], class_first_id)
+            for cat, new_id in zip(categories, new_ids):
+                cat["id"] = new_id
+            category_ids = remap_categories([ann["category_id"] for ann in annotations])
+
+        # Single pass writing every changed reference
+        next_id = annotation_first_id
+        for position, ann in enumerate(annotations):
+            if next_id is not None:
+                ann["id"] = next_id
+                next_id += 1
+            if image_ids is not None:
+                ann["image_id"] = image_ids[position]
+            if category_ids is not None:
+                ann["category_id"] = category_ids[position]
+        self.invalidate_index()
 
-        for cat in self.coco["categories"]:
-            cat["id"] = new_dict[cat["id"]]
+    def set_unique_image_id(self, first_id: int):
+        """
+        This function changes all images id.
 
-        for ann in self.coco["annotations"]:
-            ann["category_id"] = new_dict[ann["category_id"]]
+            @param first_id: First image id value
+        """
+        self.renumber(image_first_id=first_id)
+
+    def set_unique_class_id(self, first_id: int, back_grounds: bool):
+        """
+        This function changes all class' id.
+
+            @param first_id: First class id value
+            @param back_grounds: Boolean variable. İf it's True add background to class
+        """
+        self.renumber(class_first_id=first_id, back_grounds=back_grounds)
 
     def set_unique_annotation_id(self, first_id: int):
         """
@@ -96,60 +225,131 @@ class PreProcess:
 
             @param first_id: First annotation id value
         """
+        self.renumber(annotation_first_id=first_id)
 
-        for ann in self.coco["annotations"]:
-            ann["id"] = first_id
-            first_id += 1
+    @staticmethod
+    def _duplicate_positions(ids: list, fail_fast: bool) -> dict:
+        """
+        @param ids: Ids in item order
+        @param fail_fast: If it's True stop at the first duplicate
+        @return: Dictionary of duplicate id to all of its positions
+        """
+        if len(set(ids)) == len(ids):
+            return {}
+        first_position: dict = {}
+        duplicates: dict = {}
+        for position, id_ in enumerate(ids):
+            if id_ not in first_position:
+                first_position[id_] = position
+                continue
+            if id_ not in duplicates:
+                duplicates[id_] = [first_position[id_]]
+            duplicates[id_].append(position)
+            if fail_fast:
+                break
+        return duplicates
 
-    def check_id_unique(self):
+    @staticmethod
+    def _missing_references(references: list, ids: set, fail_fast: bool) -> dict:
         """
-        This function check all ids are unique or not if not unique return False else return True.
+        @param references: Referenced ids in annotation order
+        @param ids: Existing ids
+        @param fail_fast: If it's True stop at the first missing id
+        @return: Dictionary of missing id to positions of annotations that reference it
         """
-        log = logging.getLogger()
-        anno, image, category = [], [], []
+        if ids.issuperset(references):
+            return {}
+        missing: dict = {}
+        for position, id_ in enumerate(references):
+            if id_ not in ids:
+                missing.setdefault(id_, []).append(position)
+                if fail_fast:
+                    break
+        return missing
+
+    def id_report(self, fail_fast: bool = False) -> dict:
+        """
+        This function checks id uniqueness of images, annotations and categories and that every annotation points at
+        an existing image and category, in linear time.
 
-        for ann in self.coco["annotations"]:
-            anno.append(ann["id"])
-        for img in self.coco["images"]:
-            image.append(img["id"])
-        for cat in self.coco["categories"]:
-            category.append(cat["id"])
+            @param fail_fast: If it's True stop at the first problem
+            @return: Dictionary with "valid" flag, "duplicates" (per id space: duplicate id -> positions),
+             "missing_image" and "missing_category" (missing id -> annotation positions)
+        """
+        annotations = self.coco["annotations"]
+        report: dict = {
+            "valid": True,
+            "duplicates": {"annotation": {}, "image": {}, "category": {}},
+            "missing_image": {},
+            "missing_category": {},
+        }
+        image_ids = [img["id"] for img in self.coco["images"]]
+        category_ids = [cat["id"] for cat in self.coco["categories"]]
+
+        annotation_ids = [ann["id"] for ann in annotations]
+        for key, ids in [("annotation", annotation_ids), ("image", image_ids), ("category", category_ids)]:
+            report["duplicates"][key] = PreProcess._duplicate_positions(ids, fail_fast)
+            if report["duplicates"][key] and fail_fast:
+                report["valid"] = False
+                return report
+
+        references = [("missing_image", "image_id", image_ids), ("missing_category", "category_id", category_ids)]
+        for key, field, ids in references:
+            report[key] = PreProcess._missing_references([ann[field] for ann in annotations], set(ids), fail_fast)
+            if report[key] and fail_fast:
+                break
 
-        a = True if np.unique(anno).size == len(anno) else False
+        report["valid"] = not (
+            any(report["duplicates"].values()) or report["missing_image"] or report["missing_category"]
+        )
+        return report
 
-        b = True if np.unique(image).size == len(image) else False
+    def check_id_unique(self, references: bool = False):
+        """
+        This function check all ids are unique or not if not unique return False else return True.
 
-        c = True if np.unique(category).size == len(category) else False
+            @param references: If it's True also return False when annotations point at missing images or categories
+        """
+        log = logging.getLogger()
+        report = self.id_report()
+
+        for key, duplicates in report["duplicates"].items():
+            if duplicates:
+                log.error(f"{key} id not unique: {list(duplicates)[:10]}")
+        for key in ["missing_image", "missing_category"]:
+            if report[key]:
+                log.log(
+                    logging.ERROR if references else logging.WARNING,
+                    f"annotations point at {key.replace('_', ' ')} ids: {list(report[key])[:10]}",
+                )
 
-        if a and b and c:
-            return True
-        else:
-            for key, value in {"annotation": a, "image": b, "category": c}.items():
-                if not value:
-                    log.error(f"{key} id not unique")
-            return False
+        if references:
+            return report["valid"]
+        return not any(report["duplicates"].values())
 
-    def extract_data_by_class_name(self, categories: list, image_path: str, out_path: str):
+    def extract_data_by_class_name(
+        self, categories: list, image_path: str, out_path: str, workers: int = None, materialize: str = "copy"
+    ):
         """
         This function export coco json file and images, then save image
          and json file to new folder in given path directory
             @param categories: List of chosen categories names
             @param image_path: Image path of data set
             @param out_path: Output directory
+            @param workers: Thread count of image copy, DEFAULT_WORKERS if it's None
+            @param materialize: "copy", "hardlink", "symlink", "reflink" or "manifest" (only list images in
+             manifest.tsv)
         """
-        items, ann_items, cat_items, img_id, move_list_dir, image_list = [], [], [], [], [], []
+        items, cat_items, move_list_dir, image_list = [], [], [], []
 
         for cat in self.coco["categories"]:
             if cat["name"] in categories:
                 items.append(cat["id"])
                 cat_items.append(cat)
 
-        for ann in self.coco["annotations"]:
-            if ann["category_id"] in items:
-                ann_items.append(ann)
-                img_id.append(ann["image_id"])
-
-        img_id = set(img_id)
+        items = set(items)
+        ann_items = [ann for ann in self.coco["annotations"] if ann["category_id"] in items]
+        img_id = {ann["image_id"] for ann in ann_items}
         for img in self.coco["images"]:
             if img["id"] in img_id:
                 move_list_dir.append(img["file_name"])
@@ -164,81 +364,128 @@ class PreProcess:
         os.makedirs(img_path)
         os.makedirs(ann_path)
 
-        for image in move_list_dir:
-            shutil.copy(
-                image_path + f"/{image}",
-                img_path + f"/{image}",
-            )
+        copy_images(move_list_dir, image_path, img_path, workers=workers, materialize=materialize).check()
 
         self.coco["images"] = image_list
         self.coco["annotations"] = ann_items
         self.coco["categories"] = cat_items
 
         p = PreProcess(self.coco)
-        p.set_unique_annotation_id(first_id=1)
-        p.set_unique_annotation_id(first_id=1)
-        p.set_unique_class_id(first_id=0, back_grounds=True)
+        p.renumber(annotation_first_id=1, class_first_id=0, back_grounds=True)
         p.save_coco_file(directory=ann_path, file_name="extracted_dataset")
         logging.getLogger().setLevel(logging.INFO)
         logging.info(f"Extracted dataset created to {out_path}/extracted_dataset_{time}")
 
-    def separate_json_by_categories(self):
-
-        categories = self.coco['categories']
-        category_images = {}
-        for category in categories:
-            category_images[category['name']] = []
-        images = self.coco['images']
-        for image in images:
-            image_id = image['id']
-            file_name = image['file_name']
-            for annotation in self.coco['annotations']:
-                if annotation['image_id'] == image_id:
-                    category_id = annotation['category_id']
-                    category_name = next((cat['name'] for cat in categories if cat['id'] == category_id), None)
-                    if category_name is not None:
-                        category_images[category_name].append({'id': image_id, 'file_name': file_name})
-
-        for category_name, image_data in category_images.items():
-            with open(f"tests/output/{category_name}.json", "w") as outfile:
-                json.dump(image_data, outfile)
-
-    def change_category_name_and_id(self, object_id: int, new_id: int, new_name: str):
-        """
-        :param path: json path
+    def separate_json_by_categories(
+        self, out_path: str, full_coco: bool = False, workers: int = None, compression: str = None
+    ) -> dict:
+        """
+        This function saves image id and file name lists of every category as separate json files. Images of every
+        category are found through the annotation index and files are written concurrently. Categories sharing a
+        name are saved as "<name>_<id>.json", so no two threads write the same file.
+
+            @param out_path: Output directory, created if it does not exist
+            @param full_coco: If it's True save a coco json file per category (its images, its annotations and the
+             category itself) instead of image id and file name lists
+            @param workers: Thread count of file writing, DEFAULT_WORKERS if it's None
+            @param compression: "gz", "bz2", "xz" or "zst" to compress output files
+            @return: Dictionary of {file name without extension, the category name if it is unique: saved file path}
+        """
+        index = self.index
+        images, annotations = self.coco["images"], self.coco["annotations"]
+        image_position = {img["id"]: position for position, img in enumerate(images)}
+        # Image position of every annotation, -1 for unknown images
+        ann_images = np.array([image_position.get(ann["image_id"], -1) for ann in annotations], dtype=np.int64)
+        os.makedirs(out_path, exist_ok=True)
+        stems = [str(cat["name"]).replace(os.sep, "_") for cat in self.coco["categories"]]
+        stem_count = Counter(stems)
+        stems = [
+            f"{stem}_{cat['id']}" if stem_count[stem] > 1 else stem for stem, cat in zip(stems, self.coco["categories"])
+        ]
+        if len(set(stems)) < len(stems):
+            raise ValueError(f"Categories do not have unique file names: {sorted(stems)}")
+
+        def save(category: dict, stem: str) -> tuple:
+            positions = index.category_annotations.get(category["id"], [])
+            image_positions = np.unique(ann_images[np.asarray(positions, dtype=np.int64)])
+            category_images = [images[position] for position in image_positions[image_positions >= 0].tolist()]
+            path = os.path.join(out_path, stem + ".json" + (f".{compression}" if compression else ""))
+            if full_coco:
+                subset = {
+                    "info": self.coco.get("info", {}),
+                    "licenses": self.coco.get("licenses", []),
+                    "categories": [category],
+                    "images": category_images,
+                    "annotations": [annotations[position] for position in positions],
+                }
+                save_coco(subset, path)
+            else:
+                with open_file(path, "wb") as f:
+                    f.write(encode([{"id": img["id"], "file_name": img["file_name"]} for img in category_images]))
+            return stem, path
+
+        with ThreadPoolExecutor(max_workers=workers or DEFAULT_WORKERS) as executor:
+            return dict(executor.map(save, self.coco["categories"], stems))
+
+    def change_category_name_and_id(self, object_id: int, new_id: int, new_name: str, out_path: str = None):
+        """
         :param object_id: old category id
-        :param new_id: new category id
+        :param new_id: new category id, merged into the category if it already exists
         :param new_name: new category name
+        :param out_path: If it's given save coco json file to this path
         """
-        for category in self.coco['categories']:
-            if category['id'] == object_id:
-                category['id'] = new_id
-                category['name'] = new_name
-                break
-
-        with open("tests/output/coco_dataset_new.json", 'w') as f:
-            json.dump(self.coco, f)
+        # An unknown id changes nothing, as it always did
+        if any(cat["id"] == object_id for cat in self.coco["categories"]):
+            self.remap_categories({object_id: (new_id, new_name)})
+        if out_path is not None:
+            save_coco(self.coco, out_path)
 
-    def filter_data_by_class_name(self, categories: list, image_path: str, out_path: str):
+    def remap_categories(self, mapping: dict) -> dict:
+        """
+        This function applies a whole taxonomy mapping to categories and annotations at once. Mapping keys are old
+        category ids or names, values are None (drop category and its annotations), a new name, a new integer id,
+        an (id, name) tuple or an {"id": ..., "name": ...} dict. Categories ending up with the same id are merged, so
+        is a category given a name another one ends up with, whatever its id. A plain rename keeps the id, a new id
+        alone keeps the name of the category already holding it.
+
+            @param mapping: Dictionary of {old id or name: target}, e.g. {"car": "vehicle", "truck": "vehicle",
+             "dontcare": None, 7: (3, "person")}
+            @return: Dictionary of {old category id: new category id or None if dropped}
+        """
+        categories, id_map = remap_table(self.coco["categories"], mapping)
+        annotations = self.coco["annotations"]
+        new_ids, keep = remap_category_ids([ann["category_id"] for ann in annotations], id_map)
+        for ann, new_id in zip(annotations, new_ids):
+            ann["category_id"] = new_id
+        if not keep.all():
+            self.coco["annotations"] = [annotations[i] for i in np.flatnonzero(keep).tolist()]
+        self.coco["categories"] = categories
+        self.invalidate_index()
+        return id_map
+
+    def filter_data_by_class_name(
+        self, categories: list, image_path: str, out_path: str, workers: int = None, materialize: str = "copy"
+    ):
         """
         This function filter coco json file and images,
          then save image and json file to new folder in given path directory
             @param categories: List of chosen categories names
             @param image_path: Image path of data set
             @param out_path: Output directory
+            @param workers: Thread count of image copy, DEFAULT_WORKERS if it's None
+            @param materialize: "copy", "hardlink", "symlink", "reflink" or "manifest" (only list images in
+             manifest.tsv)
         """
-        items, ann_items, cat_items, img_id, move_list_dir, image_list = [], [], [], [], [], []
+        items, cat_items, move_list_dir, image_list = [], [], [], []
 
         for cat in self.coco["categories"]:
             if cat["name"] not in categories:
                 items.append(cat["id"])
                 cat_items.append(cat)
 
-        for ann in self.coco["annotations"]:
-            if ann["category_id"] in items:
-                ann_items.append(ann)
-                img_id.append(ann["image_id"])
-        img_id = set(img_id)
+        items = set(items)
+        ann_items = [ann for ann in self.coco["annotations"] if ann["category_id"] in items]
+        img_id = {ann["image_id"] for ann in ann_items}
         for img in self.coco["images"]:
             if img["id"] in img_id:
                 move_list_dir.append(img["file_name"])
@@ -253,20 +500,14 @@ class PreProcess:
         os.makedirs(img_path)
         os.makedirs(ann_path)
 
-        for image in move_list_dir:
-            shutil.copy(
-                image_path + f"/{image}",
-                img_path + f"/{image}",
-            )
+        copy_images(move_list_dir, image_path, img_path, workers=workers, materialize=materialize).check()
 
         self.coco["images"] = image_list
         self.coco["annotations"] = ann_items
         self.coco["categories"] = cat_items
 
         p = PreProcess(self.coco)
-        p.set_unique_annotation_id(first_id=1)
-        p.set_unique_annotation_id(first_id=1)
-        p.set_unique_class_id(first_id=0, back_grounds=True)
+        p.renumber(annotation_first_id=1, class_first_id=0, back_grounds=True)
         p.save_coco_file(directory=ann_path, file_name="filtered_dataset")
         logging.getLogger().setLevel(logging.INFO)
         logging.info(f"Filtered dataset created to {out_path}/filtered_dataset_{time}")
@@ -286,68 +527,142 @@ class PreProcess:
             if not ann["segmentation"] or ann["segmentation"] == []:
                 ann["segmentation"] = [[x1, y1, x1, (y1 + y2), (x1 + x2), (y1 + y2), (x1 + x2), y1]]
 
-    def save_coco_file(self, directory: str, file_name: str):
+    def save_coco_file(self, directory: str, file_name: str, precision: int = None, compression: str = None):
         """
-        This function saves coco json file to given directory named as given file name.
+        This function saves coco json file to given directory named as given file name. Arrays are streamed chunk
+        by chunk with compact separators, using orjson when it is installed.
 
             @param directory: The directory of coco json file to be saved
             @param file_name: The file name of coco json file to be saved
+            @param precision: If it's given round bbox and segmentation values to this many digits
+            @param compression: If it's "gz", "bz2", "xz" or "zst" save compressed as file_name.json.<compression>
         """
-        with open(os.path.join(directory, f"{file_name}.json"), "w") as fp:
-            json.dump(self.coco, fp)
+        suffix = ".json" if compression is None else f".json.{compression}"
+        save_coco(self.coco, os.path.join(directory, f"{file_name}{suffix}"), precision=precision)
 
-    def compare_two_annotations(self, path1: str, path2: str):
+    @staticmethod
+    def compare_two_annotations(
+        path1: str, path2: str, key: str = "content", details: bool = False, streaming: bool = True, precision=None
+    ) -> dict:
         """
-
-        :param path1: first path
-        :param path2: second path
+        This function reports what changed from first coco json file to second one. Images are matched by file_name
+        and annotations by (image file name, category name, bbox), or both by id, and every record is hashed once.
+            @param path1: Old coco json file path
+            @param path2: New coco json file path
+            @param key: "content" or "id"
+            @param details: If it's True also return changed records under "changes"
+            @param streaming: If it's True stream both files in bounded memory, otherwise load them first
+            @param precision: Digits after the decimal point of bbox values in annotation keys, None for exact values
+            @return: Report with added, removed, modified and unchanged counts of images and annotations, category
+             changes and per category annotation changes
         """
-        coco_file = [path1, path2]
+        old, new = (path1, path2) if streaming else (load_coco(path1), load_coco(path2))
+        report = diff_cocos(old, new, key=key, details=details, precision=precision)
 
-        for i in range(2):
-            with open(coco_file[i], "r") as f:
-                coco_data = json.load(f)
-
-            num_annotations = len(coco_data["annotations"])
-            logging.getLogger().setLevel(logging.INFO)
-            logging.info(f"The COCO dataset has {num_annotations} annotations.")
-
-    def remove_duplicate_image_name(self):
+        logging.getLogger().setLevel(logging.INFO)
+        for section in ("images", "annotations"):
+            counts = ", ".join(f"{change}: {count}" for change, count in report[section].items())
+            logging.info(f"{section.capitalize()} {counts}")
+        for change, names in report["categories"].items():
+            if names:
+                logging.info(f"Categories {change}: {names}")
+        return report
+
+    def remove_duplicate_image_name(
+        self, image_path: str = None, content: bool = False, workers: int = None, cache: bool = True
+    ):
         """
-        This function removes duplicate image names from coco json file
+        This function removes duplicate image names from coco json file. Of images sharing a file name the last one
+        is kept. With content mode images whose files are byte identical under different names are removed too,
+        keeping the first one.
+
+            @param image_path: Image folder path, needed by content mode
+            @param content: If it's True also remove images whose file content is identical to an earlier image
+            @param workers: Thread count of content hashing, DEFAULT_WORKERS if it's None
+            @param cache: If it's True keep content hashes in a cache file under the user cache folder, keyed by
+             path, size and modification time, so reruns only read new or changed files
         """
-        id_image, filename, remove_list, images, anno = [], [], [], [], []
-
-        for img in self.coco["images"]:
-            id_image.append(img["id"])
-            filename.append(img["file_name"])
-
-        seen = set()
-        dupes = [x for x in filename if x in seen or seen.add(x)]
-
-        for img in self.coco["images"]:
-            if img["file_name"] in dupes:
-                remove_list.append(img["id"])
-                dupes.remove(img["file_name"])
-
-        for img in self.coco["images"]:
-            if not img["id"] in remove_list:
-                images.append(img)
-        for ann in self.coco["annotations"]:
-            if ann["image_id"] not in remove_list:
-                anno.append(ann)
-
-        self.coco["annotations"] = anno
-        self.coco["images"] = images
+        last_position = {img["file_name"]: position for position, img in enumerate(self.coco["images"])}
+        remove_list = {
+            img["id"] for position, img in enumerate(self.coco["images"]) if last_position[img["file_name"]] != position
+        }
+        name_count = len(remove_list)
+
+        if content:
+            assert image_path is not None, "image_path is needed to compare image contents"
+            kept = [img for img in self.coco["images"] if img["id"] not in remove_list]
+            paths = [os.path.join(image_path, img["file_name"]) for img in kept]
+            cache_path = hash_cache_path(image_path) if cache else None
+            hashes = content_hashes(paths, cache_path=cache_path, workers=workers)
+            seen = set()
+            for img, path in zip(kept, paths):
+                digest = hashes.get(path)
+                if digest is None:
+                    continue
+                if digest in seen:
+                    remove_list.add(img["id"])
+                seen.add(digest)
+
+        self.coco["images"] = [img for img in self.coco["images"] if img["id"] not in remove_list]
+        self.coco["annotations"] = [ann for ann in self.coco["annotations"] if ann["image_id"] not in remove_list]
 
         logging.getLogger().setLevel(logging.INFO)
         logging.info("Deleted duplicate image count = " + str(len(remove_list)))
+        if content:
+            logging.info(f"Duplicate names: {name_count}, duplicate contents: {len(remove_list) - name_count}")
 
         if not remove_list:
             logging.info("There is no duplicate image name so coco json file did not change")
         else:
             logging.info("Duplicate names has removed")
 
+    def find_near_duplicates(
+        self,
+        image_path: str,
+        radius: int = DEFAULT_RADIUS,
+        hash_size: int = HASH_SIZE,
+        workers: int = None,
+        cache: bool = True,
+    ) -> dict:
+        """
+        This function finds near identical images (e.g. consecutive frames of a stopped vehicle) by perceptual hash.
+        Hashes are computed in a process pool and searched in a BK-tree, images are visited in coco json order and
+        the first of similar images is kept.
+
+            @param image_path: Image folder path
+            @param radius: Largest Hamming distance between hashes of near duplicates
+            @param hash_size: Hash is hash_size * hash_size bits
+            @param workers: Process count, os.cpu_count() if it's None
+            @param cache: If it's True keep hashes in a cache file under the user cache folder
+            @return: Dictionary of {duplicate image id: kept image id}
+        """
+        paths = [os.path.join(image_path, img["file_name"]) for img in self.coco["images"]]
+        cache_path = perceptual_hash_cache(image_path, hash_size) if cache else None
+        hashes = image_hashes(paths, hash_size=hash_size, cache_path=cache_path, workers=workers)
+        return near_duplicates(
+            [(img["id"], hashes[path]) for img, path in zip(self.coco["images"], paths) if path in hashes], radius
+        )
+
+    def remove_near_duplicates(
+        self,
+        image_path: str,
+        radius: int = DEFAULT_RADIUS,
+        hash_size: int = HASH_SIZE,
+        workers: int = None,
+        cache: bool = True,
+    ) -> dict:
+        """
+        This function removes near identical images and their annotations, see find_near_duplicates.
+
+            @return: Dictionary of {removed image id: kept image id}
+        """
+        duplicates = self.find_near_duplicates(image_path, radius, hash_size, workers=workers, cache=cache)
+        self.coco["images"] = [img for img in self.coco["images"] if img["id"] not in duplicates]
+        self.coco["annotations"] = [ann for ann in self.coco["annotations"] if ann["image_id"] not in duplicates]
+        logging.getLogger().setLevel(logging.INFO)
+        logging.info(f"Deleted near duplicate image count = {len(duplicates)}")
+        return duplicates
+
     @staticmethod
     def create_random_image_name(image_base_name, path):
         code = f"{path}--{image_base_name}"
@@ -355,46 +670,61 @@ class PreProcess:
         photo_uuid = hash_object.hexdigest()
         return photo_uuid + ".jpeg"
 
-    def change_image_file_names(self, image_path: str, inplace: bool):
+    def change_image_file_names(
+        self, image_path: str, inplace: bool, workers: int = None, materialize: str = "copy", out_path: str = None
+    ):
         """
-        This function change images' file name and copy them to a new folder.
+        This function change images' file name and copy them to a new folder. Files are written straight to their
+        new names by a thread pool and every finished file is appended to a journal in the output folder, so giving
+        out_path of an interrupted run resumes it.
             @param image_path: Image folder path
             @param inplace: If inplace True save coco json file to another coco json file
+            @param workers: Thread count of image copy, DEFAULT_WORKERS if it's None
+            @param materialize: "copy", "hardlink", "symlink", "reflink" or "manifest" (only list images in
+             manifest.tsv)
+            @param out_path: Output folder, a new image_name_change_<time> folder next to image folder if it's None.
+             If it has a journal of an earlier run, files listed in it are not copied again.
         """
-        time = str(datetime.datetime.now()).split(".")[0].split()
-        time = "-".join(time).replace(":", "-")
-
-        path = Path(image_path)
-        abs_path = path.parent.absolute()
-
-        os.makedirs(f"{abs_path}/image_name_change_{time}/images")
+        if out_path is None:
+            time = str(datetime.datetime.now()).split(".")[0].split()
+            time = "-".join(time).replace(":", "-")
+            out_path = f"{Path(image_path).parent.absolute()}/image_name_change_{time}"
+
+        os.makedirs(f"{out_path}/images", exist_ok=True)
+        journal_path = os.path.join(out_path, RENAME_JOURNAL)
+        done = set()
+        if os.path.isfile(journal_path):
+            with open(journal_path) as f:
+                done = {line.split("\t", 1)[0] for line in f if line.endswith("\n")}
+            logging.getLogger().setLevel(logging.INFO)
+            logging.info(f"Resuming, {len(done)} files already renamed")
 
         hashname_dict = {}
-        for index, img_path in enumerate(glob.glob(os.path.join(image_path, "*"))):
+        pairs = []
+        for img_path in glob.glob(os.path.join(image_path, "*")):
             basename = os.path.basename(img_path)
             uuid = PreProcess.create_random_image_name(basename, image_path)
             hashname_dict[basename] = uuid
-            shutil.copy(
-                img_path,
-                f"{abs_path}/image_name_change_{time}/images/{basename}",
-            )
-            os.rename(
-                f"{abs_path}/image_name_change_{time}/images/{basename}",
-                os.path.join(f"{abs_path}/image_name_change_{time}/images", uuid),
-            )
+            if basename not in done:
+                pairs.append((img_path, os.path.join(f"{out_path}/images", uuid)))
+
+        with open(journal_path, "a", buffering=1) as journal:
+            copy_files(
+                pairs,
+                workers=workers,
+                materialize=materialize,
+                on_done=lambda src, dst: journal.write(f"{os.path.basename(src)}\t{os.path.basename(dst)}\n"),
+            ).check()
 
         for image in self.coco["images"]:
-            for key, values in hashname_dict.items():
-                if image["file_name"] == str(key):
-                    image["file_name"] = values
+            image["file_name"] = hashname_dict.get(str(image["file_name"]), image["file_name"])
+        self.invalidate_index()
         if inplace:
-            os.makedirs(f"{abs_path}/image_name_change_{time}/annotations")
+            os.makedirs(f"{out_path}/annotations", exist_ok=True)
 
-            PreProcess(self.coco).save_coco_file(
-                directory=f"{abs_path}/image_name_change_{time}/annotations", file_name="image_name_change"
-            )
+            PreProcess(self.coco).save_coco_file(directory=f"{out_path}/annotations", file_name="image_name_change")
             logging.getLogger().setLevel(logging.INFO)
-        logging.info(f"New dataset folder created to {abs_path}/image_name_change_{time}")
+        logging.info(f"New dataset folder created to {out_path}")
 
     def remove_segmentation(self):
         """
@@ -403,35 +733,151 @@ class PreProcess:
         for ann in self.coco["annotations"]:
             del ann["segmentation"]
 
+    def validate_dataset(self, image_path: str, workers: int = None, verify: bool = False, progress: bool = True):
+        """
+        This function checks coco json file against its image folder: missing, orphan and corrupt files, recorded
+        width and height against image headers and annotations of unknown images. Only image headers are read.
+        Command line: python -m coco_toolkit validate coco.json images/
+
+            @param image_path: Image folder path
+            @param workers: Thread count of header reading, DEFAULT_WORKERS if it's None
+            @param verify: If it's True also check file structure of every image
+            @param progress: If it's True show a progress bar
+            @return: Json serializable report, "valid" is True when no problem is found
+        """
+        report = validate_dataset(self.coco, image_path, workers=workers, verify=verify, progress=progress)
+        logging.getLogger().setLevel(logging.INFO)
+        logging.info(
+            f"Missing files: {len(report['missing_files'])}, orphan files: {len(report['orphan_files'])}, "
+            f"corrupt files: {len(report['corrupt_files'])}, size mismatches: {len(report['size_mismatch'])}"
+        )
+        return report
+
+    def validate_bboxes(self, action: str = "repair", recompute_area: bool = False) -> dict:
+        """
+        This function checks every annotation bbox with array operations over an Nx4 array. Rules are malformed
+        (missing or not 4 numbers), not_finite (NaN or inf), non_positive_size (width or height <= 0) and
+        out_of_image (outside [0, image width] x [0, image height], only the lower bound if image size is unknown).
+
+            @param action: "report" to only count, "remove" to remove annotations breaking any rule, "repair" to clip
+             out of image bboxes to the image (area is recomputed) and remove the ones that can not be fixed
+            @param recompute_area: If it's True set area of every kept annotation to bbox width * height
+            @return: Dictionary of annotation count per rule plus "clipped" and "removed" counts
+        """
+        if action not in BBOX_ACTIONS:
+            raise ValueError(f"Unknown action {action}, choose one of {BBOX_ACTIONS}")
+        annotations = self.coco["annotations"]
+        bboxes, malformed = bbox_array(annotations)
+
+        # Image size per annotation, NaN for unknown images and sizes
+        position = {img["id"]: i for i, img in enumerate(self.coco["images"])}
+        sizes = np.array(
+            [[img.get("width") or np.nan, img.get("height") or np.nan] for img in self.coco["images"]] + [[np.nan] * 2],
+            dtype=np.float64,
+        )
+        ann_sizes = sizes[[position.get(ann["image_id"], -1) for ann in annotations]]
+        widths, heights = ann_sizes[:, 0], ann_sizes[:, 1]
+
+        problems = check_bboxes(bboxes, malformed, widths, heights)
+        report = {rule: int(mask.sum()) for rule, mask in problems.items()}
+        broken = problems["malformed"] | problems["not_finite"] | problems["non_positive_size"]
+        clipped = np.zeros(len(annotations), dtype=bool)
+        if action == "remove":
+            broken |= problems["out_of_image"]
+        elif action == "repair":
+            rows = np.flatnonzero(problems["out_of_image"] & ~broken)
+            repaired = clip_bboxes(bboxes[rows], widths[rows], heights[rows])
+            fixed = (repaired[:, 2] > 0) & (repaired[:, 3] > 0)
+            broken[rows[~fixed]] = True
+            bboxes[rows[fixed]] = repaired[fixed]
+            clipped[rows[fixed]] = True
+        report["clipped"] = int(clipped.sum())
+        report["removed"] = int(broken.sum()) if action != "report" else 0
+
+        if action != "report":
+            areas = (bboxes[:, 2] * bboxes[:, 3]).tolist()
+
+            def area_value(ann: dict, area: float):
+                # Integer bboxes keep integer areas
+                is_int = all(isinstance(p, int) for p in ann["bbox"])
+                return int(area) if is_int and area.is_integer() else area
+
+            for i in np.flatnonzero(clipped).tolist():
+                ann = annotations[i]
+                is_int = all(isinstance(p, int) for p in ann["bbox"])
+                ann["bbox"] = [int(v) if is_int and v.is_integer() else v for v in bboxes[i].tolist()]
+                ann["area"] = area_value(ann, areas[i])
+            if recompute_area:
+                for i in np.flatnonzero(~broken).tolist():
+                    annotations[i]["area"] = area_value(annotations[i], areas[i])
+            if report["removed"]:
+                self.coco["annotations"] = [annotations[i] for i in np.flatnonzero(~broken).tolist()]
+
+        logging.getLogger().setLevel(logging.INFO)
+        logging.info(f"Bbox validation: {report}")
+        return report
+
     def remove_distorted_bbox(self):
         """
-        This function remove distorted bbox information if there is any
+        This function remove distorted bbox information if there is any. Bboxes crossing the image border are
+        clipped, see validate_bboxes.
         """
-        ann_list: list = []
-        count = 0
-        for ann in self.coco["annotations"]:
-            if not (
-                len(ann["bbox"]) != 4
-                or False in [False for p in ann["bbox"] if type(p) != float and type(p) != int]
-                or False in [False for p in ann["bbox"] if p < 0]
-            ):
-                ann_list.append(ann)
-            else:
-                count += 1
-        self.coco["annotations"] = ann_list
-        if count != 0:
+        report = self.validate_bboxes(action="repair")
+        if report["removed"] + report["clipped"] != 0:
             logging.getLogger().setLevel(logging.INFO)
             logging.info("Annotations that has distorted bbox information has removed")
         else:
             logging.getLogger().setLevel(logging.INFO)
             logging.info("There is no distorted bbox so coco json file did not change")
 
+    def split(
+        self, test_percent: float, validation_percent: float, seed: int = None, stratify: bool = False, group_by=None
+    ) -> tuple:
+        """
+        This function splits dataset by images according to test and validation percent without touching the disk.
+        Images are assigned with one seeded random permutation and annotations follow their image.
+
+            @param test_percent: Test split percent
+            @param validation_percent: Validation split percent
+            @param seed: Random seed, same seed gives same split
+            @param stratify: If it's True use iterative stratification so every category, rare ones included, is
+             shared between splits by the split percents
+            @param group_by: If it's given keep groups of images (e.g. frames of a driving sequence) in one split.
+             Image field name, compiled regex searched in file name or callable taking an image and returning its key.
+             A string is always a field name, a field no image has raises KeyError
+            @return: Tuple of (train, test, validation) coco json files sharing image and annotation dicts with this
+             dataset
+        """
+        images = self.coco["images"]
+        if stratify and group_by is not None:
+            raise ValueError("stratify and group_by can not be used together")
+        if group_by is not None:
+            assignment = group_assignment(group_keys(images, group_by), test_percent, validation_percent, seed)
+        elif stratify:
+            position = {img["id"]: i for i, img in enumerate(images)}
+            annotations = [ann for ann in self.coco["annotations"] if ann["image_id"] in position]
+            ann_images = [position[ann["image_id"]] for ann in annotations]
+            categories: dict = {}
+            ann_categories = [categories.setdefault(ann["category_id"], len(categories)) for ann in annotations]
+            assignment = stratified_assignment(
+                ann_images, ann_categories, len(images), test_percent, validation_percent, seed
+            )
+        else:
+            assignment = random_assignment(len(images), test_percent, validation_percent, seed)
+        return build_subsets(self.coco, assignment)
+
     def train_test_validation_split(
         self,
         image_path: str,
         test_percent: int,
         validation_percent: int,
-        out_path: str,
+        out_path: str = None,
+        workers: int = None,
+        materialize: str = "copy",
+        seed: int = None,
+        interactive: bool = False,
+        stratify: bool = False,
+        group_by=None,
     ):
         """
         This function split dataset according to test, validation percent and save them to given output path.
@@ -439,144 +885,79 @@ class PreProcess:
             @param image_path: Path of folder that contains dataset images
             @param test_percent: Test split percent
             @param validation_percent: Validation split percent
-            @param out_path: Output path
+            @param out_path: Output path. If it's None nothing is written or copied, splits are only returned.
+            @param workers: Thread count of image copy, DEFAULT_WORKERS if it's None
+            @param materialize: "copy", "hardlink", "symlink", "reflink" or "manifest" (only list images in
+             manifest.tsv)
+            @param seed: Random seed, same seed gives same split
+            @param interactive: If it's True ask for confirmation and let user change percents before splitting
+            @param stratify: If it's True keep the share of every category in each split close to split percents
+            @param group_by: If it's given keep groups of images in one split, see split
             @return: Return spoiled train test validation datasets as tuple
         """
-        time = str(datetime.datetime.now()).split(".")[0].split()
-        time = "-".join(time).replace(":", "-")
-
-        exit_path = out_path + f"/data-{time}"
-
-        train = {
-            "licenses": [],
-            "info": {},
-            "categories": [],
-            "images": [],
-            "annotations": [],
-        }
-        test = {
-            "licenses": [],
-            "info": {},
-            "categories": [],
-            "images": [],
-            "annotations": [],
-        }
-        validation = {
-            "licenses": [],
-            "info": {},
-            "categories": [],
-            "images": [],
-            "annotations": [],
-        }
-
-        (
-            random_list,
-            img_id_test,
-            img_id_train,
-            img_id_val,
-            list_dir_train,
-            list_dir_test,
-            list_dir_validation,
-            id_train,
-        ) = ([], [], [], [], [], [], [], [])
-        list_split = [train, test, validation]
-
-        p = PreProcess(self.coco)
-        if not p.check_id_unique():
+        if not self.check_id_unique():
             assert False, "Id not unique"
 
-        len_images = len(self.coco["images"])
-        len_test = int(len_images * test_percent / 100)
-        len_validation = int(len_images * validation_percent / 100)
-        len_train = len_images - (len_test + len_validation)
+        len_train, len_test, len_validation = split_sizes(len(self.coco["images"]), test_percent, validation_percent)
 
         logging.getLogger().setLevel(logging.INFO)
         logging.info("Train image count :" + str(len_train))
         logging.info("Test image count :" + str(len_test))
         logging.info("Validation image count :" + str(len_validation))
 
-        answer = input("Do you want to split datasets?  [yes/ no]: ")
-        if any(answer.lower() == f for f in ["no", "n", "0"]):
-            test_p = input("Please choose test percent : %")
-            val_p = input("Please choose val percent : %")
-            return PreProcess.train_test_validation_split(self, image_path, int(test_p), int(val_p), out_path)
-
-        for elem in list_split:
-            elem["categories"] = self.coco["categories"]
-            elem["licenses"] = self.coco["licenses"]
-            elem["info"] = self.coco["info"]
-
-        for i in tqdm(range(len_test + len_validation)):
-            x = random.randint(0, (len_test + len_validation))
-            while x in random_list:
-                x = random.randint(0, len(self.coco["images"]) - 1)
-            random_list.append(x)
-
-            if i < len_validation:
-                validation["images"] += [self.coco["images"][x]]
-                img_id_val.append(self.coco["images"][x]["id"])
-                list_dir_validation.append(self.coco["images"][x]["file_name"])
-                id_train.append(self.coco["images"][x]["id"])
-            else:
-                test["images"] += [self.coco["images"][x]]
-                img_id_test.append(self.coco["images"][x]["id"])
-                list_dir_test.append(self.coco["images"][x]["file_name"])
-                id_train.append(self.coco["images"][x]["id"])
-
-        for img in tqdm(self.coco["images"]):
-            if img["id"] not in id_train:
-                train["images"] += [img]
-                list_dir_train.append(img["file_name"])
-                img_id_train.append(img["id"])
-
-        for ann in tqdm(self.coco["annotations"]):
-            if ann["image_id"] in img_id_train:
-                train["annotations"] += [ann]
-            if ann["image_id"] in img_id_test:
-                test["annotations"] += [ann]
-            if ann["image_id"] in img_id_val:
-                validation["annotations"] += [ann]
-
-        os.makedirs(exit_path + "/train/annotations"), os.makedirs(exit_path + "/train/images")
-        p = PreProcess(test)
-        if len_test != 0:
-            os.makedirs(exit_path + "/test/images"), os.makedirs(exit_path + "/test/annotations")
-
-            for image in list_dir_test:
-                shutil.copy(
-                    image_path + f"/{image}",
-                    exit_path + "/test/images" + f"/{image}",
-                )
-            p.set_unique_annotation_id(first_id=1)
-            p.set_unique_image_id(first_id=1)
-            p.save_coco_file(directory=exit_path + "/test/annotations/", file_name="test")
-
-        for image in list_dir_train:
-            shutil.copy(
-                image_path + f"/{image}",
-                exit_path + "/train/images" + f"/{image}",
-            )
-        p = PreProcess(train)
-        p.set_unique_annotation_id(first_id=1)
-        p.set_unique_image_id(first_id=1)
-        p.save_coco_file(directory=exit_path + "/train/annotations/", file_name="train")
-
-        if len_validation != 0:
-            os.makedirs(exit_path + "/validation/images"), os.makedirs(exit_path + "/validation/annotations")
-
-            for image in list_dir_validation:
-                shutil.copy(
-                    image_path + f"/{image}",
-                    exit_path + "/validation/images" + f"/{image}",
+        if interactive:
+            answer = input("Do you want to split datasets?  [yes/ no]: ")
+            if any(answer.lower() == f for f in ["no", "n", "0"]):
+                test_p = input("Please choose test percent : %")
+                val_p = input("Please choose val percent : %")
+                return self.train_test_validation_split(
+                    image_path,
+                    int(test_p),
+                    int(val_p),
+                    out_path,
+                    workers=workers,
+                    materialize=materialize,
+                    seed=seed,
+                    interactive=interactive,
+                    stratify=stratify,
+                    group_by=group_by,
                 )
-            p = PreProcess(validation)
-            p.set_unique_annotation_id(first_id=1)
-            p.set_unique_image_id(first_id=1)
-            p.save_coco_file(directory=exit_path + "/validation/annotations/", file_name="validation")
+
+        subsets = self.split(test_percent, validation_percent, seed=seed, stratify=stratify, group_by=group_by)
+        deviation = class_ratio_deviation(subsets, test_percent, validation_percent)
+        logging.info(f"Class ratio deviation max: {deviation['max']:.4f} mean: {deviation['mean']:.4f}")
+        if out_path is None:
+            return subsets
+
+        time = str(datetime.datetime.now()).split(".")[0].split()
+        time = "-".join(time).replace(":", "-")
+        exit_path = out_path + f"/data-{time}"
+
+        saved = []
+        for name, subset in zip(SPLIT_NAMES, subsets):
+            if name != "train" and not subset["images"]:
+                saved.append(subset)
+                continue
+            os.makedirs(exit_path + f"/{name}/images"), os.makedirs(exit_path + f"/{name}/annotations")
+            copy_images(
+                [img["file_name"] for img in subset["images"]],
+                image_path,
+                exit_path + f"/{name}/images",
+                workers=workers,
+                materialize=materialize,
+            ).check()
+            # Renumber copies so the source dataset keeps its ids
+            subset = dict(subset)
+            subset["images"] = [dict(img) for img in subset["images"]]
+            subset["annotations"] = [dict(ann) for ann in subset["annotations"]]
+            p = PreProcess(subset)
+            p.renumber(image_first_id=1, annotation_first_id=1)
+            p.save_coco_file(directory=exit_path + f"/{name}/annotations/", file_name=name)
+            saved.append(p.coco)
         logging.info("Data split Done!")
         logging.info(f" Data saved to {exit_path}")
 
-        return train, test, validation
+        return tuple(saved)
 
     def unite_classes(self, class_names: list, new_class_name: str):
         """
@@ -586,79 +967,72 @@ class PreProcess:
             @param new_class_name: Name of class name to be created
             @return:
         """
-        classes: list = []
-        class_id: list = []
-
-        for cat in self.coco["categories"]:
-            if cat["name"] not in class_names:
-                classes.append(cat)
-            else:
-                class_id.append(cat["id"])
-
-        max_id = self.coco["categories"][-1]["id"]
-
-        # get unique id
-        class_id = list(set(class_id))
-
-        # unite classes in one class
-        classes += [{"id": f"{max_id + 1}", "name": f"{new_class_name}", "supercategory": ""}]
-
-        # set new class id
-        for ann in self.coco["annotations"]:
-            if ann["category_id"] in class_id:
-                ann["category_id"] = f"{max_id + 1}"
-
-        # change categories
-        self.coco["categories"] = classes
+        names = {cat["name"] for cat in self.coco["categories"]}
+        self.remap_categories({name: new_class_name for name in class_names if name in names})
+
+        # The united class is always created and comes after the other classes
+        categories = self.coco["categories"]
+        united = [cat for cat in categories if cat["name"] == new_class_name]
+        if united:
+            categories.remove(united[0])
+        else:
+            int_ids = [cat["id"] for cat in categories if isinstance(cat["id"], int)]
+            united = [{"id": max(int_ids, default=0) + 1, "name": new_class_name, "supercategory": ""}]
+        categories.append(united[0])
 
         # set unique id
         p = PreProcess(self.coco)
         p.set_unique_class_id(first_id=0, back_grounds=True)
 
     @staticmethod
-    def image_split(image_path: str, test_percent: int, val_percent: int):
+    def image_split(
+        image_path: str,
+        test_percent: int,
+        val_percent: int,
+        workers: int = None,
+        materialize: str = "copy",
+        seed: int = None,
+        dry_run: bool = False,
+    ) -> dict:
         """
-        This function split images according to test validation percent into a new folder
+        This function split images according to test validation percent into a new folder. Sorted folder listing is
+        split with one seeded permutation and files are placed in parallel.
             @param image_path: Path of folder that obtain images
             @param test_percent: Image split test percent
             @param val_percent: Image split val percent
+            @param workers: Thread count of image copy, DEFAULT_WORKERS if it's None
+            @param materialize: "copy", "hardlink", "symlink", "reflink" or "manifest" (only list images in
+             manifest.tsv)
+            @param seed: Random seed, same seed and same folder give same split
+            @param dry_run: If it's True only report the split, nothing is created
+            @return: Dictionary of {split name: {"count", "bytes", "path"}}, path is None for dry run
         """
+        if materialize not in MATERIALIZE_MODES:
+            raise ValueError(f"Unknown materialize mode {materialize}, choose one of {MATERIALIZE_MODES}")
+        files = scan_image_folder(image_path)
+        names = sorted(files)
+        assignment = random_assignment(len(names), test_percent, val_percent, seed)
 
         time = str(datetime.datetime.now()).split(".")[0].split()
         time = "-".join(time).replace(":", "-")
-
-        random_list: list = []
-
         parent_path = os.path.abspath(os.path.join(image_path, os.pardir))
-        list_images = os.listdir(image_path)
-
-        len_images = len(list_images)
-        len_test = int(len_images * test_percent / 100)
-        len_validation = int(len_images * val_percent / 100)
-
-        os.makedirs(parent_path + f"/train-{time}"), os.makedirs(parent_path + f"/test-{time}")
-        os.makedirs(parent_path + f"/val-{time}")
-        train_path, test_path, val_path = (
-            parent_path + f"/train-{time}",
-            parent_path + f"/test-{time}",
-            parent_path + f"/val-{time}",
-        )
-
-        for i in tqdm(range(len_test + len_validation)):
-            x = random.randint(0, (len_test + len_validation))
-            while x in random_list:
-                x = random.randint(0, len(list_images) - 1)
-            random_list.append(x)
 
-            if i < len_validation:
-                shutil.copy(image_path + f"/{list_images[x]}", val_path + f"/{list_images[x]}")
-                list_images.remove(list_images[x])
-            else:
-                shutil.copy(image_path + f"/{list_images[x]}", test_path + f"/{list_images[x]}")
-                list_images.remove(list_images[x])
+        report, pairs = {}, []
+        sizes = np.array([files[name] for name in names], dtype=np.int64)
+        for index, (name, folder) in enumerate(zip(SPLIT_NAMES, ("train", "test", "val"))):
+            members = np.flatnonzero(assignment == index)
+            path = None if dry_run else os.path.join(parent_path, f"{folder}-{time}")
+            report[name] = {"count": len(members), "bytes": int(sizes[members].sum()), "path": path}
+            if not dry_run:
+                os.makedirs(path)
+                pairs += [(os.path.join(image_path, names[i]), os.path.join(path, names[i])) for i in members.tolist()]
 
-        for image in list_images:
-            shutil.copy(image_path + f"/{image}", train_path + f"/{image}")
+        logging.getLogger().setLevel(logging.INFO)
+        for name, split_report in report.items():
+            logging.info(f"{name}: {split_report['count']} images, {split_report['bytes']} bytes")
+        if not dry_run:
+            copy_files(pairs, workers=workers, materialize=materialize).check()
+        return report
 
     def reduce_class(self, img_count: int):
         """
@@ -666,39 +1040,50 @@ class PreProcess:
         It sorts image by annotation size and pick first "img_count" images.
             @param img_count: Max image count
         """
+        counter = PairCounter()
+        annotations = self.coco["annotations"]
+        counter.add([ann["image_id"] for ann in annotations], [ann["category_id"] for ann in annotations])
+        image_ids = list(counter.image_positions)
+        keep = {image_ids[position] for position in top_k_per_category(*counter.pairs(), img_count).tolist()}
 
-        ann_info: dict = {}
-        image_id: list = []
-        image_list: list = []
-        ann_list: list = []
-
-        for ann in self.coco["annotations"]:
-            if ann["category_id"] not in list(ann_info.keys()):
-                ann_info[ann["category_id"]] = {}
-
-        for ann in self.coco["annotations"]:
-            for elem in ann_info:
-                if elem == ann["category_id"]:
-                    if ann["image_id"] not in ann_info[elem]:
-                        ann_info[elem][ann["image_id"]] = 1
-                    else:
-                        ann_info[elem][ann["image_id"]] += 1
-
-        for key, _ in ann_info.items():
-            sort_list = sorted(ann_info[key].items(), key=lambda item: item[1])
-            sort_list.reverse()
-            for x in range(0, img_count, 1):
-                image_id.append(sort_list[x][0])
-
-        set(image_id)
+        self.coco["images"] = [image for image in self.coco["images"] if image["id"] in keep]
+        self.coco["annotations"] = [ann for ann in self.coco["annotations"] if ann["image_id"] in keep]
 
-        for image in self.coco["images"]:
-            if image["id"] in image_id:
-                image_list.append(image)
-
-        for ann in self.coco["annotations"]:
-            if ann["image_id"] in image_id:
-                ann_list.append(ann)
-
-        self.coco["images"] = image_list
-        self.coco["annotations"] = ann_list
+    @staticmethod
+    def reduce_class_file(path: str, img_count: int) -> dict:
+        """
+        This function is reduce_class for json files too big to load. The file is streamed twice: first pass only
+        counts annotations per image and category, second pass keeps the selected images and their annotations.
+            @param path: Coco json file path, may be compressed
+            @param img_count: Max image count per category
+            @return: Reduced coco json file
+        """
+        counter = PairCounter()
+        image_ids, category_ids = [], []
+        for _, ann in iter_coco(path, keys=("annotations",)):
+            image_ids.append(ann["image_id"])
+            category_ids.append(ann["category_id"])
+            if len(image_ids) == counter.chunk_size:
+                counter.add(image_ids, category_ids)
+                image_ids, category_ids = [], []
+        counter.add(image_ids, category_ids)
+        image_ids = list(counter.image_positions)
+        keep = {image_ids[position] for position in top_k_per_category(*counter.pairs(), img_count).tolist()}
+        del counter, image_ids, category_ids
+
+        coco: dict = {"images": [], "annotations": [], "categories": []}
+        arrays = set()
+
+        def start_array(key):
+            arrays.add(key)
+            coco.setdefault(key, [])
+
+        for key, item in iter_coco(path, on_array=start_array):
+            if key in ("images", "annotations"):
+                if (item["id"] if key == "images" else item["image_id"]) in keep:
+                    coco[key].append(item)
+            elif key in arrays:
+                coco[key].append(item)
+            else:
+                coco[key] = item
+        return coco
@@ -0,0 +1,78 @@
+import numpy as np
+
+CHUNK_SIZE = 1 << 20
+
+
+class PairCounter:
+    """
+    Sparse image x category count matrix. Pairs are added in batches and folded with np.unique once a chunk is full,
+    so memory holds the distinct (image, category) pairs and one chunk, never every annotation.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.image_positions: dict = {}
+        self.category_positions: dict = {}
+        self._images: list = []
+        self._categories: list = []
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, image_ids: list, category_ids: list):
+        """
+        @param image_ids: Image id per annotation
+        @param category_ids: Category id per annotation
+        """
+        for ids, positions in ((image_ids, self.image_positions), (category_ids, self.category_positions)):
+            for key in dict.fromkeys(ids):
+                if key not in positions:
+                    positions[key] = len(positions)
+        self._images.extend(map(self.image_positions.__getitem__, image_ids))
+        self._categories.extend(map(self.category_positions.__getitem__, category_ids))
+        if len(self._images) >= self.chunk_size:
+            self._fold()
+
+    def _fold(self):
+        if not self._images:
+            return
+        # Image position in the high bits, category position in the low 32 bits
+        keys = (np.array(self._images, dtype=np.int64) << 32) | np.array(self._categories, dtype=np.int64)
+        keys = np.concatenate([self._keys, keys])
+        counts = np.concatenate([self._counts, np.ones(len(self._images), dtype=np.int64)])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(self._keys)).astype(np.int64)
+        self._images, self._categories = [], []
+
+    def pairs(self) -> tuple:
+        """
+        @return: Tuple of (image positions, category positions, annotation counts) arrays of non zero cells
+        """
+        self._fold()
+        return self._keys >> 32, self._keys & 0xFFFFFFFF, self._counts
+
+
+def top_k_per_category(images, categories, counts, k: int) -> np.ndarray:
+    """
+    This function selects, for every category, the k images having the most annotations of it. Cells are grouped
+    by category with one stable sort and each group is cut with np.argpartition, so a category with fewer than k
+    images simply keeps all of them. Ties keep the image that comes first.
+
+        @param images: Image position per non zero cell
+        @param categories: Category position per non zero cell
+        @param counts: Annotation count per non zero cell
+        @param k: Image count to keep per category
+        @return: Sorted unique positions of selected images
+    """
+    images, categories, counts = np.asarray(images), np.asarray(categories), np.asarray(counts)
+    if k <= 0 or not images.size:
+        return np.zeros(0, dtype=np.int64)
+    order = np.argsort(categories, kind="stable")
+    bounds = np.flatnonzero(np.diff(categories[order])) + 1
+    # Higher count first, earlier image first among equal counts
+    scores = counts.astype(np.int64) * (int(images.max()) + 1) - images
+    selected = []
+    for cells in np.split(order, bounds):
+        if len(cells) > k:
+            cells = cells[np.argpartition(-scores[cells], k - 1)[:k]]
+        selected.append(images[cells])
+    return np.unique(np.concatenate(selected))
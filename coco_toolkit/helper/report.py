@@ -4,6 +4,7 @@ import os
 
 import matplotlib.pyplot as plt
 
+from coco_toolkit.helper.index import CocoIndex, get_index
 from coco_toolkit.modules.coco_viewer.cocoviewer import cocoviewer
 
 
@@ -13,15 +14,23 @@ class AnalyzeCategories:
         :param coco: Coco json file
         """
         self.coco = coco.copy()
+        self._index = None
+
+    @property
+    def index(self) -> CocoIndex:
+        """
+        Annotation index of coco json file. It is rebuilt lazily when images, annotations or categories change.
+        """
+        return get_index(self, self.coco)
 
     def plot_category_destinations(self):
 
         categories = {category["id"]: category["name"] for category in self.coco["categories"]}
         category_destinations = {category_id: [] for category_id in categories}
+        index = self.index
         for annotation in self.coco["annotations"]:
             category_id = annotation["category_id"]
-            image_id = annotation["image_id"]
-            image_info = next((image for image in self.coco["images"] if image["id"] == image_id), None)
+            image_info = index.image_of_annotation(annotation)
             if image_info:
                 category_destinations[category_id].append((image_info["file_name"], annotation["bbox"]))
         for category_id, destination in category_destinations.items():
@@ -0,0 +1,246 @@
+import logging
+import re
+
+import numpy as np
+
+SPLIT_NAMES = ("train", "test", "validation")
+
+
+def split_sizes(count: int, test_percent: float, validation_percent: float) -> tuple:
+    """
+    @param count: Count of items to be split
+    @param test_percent: Test split percent
+    @param validation_percent: Validation split percent
+    @return: Tuple of (train, test, validation) item counts
+    """
+    if test_percent < 0 or validation_percent < 0 or test_percent + validation_percent > 100:
+        raise ValueError(f"Invalid split percents test={test_percent}, validation={validation_percent}")
+    len_test = int(count * test_percent / 100)
+    len_validation = int(count * validation_percent / 100)
+    return count - (len_test + len_validation), len_test, len_validation
+
+
+def random_assignment(count: int, test_percent: float, validation_percent: float, seed: int = None) -> np.ndarray:
+    """
+    This function assigns items to splits with a single random permutation. Same seed gives same assignment.
+
+        @param count: Count of items to be split
+        @param test_percent: Test split percent
+        @param validation_percent: Validation split percent
+        @param seed: Random seed, a fresh random split if it's None
+        @return: Array of split index per item, 0 train, 1 test, 2 validation
+    """
+    _, len_test, len_validation = split_sizes(count, test_percent, validation_percent)
+    order = np.random.default_rng(seed).permutation(count)
+    assignment = np.zeros(count, dtype=np.int8)
+    assignment[order[:len_validation]] = 2
+    assignment[order[len_validation : len_validation + len_test]] = 1
+    return assignment
+
+
+def build_subsets(coco: dict, assignment) -> tuple:
+    """
+    This function builds train, test and validation coco json files from a split index per image. Images keep their
+    order, annotations are bucketed with a dict lookup of their image id. Image and annotation dicts are shared with
+    the given coco json file, not copied.
+
+        @param coco: Coco json file
+        @param assignment: Split index per image (0 train, 1 test, 2 validation) in coco["images"] order
+        @return: Tuple of (train, test, validation) coco json files
+    """
+    subsets = tuple(
+        {
+            "licenses": coco.get("licenses", []),
+            "info": coco.get("info", {}),
+            "categories": coco.get("categories", []),
+            "images": [],
+            "annotations": [],
+        }
+        for _ in SPLIT_NAMES
+    )
+    split_of_image = {}
+    for img, split in zip(coco["images"], np.asarray(assignment).tolist()):
+        subsets[split]["images"].append(img)
+        split_of_image[img["id"]] = split
+    for ann in coco["annotations"]:
+        split = split_of_image.get(ann["image_id"])
+        if split is not None:
+            subsets[split]["annotations"].append(ann)
+    return subsets
+
+
+def group_keys(images: list, group_by) -> list:
+    """
+    This function computes the group key of every image. Images without a key (missing field, file name not matching
+    the pattern) are groups of their own and are counted in a warning. A string is always a field name, patterns must
+    be compiled with re.compile.
+
+        @param images: Coco images
+        @param group_by: Image field name such as "sequence_id", compiled regex searched in file name (first group if
+         it has groups, else whole match) or callable taking an image and returning its key
+        @return: Group key per image
+    """
+    if callable(group_by) and not isinstance(group_by, re.Pattern):
+        return [group_by(img) for img in images]
+    keys, missing = [], 0
+    if isinstance(group_by, re.Pattern):
+        for img in images:
+            match = group_by.search(img["file_name"])
+            if match is None:
+                keys.append(("image", img["id"]))
+                missing += 1
+            else:
+                keys.append(match.group(1) if group_by.groups else match.group(0))
+        if images and missing == len(images):
+            raise ValueError(f"Group pattern {group_by.pattern!r} matches no image file name")
+    elif isinstance(group_by, str):
+        for img in images:
+            if group_by in img:
+                keys.append(img[group_by])
+            else:
+                keys.append(("image", img["id"]))
+                missing += 1
+        if images and missing == len(images):
+            raise KeyError(f"No image has a {group_by!r} field, pass re.compile(...) to group by a file name pattern")
+    else:
+        raise TypeError(f"group_by must be a field name, compiled regex or callable, not {type(group_by).__name__}")
+    if missing:
+        logging.getLogger().warning(f"{missing} of {len(images)} images have no group key, each is a group of its own")
+    return keys
+
+
+def group_assignment(keys: list, test_percent: float, validation_percent: float, seed: int = None) -> np.ndarray:
+    """
+    This function assigns whole groups of images to splits. Groups are found with one dict pass over the keys, put
+    in a seeded random order and cut where their cumulative image count crosses the split sizes, so a group never
+    spans two splits and split sizes stay close to the targets.
+
+        @param keys: Group key per image, any hashable value
+        @param test_percent: Test split percent
+        @param validation_percent: Validation split percent
+        @param seed: Random seed, same seed and keys give same assignment
+        @return: Array of split index per image, 0 train, 1 test, 2 validation
+    """
+    _, len_test, len_validation = split_sizes(len(keys), test_percent, validation_percent)
+    groups: dict = {}
+    image_groups = np.fromiter((groups.setdefault(key, len(groups)) for key in keys), dtype=np.int64, count=len(keys))
+    sizes = np.bincount(image_groups, minlength=len(groups))
+    order = np.random.default_rng(seed).permutation(len(groups))
+    # A group goes to the split that holds the middle of its cumulative range
+    middles = np.cumsum(sizes[order]) - sizes[order] / 2
+    group_split = np.empty(len(groups), dtype=np.int8)
+    group_split[order] = np.array([2, 1, 0], dtype=np.int8)[
+        np.searchsorted([len_validation, len_validation + len_test], middles, side="right")
+    ]
+    return group_split[image_groups]
+
+
+def _apportion(count: int, weights) -> np.ndarray:
+    """
+    @param count: Count of items to be shared
+    @param weights: Non negative weight per split
+    @return: Integer share per split summing to count, by largest remainder
+    """
+    exact = count * np.asarray(weights, dtype=np.float64) / np.sum(weights)
+    shares = np.floor(exact).astype(np.int64)
+    left = count - int(shares.sum())
+    if left:
+        shares[np.argsort(shares - exact, kind="stable")[:left]] += 1
+    return shares
+
+
+def stratified_assignment(
+    ann_images, ann_categories, count: int, test_percent: float, validation_percent: float, seed: int = None
+) -> np.ndarray:
+    """
+    This function assigns images to splits with iterative stratification over their categories. Categories are
+    visited from the rarest to the most common; images whose rarest category is the visited one are shared between
+    splits in proportion to how many instances of that category each split still needs. Every visit is a few array
+    operations, so the run is O(A log A) for A annotations whatever the image and category counts are.
+
+        @param ann_images: Image position (index in coco["images"]) per annotation
+        @param ann_categories: Category position (0 .. C-1) per annotation
+        @param count: Count of images
+        @param test_percent: Test split percent
+        @param validation_percent: Validation split percent
+        @param seed: Random seed, same seed gives same assignment
+        @return: Array of split index per image, 0 train, 1 test, 2 validation
+    """
+    sizes = np.array(split_sizes(count, test_percent, validation_percent), dtype=np.float64)
+    if count == 0:
+        return np.zeros(0, dtype=np.int8)
+    rng = np.random.default_rng(seed)
+    ratios = sizes / count
+    ann_images = np.asarray(ann_images, dtype=np.int64)
+    ann_categories = np.asarray(ann_categories, dtype=np.int64)
+    n_categories = int(ann_categories.max()) + 1 if ann_categories.size else 0
+
+    # Rarest category first, ties in random order
+    totals = np.bincount(ann_categories, minlength=n_categories)
+    order = np.lexsort((rng.random(n_categories), totals))
+    rank = np.empty(n_categories, dtype=np.int64)
+    rank[order] = np.arange(n_categories)
+
+    # Rank of rarest category per image, n_categories for images without annotations
+    image_rank = np.full(count, n_categories, dtype=np.int64)
+    np.minimum.at(image_rank, ann_images, rank[ann_categories])
+
+    shuffled = rng.permutation(count)
+    by_rank = shuffled[np.argsort(image_rank[shuffled], kind="stable")]
+    bounds = np.searchsorted(image_rank[by_rank], np.arange(n_categories + 2))
+    ann_rank = image_rank[ann_images]
+    ann_order = np.argsort(ann_rank, kind="stable")
+    ann_bounds = np.searchsorted(ann_rank[ann_order], np.arange(n_categories + 2))
+
+    desired_labels = ratios[:, None] * totals[None, :]
+    desired_images = sizes.copy()
+    assignment = np.zeros(count, dtype=np.int8)
+    for r in range(n_categories + 1):
+        images = by_rank[bounds[r] : bounds[r + 1]]
+        if not images.size:
+            continue
+        weights = np.zeros(len(SPLIT_NAMES))
+        if r < n_categories:
+            weights = np.maximum(desired_labels[:, order[r]], 0) * (desired_images > 0)
+        if weights.sum() <= 0:
+            weights = np.maximum(desired_images, 0)
+        if weights.sum() <= 0:
+            weights = ratios
+        shares = _apportion(len(images), weights)
+        assignment[images] = np.repeat(np.arange(len(SPLIT_NAMES), dtype=np.int8), shares)
+        desired_images -= shares
+
+        anns = ann_order[ann_bounds[r] : ann_bounds[r + 1]]
+        taken = np.bincount(
+            assignment[ann_images[anns]].astype(np.int64) * n_categories + ann_categories[anns],
+            minlength=len(SPLIT_NAMES) * n_categories,
+        )
+        desired_labels -= taken.reshape(len(SPLIT_NAMES), n_categories)
+    return assignment
+
+
+def class_ratio_deviation(subsets: tuple, test_percent: float, validation_percent: float) -> dict:
+    """
+    This function measures how far the annotation share of every category in each split is from the target ratio.
+
+        @param subsets: Tuple of (train, test, validation) coco json files
+        @param test_percent: Test split percent
+        @param validation_percent: Validation split percent
+        @return: Dictionary with "categories" {category id: [train, test, validation] deviation}, "max" and "mean"
+         absolute deviation
+    """
+    target = np.array([100 - test_percent - validation_percent, test_percent, validation_percent]) / 100
+    category_ids = sorted({ann["category_id"] for subset in subsets for ann in subset["annotations"]}, key=str)
+    position = {category_id: i for i, category_id in enumerate(category_ids)}
+    counts = np.zeros((len(SPLIT_NAMES), len(category_ids)))
+    for split, subset in enumerate(subsets):
+        for ann in subset["annotations"]:
+            counts[split, position[ann["category_id"]]] += 1
+    if not category_ids:
+        return {"categories": {}, "max": 0.0, "mean": 0.0}
+    deviation = counts / counts.sum(axis=0) - target[:, None]
+    return {
+        "categories": {category_id: deviation[:, i].tolist() for i, category_id in enumerate(category_ids)},
+        "max": float(np.abs(deviation).max()),
+        "mean": float(np.abs(deviation).mean()),
+    }
@@ -0,0 +1,147 @@
+import json
+from collections import Counter
+
+from coco_toolkit.helper.compression import open_file
+
+CHUNK_SIZE = 1 << 20
+
+_WHITESPACE = " \t\n\r"
+
+# Characters that may continue a number, "1." and "1e" decode as 1 and stop before them
+_NUMBER_CHARS = "0123456789+-.eE"
+
+
+class _Buffer:
+    """
+    Text buffer over a file that keeps only the unparsed tail in memory.
+    """
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        @return: Next non whitespace character without consuming it, "" at end of file
+        """
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid coco json: expected {char!r}, found {found!r}")
+        self.pos += 1
+
+    def value(self, decoder: json.JSONDecoder):
+        """
+        @return: Next complete json value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+                # A number is complete only once the character after it is read and can not continue it
+                number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.eof or (end < len(self.text) and not (number and self.text[end] in _NUMBER_CHARS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_coco(path: str, keys=None, chunk_size: int = CHUNK_SIZE, on_array=None):
+    """
+    This function reads coco json file incrementally. Elements of top level arrays (images, annotations, categories,
+    licenses ...) are yielded one by one as they are parsed, other top level values are yielded whole. Memory use is
+    bounded by chunk size and the biggest single element, not by file size.
+
+        @param path: Coco json file path, may be compressed (.gz, .bz2, .xz, .zst)
+        @param keys: Top level keys to be yielded, None for all keys. Other values are parsed and dropped.
+        @param chunk_size: Characters read from file at once
+        @param on_array: Function called with the key of every yielded top level array before its elements, empty
+         arrays included, so callers can tell arrays from other values
+        @return: Generator of (top level key, item) tuples in file order
+    """
+    decoder = json.JSONDecoder()
+    with open_file(path) as f:
+        buffer = _Buffer(f, chunk_size)
+        buffer.expect("{")
+        if buffer.peek() == "}":
+            return
+        while True:
+            key = buffer.value(decoder)
+            buffer.expect(":")
+            wanted = keys is None or key in keys
+            if buffer.peek() == "[":
+                buffer.pos += 1
+                if wanted and on_array is not None:
+                    on_array(key)
+                if buffer.peek() == "]":
+                    buffer.pos += 1
+                else:
+                    while True:
+                        item = buffer.value(decoder)
+                        if wanted:
+                            yield key, item
+                        if buffer.peek() == ",":
+                            buffer.pos += 1
+                            continue
+                        buffer.expect("]")
+                        break
+            else:
+                value = buffer.value(decoder)
+                if wanted:
+                    yield key, value
+            if buffer.peek() == ",":
+                buffer.pos += 1
+                continue
+            buffer.expect("}")
+            return
+
+
+def iter_section(path: str, key: str, chunk_size: int = CHUNK_SIZE):
+    """
+    @param path: Coco json file path
+    @param key: Top level key such as "images", "annotations" or "categories"
+    @param chunk_size: Characters read from file at once
+    @return: Generator of items of given top level array
+    """
+    for _, item in iter_coco(path, keys=(key,), chunk_size=chunk_size):
+        yield item
+
+
+def count_items(path: str) -> dict:
+    """
+    This function counts images, annotations and annotations per category id in one streaming pass.
+
+        @param path: Coco json file path
+        @return: Dictionary with "images", "annotations", "categories" counts and "category_annotations" Counter
+    """
+    counts = {"images": 0, "annotations": 0, "categories": 0, "category_annotations": Counter()}
+    for key, item in iter_coco(path, keys=("images", "annotations", "categories")):
+        counts[key] += 1
+        if key == "annotations":
+            counts["category_annotations"][item["category_id"]] += 1
+    return counts
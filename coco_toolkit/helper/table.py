@@ -0,0 +1,263 @@
+import gc
+import numbers
+
+import numpy as np
+
+# Bits of AnnotationTable.flags
+HAS_BBOX = 1
+HAS_AREA = 2
+HAS_ISCROWD = 4
+HAS_SEGMENTATION = 8
+BBOX_INT = 16
+AREA_INT = 32
+SEGMENTATION_INT = 64
+
+COLUMNS = ("id", "image_id", "category_id", "bbox", "area", "iscrowd", "segmentation")
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+# Integers above this do not survive a float64 column
+_MAX_EXACT_INT = 1 << 53
+
+
+def _number_kind(values: list):
+    """
+    @param values: List of values
+    @return: "int" if all are integers a float64 column holds exactly, "float" if all are floats, else None. Mixed
+     lists are None so the round trip does not turn their integers into floats.
+    """
+    if all(_is_int(p) and -_MAX_EXACT_INT <= p <= _MAX_EXACT_INT for p in values):
+        return "int"
+    if all(isinstance(p, float) for p in values):
+        return "float"
+    return None
+
+
+def _is_polygons(value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) > 0
+        and all(isinstance(poly, list) and all(_is_number(p) for p in poly) for poly in value)
+    )
+
+
+class AnnotationTable:
+    """
+    Columnar (struct of arrays) form of coco annotations.
+
+    Annotation i has id ids[i], image id image_ids[i], category id category_ids[i], bbox bboxes[i], area areas[i]
+    and iscrowd iscrowd[i]. Its polygons are polygon_offsets[segmentation_offsets[i]:segmentation_offsets[i + 1] + 1]
+    boundaries in segmentation_values. Values that do not fit a column (RLE masks, malformed bboxes, extra keys) are
+    kept as they are in extras, so converting back to coco annotations is lossless.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        image_ids: np.ndarray,
+        category_ids: np.ndarray,
+        bboxes: np.ndarray,
+        areas: np.ndarray,
+        iscrowd: np.ndarray,
+        flags: np.ndarray,
+        segmentation_values: np.ndarray,
+        polygon_offsets: np.ndarray,
+        segmentation_offsets: np.ndarray,
+        extras: list,
+    ):
+        self.ids = ids
+        self.image_ids = image_ids
+        self.category_ids = category_ids
+        self.bboxes = bboxes
+        self.areas = areas
+        self.iscrowd = iscrowd
+        self.flags = flags
+        self.segmentation_values = segmentation_values
+        self.polygon_offsets = polygon_offsets
+        self.segmentation_offsets = segmentation_offsets
+        self.extras = extras
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def from_annotations(annotations: list) -> "AnnotationTable":
+        """
+        This function converts list of coco annotations to a table.
+
+            @param annotations: List of coco annotations
+            @return: Annotation table
+        """
+        n = len(annotations)
+        ids = np.empty(n, dtype=np.int64)
+        image_ids = np.empty(n, dtype=np.int64)
+        category_ids = np.empty(n, dtype=np.int64)
+        bboxes = np.full((n, 4), np.nan, dtype=np.float64)
+        areas = np.zeros(n, dtype=np.float64)
+        iscrowd = np.zeros(n, dtype=np.int8)
+        flags = np.zeros(n, dtype=np.uint8)
+        segmentation_values: list = []
+        polygon_offsets: list = [0]
+        segmentation_offsets = np.zeros(n + 1, dtype=np.int64)
+        extras: list = [None] * n
+
+        for i, ann in enumerate(annotations):
+            for key in ("id", "image_id", "category_id"):
+                if not _is_int(ann.get(key)):
+                    raise ValueError(f"Annotation {i} has no integer {key}: {ann.get(key)!r}")
+            ids[i] = ann["id"]
+            image_ids[i] = ann["image_id"]
+            category_ids[i] = ann["category_id"]
+
+            flag = 0
+            extra = {key: value for key, value in ann.items() if key not in COLUMNS}
+
+            bbox = ann.get("bbox")
+            kind = _number_kind(bbox) if isinstance(bbox, list) and len(bbox) == 4 else None
+            if kind is not None:
+                bboxes[i] = bbox
+                flag |= HAS_BBOX | (BBOX_INT if kind == "int" else 0)
+            elif "bbox" in ann:
+                extra["bbox"] = bbox
+
+            area = ann.get("area")
+            if _number_kind([area]) is not None:
+                areas[i] = area
+                flag |= HAS_AREA | (AREA_INT if _is_int(area) else 0)
+            elif "area" in ann:
+                extra["area"] = area
+
+            crowd = ann.get("iscrowd")
+            if _is_int(crowd) and crowd in (0, 1):
+                iscrowd[i] = crowd
+                flag |= HAS_ISCROWD
+            elif "iscrowd" in ann:
+                extra["iscrowd"] = crowd
+
+            segmentation = ann.get("segmentation")
+            kind = _number_kind([p for poly in segmentation for p in poly]) if _is_polygons(segmentation) else None
+            if kind is not None:
+                for poly in segmentation:
+                    segmentation_values += poly
+                    polygon_offsets.append(len(segmentation_values))
+                flag |= HAS_SEGMENTATION | (SEGMENTATION_INT if kind == "int" else 0)
+            elif "segmentation" in ann:
+                extra["segmentation"] = segmentation
+            segmentation_offsets[i + 1] = len(polygon_offsets) - 1
+
+            flags[i] = flag
+            if extra:
+                extras[i] = extra
+
+        return AnnotationTable(
+            ids,
+            image_ids,
+            category_ids,
+            bboxes,
+            areas,
+            iscrowd,
+            flags,
+            np.asarray(segmentation_values, dtype=np.float64),
+            np.asarray(polygon_offsets, dtype=np.int64),
+            segmentation_offsets,
+            extras,
+        )
+
+    def polygons(self, i: int) -> list:
+        """
+        @param i: Annotation position
+        @return: Polygons of annotation as list of float arrays
+        """
+        first, last = self.segmentation_offsets[i], self.segmentation_offsets[i + 1]
+        bounds = self.polygon_offsets[first : last + 1]
+        return [self.segmentation_values[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def to_annotations(self) -> list:
+        """
+        This function converts the table back to list of coco annotations.
+
+            @return: List of coco annotations
+        """
+        ids = self.ids.tolist()
+        image_ids = self.image_ids.tolist()
+        category_ids = self.category_ids.tolist()
+        iscrowd = self.iscrowd.tolist()
+        flags = self.flags.tolist()
+
+        # Convert whole columns once, rows only slice python lists
+        bboxes = self.bboxes.tolist()
+        int_bboxes = np.nan_to_num(self.bboxes).astype(np.int64).tolist()
+        areas = self.areas.tolist()
+        int_areas = self.areas.astype(np.int64).tolist()
+        values = self.segmentation_values.tolist()
+        int_values = self.segmentation_values.astype(np.int64).tolist()
+        polygon_offsets = self.polygon_offsets.tolist()
+        segmentation_offsets = self.segmentation_offsets.tolist()
+
+        # Building millions of small dicts triggers the cyclic garbage collector over and over
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            annotations = []
+            for i in range(len(ids)):
+                flag = flags[i]
+                ann = {"id": ids[i], "image_id": image_ids[i], "category_id": category_ids[i]}
+                if flag & HAS_SEGMENTATION:
+                    source = int_values if flag & SEGMENTATION_INT else values
+                    bounds = polygon_offsets[segmentation_offsets[i] : segmentation_offsets[i + 1] + 1]
+                    ann["segmentation"] = [source[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+                if flag & HAS_AREA:
+                    ann["area"] = int_areas[i] if flag & AREA_INT else areas[i]
+                if flag & HAS_BBOX:
+                    ann["bbox"] = int_bboxes[i] if flag & BBOX_INT else bboxes[i]
+                if flag & HAS_ISCROWD:
+                    ann["iscrowd"] = iscrowd[i]
+                if self.extras[i]:
+                    ann.update(self.extras[i])
+                annotations.append(ann)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return annotations
+
+
+def renumber_map(old_ids: list, first_id: int):
+    """
+    This function builds the remap table that gives the items of an id space consecutive ids starting from first_id.
+    Items sharing an id all get the new id of the last of them.
+
+        @param old_ids: Ids in item order
+        @param first_id: First new id value
+        @return: Tuple of (new id of every item, function that maps a list of old ids to new ids)
+    """
+    old = np.asarray(old_ids)
+    new = np.arange(first_id, first_id + len(old), dtype=np.int64)
+    if old.dtype.kind not in "iu":
+        # Mixed or non integer ids fall back to a dictionary lookup
+        table = dict(zip(old_ids, new.tolist()))
+        return [table[i] for i in old_ids], lambda values: [table[value] for value in values]
+
+    # Position of the last occurrence of every unique old id
+    keys, last = np.unique(old[::-1], return_index=True)
+    values = new[len(old) - 1 - last]
+
+    def apply(ids: list) -> list:
+        ids = np.asarray(ids)
+        if ids.size == 0:
+            return []
+        if ids.dtype.kind not in "iu":
+            raise KeyError(f"Ids are not in the remap table: {ids[:5].tolist()}")
+        position = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+        missing = keys[position] != ids
+        if missing.any():
+            raise KeyError(f"Ids are not in the remap table: {ids[missing][:5].tolist()}")
+        return values[position].tolist()
+
+    return apply(old), apply
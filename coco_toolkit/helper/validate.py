@@ -0,0 +1,153 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from tqdm import tqdm
+
+from coco_toolkit.helper.copier import DEFAULT_WORKERS
+from coco_toolkit.helper.index import CocoIndex
+
+
+def scan_image_folder(image_path: str, recursive: bool = False) -> dict:
+    """
+    This function lists image folder once with os.scandir. Hidden files (caches, journals) are skipped, so are
+    folders unless recursive.
+
+        @param image_path: Image folder path
+        @param recursive: If it's True also list non hidden subfolders, names are relative paths joined with "/"
+        @return: Dictionary of {file name: size in bytes}
+    """
+    files = {}
+    folders = [(image_path, "")]
+    while folders:
+        folder, prefix = folders.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_file():
+                    files[prefix + entry.name] = entry.stat().st_size
+                elif recursive and entry.is_dir():
+                    folders.append((entry.path, f"{prefix}{entry.name}/"))
+    return files
+
+
+def _relative_name(file_name: str) -> str:
+    """
+    @param file_name: File name of a coco image, may contain subfolders
+    @return: Normalized relative path joined with "/", as scan_image_folder names it
+    """
+    return os.path.normpath(file_name).replace(os.sep, "/")
+
+
+def image_header(path: str, verify: bool = False) -> tuple:
+    """
+    This function reads width and height from image header without decoding pixels.
+
+        @param path: Image file path
+        @param verify: If it's True also run Pillow's structural check of the whole file, still without decoding
+        @return: Tuple of (width, height)
+    """
+    with Image.open(path) as img:
+        size = img.size
+        if verify:
+            img.verify()
+    return size
+
+
+def validate_dataset(
+    coco: dict, image_path: str, workers: int = None, verify: bool = False, progress: bool = True
+) -> dict:
+    """
+    This function checks that coco json file agrees with image folder: every referenced file exists, recorded width
+    and height match the image header, no file is left unreferenced and every referenced file can be opened.
+    Headers are read in a thread pool, annotations are cross checked with the annotation index.
+
+        @param coco: Coco json file
+        @param image_path: Image folder path
+        @param workers: Thread count of header reading, DEFAULT_WORKERS if it's None
+        @param verify: If it's True also check file structure, slower but finds more truncated files
+        @param progress: If it's True show a progress bar
+        @return: Json serializable report, "valid" is True when no problem is found
+    """
+    start = time.perf_counter()
+    images = coco["images"]
+    names = [_relative_name(img["file_name"]) for img in images]
+    # File names with a folder part are joined onto image_path like everywhere else, so subfolders are scanned too
+    files = scan_image_folder(image_path, recursive=any("/" in name for name in names))
+    index = CocoIndex(coco)
+
+    referenced = set(names)
+    missing = [img["file_name"] for img, name in zip(images, names) if name not in files]
+    present = [img for img, name in zip(images, names) if name in files]
+
+    def probe(img):
+        try:
+            return img, image_header(os.path.join(image_path, img["file_name"]), verify), None
+        except Exception as e:  # Pillow raises many exception types for broken files
+            return img, None, f"{type(e).__name__}: {e}"
+
+    size_mismatch, corrupt = [], []
+    with ThreadPoolExecutor(max_workers=workers or DEFAULT_WORKERS) as executor:
+        results = executor.map(probe, present, chunksize=64)
+        for img, size, error in tqdm(results, total=len(present), desc="Reading headers", disable=not progress):
+            if error is not None:
+                corrupt.append({"image_id": img["id"], "file_name": img["file_name"], "error": error})
+                continue
+            recorded = [img.get("width"), img.get("height")]
+            if recorded != list(size):
+                size_mismatch.append(
+                    {"image_id": img["id"], "file_name": img["file_name"], "recorded": recorded, "actual": list(size)}
+                )
+
+    dangling = sum(
+        len(positions) for image_id, positions in index.image_annotations.items() if image_id not in index.images_by_id
+    )
+    report = {
+        "image_path": os.path.abspath(image_path),
+        "images": len(images),
+        "files": len(files),
+        "missing_files": missing,
+        "size_mismatch": size_mismatch,
+        "corrupt_files": corrupt,
+        "orphan_files": sorted(name for name in files if name not in referenced),
+        "unannotated_images": sum(1 for img in images if not index.image_annotations.get(img["id"])),
+        "dangling_annotations": dangling,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    report["valid"] = not (missing or size_mismatch or corrupt or report["orphan_files"] or dangling)
+    return report
+
+
+def add_arguments(parser):
+    """
+    @param parser: argparse parser of validate command
+    """
+    parser.add_argument("annotations", type=str, help="path to coco json file")
+    parser.add_argument("images", type=str, help="path to images folder")
+    parser.add_argument("--workers", type=int, default=None, help="thread count of header reading")
+    parser.add_argument("--verify", action="store_true", help="also check file structure of every image")
+    parser.add_argument("--output", type=str, default=None, help="write json report to this file instead of stdout")
+
+
+def run(args) -> int:
+    """
+    This function validates a dataset from parsed command line arguments and prints or writes the json report.
+
+        @param args: Parsed arguments, see add_arguments
+        @return: Exit code, 0 if dataset is valid else 1
+    """
+    from coco_toolkit.helper.preprocess import PreProcess
+
+    report = PreProcess(PreProcess.reader(args.annotations, plain=True)).validate_dataset(
+        args.images, workers=args.workers, verify=args.verify, progress=args.output is not None
+    )
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+    return 0 if report["valid"] else 1
@@ -0,0 +1,133 @@
+import json
+import math
+
+import numpy as np
+
+from coco_toolkit.helper.compression import open_file
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional fast backend
+    orjson = None
+
+CHUNK_SIZE = 10000
+
+
+def _default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+_json_encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, allow_nan=False, default=_default)
+
+
+def _finite(obj):
+    """
+    @param obj: Json serializable value
+    @return: Copy of value with NaN and infinite floats replaced by None, as orjson writes them
+    """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return _finite(_default(obj))
+    return obj
+
+
+def encode(obj) -> bytes:
+    """
+    This function encodes a value as compact json, with orjson when it is installed. Both backends write NaN and
+    infinite floats as null, json has no literal for them.
+
+        @param obj: Value to be encoded
+        @return: Utf-8 encoded json
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    try:
+        return _json_encoder.encode(obj).encode("utf-8")
+    except ValueError:
+        # Only values holding non finite floats pay for the copy
+        return _json_encoder.encode(_finite(obj)).encode("utf-8")
+
+
+def backend() -> str:
+    """
+    @return: Name of json encoder in use
+    """
+    return "orjson" if orjson is not None else "json"
+
+
+def _round_list(values: list, precision: int) -> list:
+    return [round(value, precision) if type(value) is float else value for value in values]
+
+
+def round_annotation(ann: dict, precision: int) -> dict:
+    """
+    This function returns a copy of annotation whose bbox and polygon values are rounded.
+
+        @param ann: Coco annotation
+        @param precision: Digits after the decimal point
+        @return: Rounded copy of annotation
+    """
+    ann = dict(ann)
+    bbox = ann.get("bbox")
+    if isinstance(bbox, list):
+        ann["bbox"] = _round_list(bbox, precision)
+    segmentation = ann.get("segmentation")
+    if isinstance(segmentation, list):
+        ann["segmentation"] = [
+            _round_list(poly, precision) if isinstance(poly, list) else poly for poly in segmentation
+        ]
+    return ann
+
+
+def write_coco(coco: dict, f, chunk_size: int = CHUNK_SIZE, precision: int = None):
+    """
+    This function writes coco json file to a binary file object. Top level arrays are encoded and written chunk by
+    chunk, so the whole document is never held as one string.
+
+        @param coco: Coco json file
+        @param f: File object opened in binary mode
+        @param chunk_size: Count of array items encoded at once
+        @param precision: If it's given round bbox and segmentation values to this many digits
+    """
+    f.write(b"{")
+    for key_index, (key, value) in enumerate(coco.items()):
+        if key_index:
+            f.write(b",")
+        f.write(encode(str(key)) + b":")
+        if not isinstance(value, list):
+            f.write(encode(value))
+            continue
+
+        f.write(b"[")
+        for start in range(0, len(value), chunk_size):
+            chunk = value[start : start + chunk_size]
+            if precision is not None and key == "annotations":
+                chunk = [round_annotation(ann, precision) for ann in chunk]
+            if start:
+                f.write(b",")
+            # Encode the chunk as a list and drop its brackets
+            f.write(encode(chunk)[1:-1])
+        f.write(b"]")
+    f.write(b"}")
+
+
+def save_coco(coco: dict, path: str, chunk_size: int = CHUNK_SIZE, precision: int = None):
+    """
+    This function saves coco json file to given path with write_coco.
+
+        @param coco: Coco json file
+        @param path: Output json file path, compressed when it ends with .gz, .bz2, .xz or .zst
+        @param chunk_size: Count of array items encoded at once
+        @param precision: If it's given round bbox and segmentation values to this many digits
+    """
+    with open_file(path, "wb") as f:
+        write_coco(coco, f, chunk_size=chunk_size, precision=precision)
@@ -5,7 +5,6 @@ View images with bboxes from the COCO dataset.
 """
 import argparse
 import colorsys
-import json
 import logging
 import os
 import random
@@ -17,6 +16,9 @@ from turtle import __forwardmethods
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageTk
 
+from coco_toolkit.helper.cache import load_coco
+from coco_toolkit.helper.index import CocoIndex
+
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
 parser = argparse.ArgumentParser(description="View images with bboxes from the COCO dataset")
@@ -45,6 +47,7 @@ class Data:
         self.image_dir = image_dir
         instances, images, categories = parse_coco(annotations_file)
         self.instances = instances
+        self.index = CocoIndex(instances)  # Per-image annotation lookup
         self.images = ImageList(images)  # NOTE: image list is based on annotations file
         self.categories = categories  # Dataset categories
 
@@ -58,7 +61,7 @@ class Data:
         full_path = os.path.join(self.image_dir, img_name)
 
         # Get objects and category ids
-        objects = [obj for obj in self.instances["annotations"] if obj["image_id"] == img_id]
+        objects = self.index.annotations_of_image(img_id)
         obj_categories_ids = [obj["category_id"] for obj in objects]
 
         # List of category ids of all objects
@@ -111,8 +114,7 @@ def load_annotations(fname: str) -> dict:
     """Loads annotations file."""
     logging.info(f"Parsing {fname}...")
 
-    with open(fname) as f:
-        instances = json.load(f)
+    instances = load_coco(fname)
     return instances
 
 
@@ -1,10 +1,27 @@
+import copy
+import json
 import os
+import re
+import shutil
+import tempfile
 import unittest
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from coco_toolkit.__main__ import main as coco_toolkit_main
 from coco_toolkit.convertors.voc2coco import voc_to_coco
 from coco_toolkit.convertors.coco2yolo import coco_to_yolo
+from coco_toolkit.helper import cache, categories, copier, near_duplicate, reduce, split, writer
+from coco_toolkit.helper.compression import open_file
+from coco_toolkit.helper.copier import copy_files, copy_images
+from coco_toolkit.helper.index import CocoIndex
 from coco_toolkit.helper.merge import merge_multiple_cocos
 from coco_toolkit.helper.preprocess import PreProcess
 from coco_toolkit.helper.report import AnalyzeCategories
+from coco_toolkit.helper.stream import count_items, iter_coco
+from coco_toolkit.helper.table import HAS_BBOX, AnnotationTable
 
 
 class TestCocoMergeTool(unittest.TestCase):
@@ -45,6 +62,23 @@ class TestCocoMergeTool(unittest.TestCase):
         self.assertEqual(result_1, start_id + 2)
         self.assertEqual(result_2, start_id + 4)
 
+    def test_renumber(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        expected = PreProcess(PreProcess.reader(path, plain=True))
+        expected.set_unique_image_id(first_id=100)
+        expected.set_unique_annotation_id(first_id=7)
+        expected.set_unique_class_id(first_id=1, back_grounds=True)
+
+        p = PreProcess(PreProcess.reader(path, plain=True))
+        p.renumber(image_first_id=100, annotation_first_id=7, class_first_id=1, back_grounds=True)
+        self.assertEqual(p.coco, expected.coco)
+        self.assertEqual(p.coco["images"][3]["id"], 103)
+        self.assertEqual(p.coco["categories"][0]["id"], 1)
+
+        p.coco["annotations"][0]["image_id"] = -1
+        with self.assertRaises(KeyError):
+            p.renumber(image_first_id=1)
+
     def test_check_id_unique(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
@@ -52,6 +86,27 @@ class TestCocoMergeTool(unittest.TestCase):
         result = p.check_id_unique()
         self.assertTrue(result)
 
+    def test_id_report(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path, plain=True)
+        p = PreProcess(coco)
+        self.assertTrue(p.id_report()["valid"])
+
+        coco["annotations"][5]["id"] = coco["annotations"][2]["id"]
+        coco["annotations"][4]["image_id"] = 999
+        coco["annotations"][6]["category_id"] = 42
+        report = p.id_report()
+        self.assertFalse(report["valid"])
+        self.assertEqual(report["duplicates"]["annotation"], {coco["annotations"][2]["id"]: [2, 5]})
+        self.assertEqual(report["missing_image"], {999: [4]})
+        self.assertEqual(report["missing_category"], {42: [6]})
+        self.assertFalse(p.check_id_unique())
+
+        coco["annotations"][5]["id"] = -1
+        self.assertTrue(p.check_id_unique())
+        self.assertFalse(p.check_id_unique(references=True))
+        self.assertEqual(p.id_report(fail_fast=True)["missing_category"], {})
+
     def test_extract_data_by_class_name(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
@@ -63,6 +118,17 @@ class TestCocoMergeTool(unittest.TestCase):
         result = AnalyzeCategories(p.coco).class_have_ann_list()
         self.assertEqual(result, export_list)
 
+    def test_extract_data_by_class_name_string_ids(self):
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        for ann in coco["annotations"]:
+            ann["id"], ann["category_id"] = str(ann["id"]), str(ann["category_id"])
+        for cat in coco["categories"]:
+            cat["id"] = str(cat["id"])
+        p = PreProcess(coco)
+        with tempfile.TemporaryDirectory() as tmp:
+            p.extract_data_by_class_name(categories=["crosswalk"], image_path="tests/coco_dataset/images", out_path=tmp)
+        self.assertEqual(AnalyzeCategories(p.coco).class_have_ann_list(), ["crosswalk"])
+
     def test_filter_data_by_class_name(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
@@ -78,13 +144,149 @@ class TestCocoMergeTool(unittest.TestCase):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
         p = PreProcess(coco)
-        p.separate_json_by_categories()
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = p.separate_json_by_categories(out_path=tmp)
+            self.assertEqual(sorted(paths), ["Background", "crosswalk", "stop", "trafficlight"])
+            with open(paths["trafficlight"]) as f:
+                self.assertEqual([img["id"] for img in json.load(f)], [4, 5, 9])
+            with open(paths["stop"]) as f:
+                self.assertEqual(json.load(f)[0], {"id": 1, "file_name": "road70.png"})
+
+            paths = p.separate_json_by_categories(out_path=os.path.join(tmp, "full"), full_coco=True, compression="gz")
+            subset = PreProcess.reader(paths["trafficlight"], plain=True)
+            self.assertEqual([cat["name"] for cat in subset["categories"]], ["trafficlight"])
+            self.assertEqual(len(subset["annotations"]), 6)
+            self.assertEqual(len(subset["images"]), 3)
+
+            # Categories sharing a name get their id in the file name
+            p.coco["categories"][3]["name"] = "stop"
+            paths = p.separate_json_by_categories(out_path=os.path.join(tmp, "same_name"))
+            self.assertEqual(sorted(paths), ["Background", "stop_1", "stop_3", "trafficlight"])
 
     def test_change_category_name_and_id(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
         p = PreProcess(coco)
         p.change_category_name_and_id(object_id=1, new_id=3, new_name="cat")
+        result = [(cat["id"], cat["name"]) for cat in p.coco["categories"]]
+        self.assertEqual(result, [(0, "Background"), (2, "trafficlight"), (3, "cat")])
+        self.assertEqual(sum(ann["category_id"] == 3 for ann in p.coco["annotations"]), 7)
+
+        # Unknown ids are ignored
+        p.change_category_name_and_id(object_id=42, new_id=5, new_name="dog")
+        self.assertEqual([cat["id"] for cat in p.coco["categories"]], [0, 2, 3])
+
+    def test_remap_categories(self):
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        p = PreProcess(copy.deepcopy(coco))
+        id_map = p.remap_categories({"stop": "sign", "trafficlight": "sign", 3: None, "Background": 10})
+        self.assertEqual(id_map, {0: 10, 1: 1, 2: 1, 3: None})
+        self.assertEqual([(cat["id"], cat["name"]) for cat in p.coco["categories"]], [(10, "Background"), (1, "sign")])
+        self.assertEqual(len(p.coco["annotations"]), 9)
+        self.assertTrue(all(ann["category_id"] == 1 for ann in p.coco["annotations"]))
+
+        # A plain rename keeps the id, a new id alone keeps the name of the category holding it
+        p = PreProcess(copy.deepcopy(coco))
+        self.assertEqual(p.remap_categories({"trafficlight": "light"})[2], 2)
+        self.assertEqual(p.coco["categories"][2], dict(coco["categories"][2], name="light"))
+        p = PreProcess(copy.deepcopy(coco))
+        self.assertEqual(p.remap_categories({"stop": 2})[1], 2)
+        result = [(cat["id"], cat["name"]) for cat in p.coco["categories"]]
+        self.assertEqual(result, [(0, "Background"), (2, "trafficlight"), (3, "crosswalk")])
+        self.assertEqual(sum(ann["category_id"] == 2 for ann in p.coco["annotations"]), 9)
+
+        # Renaming to an existing name merges, string ids fall back to dict lookups
+        p = PreProcess(copy.deepcopy(coco))
+        p.remap_categories({"stop": "crosswalk"})
+        self.assertEqual([cat["name"] for cat in p.coco["categories"]], ["Background", "trafficlight", "crosswalk"])
+        self.assertEqual(sum(ann["category_id"] == 3 for ann in p.coco["annotations"]), 7)
+        self.assertEqual(categories.remap_category_ids(["a", 1], {"a": 5})[0], [5, 1])
+
+        # Same name under different explicit ids is merged too, the first id wins
+        p = PreProcess(copy.deepcopy(coco))
+        id_map = p.remap_categories({"stop": (7, "sign"), "trafficlight": (8, "sign")})
+        self.assertEqual(id_map, {0: 0, 1: 7, 2: 7, 3: 3})
+        result = [(cat["id"], cat["name"]) for cat in p.coco["categories"]]
+        self.assertEqual(result, [(0, "Background"), (7, "sign"), (3, "crosswalk")])
+        with self.assertRaises(KeyError):
+            p.remap_categories({"missing": None})
+
+    def test_compare_two_annotations(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path, plain=True)
+        new = copy.deepcopy(coco)
+        new["annotations"][0]["area"] += 1
+        removed = new["annotations"].pop(1)
+        new["annotations"].append(dict(new["annotations"][2]))
+        for position, ann in enumerate(new["annotations"]):
+            ann["id"] = position + 100
+        new["images"][2]["width"] += 1
+        new["categories"].append({"id": 4, "name": "bike", "supercategory": ""})
+        names = {cat["id"]: cat["name"] for cat in coco["categories"]}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            new_path = os.path.join(tmp, "new.json")
+            writer.save_coco(new, new_path)
+            for streaming in [True, False]:
+                report = PreProcess.compare_two_annotations(path, new_path, details=True, streaming=streaming)
+                self.assertEqual(report["images"], {"added": 0, "removed": 0, "modified": 1, "unchanged": 9})
+                self.assertEqual(report["annotations"], {"added": 1, "removed": 1, "modified": 1, "unchanged": 11})
+                self.assertEqual(report["categories"], {"added": ["bike"], "removed": [], "modified": []})
+                self.assertEqual(report["per_category"][names[removed["category_id"]]]["removed"], 1)
+                self.assertEqual(report["changes"]["annotations"]["removed"], [removed])
+                old_ann, new_ann = report["changes"]["annotations"]["modified"][0]
+                self.assertEqual((old_ann["id"], new_ann["id"], new_ann["area"] - old_ann["area"]), (1, 100, 1))
+                self.assertFalse(report["identical"])
+
+            # Renumbered annotation ids are changes when records are matched by id
+            report = PreProcess.compare_two_annotations(path, new_path, key="id")
+            self.assertEqual(report["annotations"]["unchanged"], 0)
+            self.assertTrue(PreProcess.compare_two_annotations(path, path)["identical"])
+            self.assertEqual(coco_toolkit_main(["diff", path, new_path, "--output", os.path.join(tmp, "diff.json")]), 1)
+
+    def test_patch_journal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "coco.json")
+            shutil.copy("tests/coco_dataset/annotations/coco.json", path)
+            base = PreProcess.reader(path, plain=True)
+            journal = PreProcess.journal(path)
+            journal.modify("annotations", 1, {"area": 5})
+            journal.modify("images", 3, {"width": 10})
+            journal.append(
+                [
+                    {"op": "remove", "section": "categories", "id": 2},
+                    {"op": "add", "section": "annotations", "item": {"id": 50, "image_id": 1, "category_id": 3}},
+                ]
+            )
+            journal.add("annotations", {"id": 51, "image_id": 1, "category_id": 2})
+            # A crash in the middle of an append leaves an unfinished line
+            with open(path + ".journal", "ab") as f:
+                f.write(b'{"op": "remove"')
+            with self.assertRaises(ValueError):
+                journal.remove("videos", 1)
+
+            coco = PreProcess.reader(path, plain=True)
+            kept = [ann for ann in base["annotations"] if ann["category_id"] != 2]
+            self.assertEqual([ann["id"] for ann in coco["annotations"]], [ann["id"] for ann in kept] + [50])
+            self.assertEqual(coco["annotations"][0]["area"], 5)
+            self.assertEqual(coco["images"][2]["width"], 10)
+            self.assertEqual([cat["id"] for cat in coco["categories"]], [0, 1, 3])
+            self.assertEqual(PreProcess.reader(path, plain=True, journal=False), base)
+            sections = ("images", "annotations", "categories")
+            streamed: dict = {}
+            for key, item in PreProcess.stream(path, keys=sections):
+                streamed.setdefault(key, []).append(item)
+            self.assertEqual(streamed, {key: coco[key] for key in sections})
+
+            self.assertEqual(PreProcess.compact_journal(path), 5)
+            self.assertFalse(os.path.exists(path + ".journal"))
+            self.assertEqual(PreProcess.reader(path, plain=True), coco)
+
+            # A journal whose json file was rewritten afterwards is refused
+            journal.remove("images", 1)
+            writer.save_coco(base, path)
+            with self.assertRaises(ValueError):
+                PreProcess.reader(path)
 
     def test_remove_segmentation(self):
         path = "tests/coco_dataset/annotations/coco.json"
@@ -119,6 +321,28 @@ class TestCocoMergeTool(unittest.TestCase):
             result = False
         self.assertTrue(result)
 
+    def test_change_image_file_names_resume(self):
+        img_path = "tests/coco_dataset/images"
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        originals = [img["file_name"] for img in coco["images"]]
+        names = {name: PreProcess.create_random_image_name(name, img_path) for name in originals}
+        with tempfile.TemporaryDirectory() as tmp:
+            PreProcess(copy.deepcopy(coco)).change_image_file_names(img_path, inplace=False, out_path=tmp)
+            with open(os.path.join(tmp, "rename_journal.tsv")) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(sorted(lines), sorted(f"{k}\t{v}" for k, v in names.items()))
+
+            # Interrupted run: last file is neither journaled nor complete
+            with open(os.path.join(tmp, "rename_journal.tsv"), "w") as f:
+                f.write("\n".join(lines[:-1]) + "\n" + lines[-1][:5])
+            os.remove(os.path.join(tmp, "images", lines[-1].split("\t")[1]))
+            p = PreProcess(coco)
+            with mock.patch.object(copier, "materialize_file", wraps=copier.materialize_file) as materialize:
+                p.change_image_file_names(img_path, inplace=True, out_path=tmp)
+            self.assertEqual(materialize.call_count, 1)
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, "images"))), sorted(names.values()))
+            self.assertEqual([img["file_name"] for img in p.coco["images"]], [names[name] for name in originals])
+
     def test_remove_duplicate_image_names(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
@@ -128,6 +352,32 @@ class TestCocoMergeTool(unittest.TestCase):
         result = len(p.coco["images"])
         self.assertEqual(result, len_image)
 
+    def test_remove_duplicate_image_content(self):
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        first = coco["images"][0]
+        coco["images"].append(dict(first, id=100, file_name="copy_" + first["file_name"]))
+        coco["annotations"].append({"id": 100, "image_id": 100, "category_id": 1, "bbox": [0, 0, 1, 1]})
+        with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as cache_dir:
+            shutil.copytree("tests/coco_dataset/images", tmp, dirs_exist_ok=True)
+            shutil.copy(os.path.join(tmp, first["file_name"]), os.path.join(tmp, "copy_" + first["file_name"]))
+            files = sorted(os.listdir(tmp))
+            p = PreProcess(coco)
+            with mock.patch.dict(os.environ, {"COCO_TOOLKIT_CACHE_DIR": cache_dir}):
+                p.remove_duplicate_image_name(image_path=tmp, content=True)
+            self.assertEqual(len(p.coco["images"]), 10)
+            self.assertNotIn(100, [img["id"] for img in p.coco["images"]])
+            self.assertNotIn(100, [ann["image_id"] for ann in p.coco["annotations"]])
+            self.assertEqual(sorted(os.listdir(tmp)), files)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            with mock.patch("coco_toolkit.helper.hashing.file_hash") as file_hash, mock.patch.dict(
+                os.environ, {"COCO_TOOLKIT_CACHE_DIR": cache_dir}
+            ):
+                p = PreProcess(coco)
+                p.remove_duplicate_image_name(image_path=tmp, content=True)
+                file_hash.assert_not_called()
+            self.assertEqual(len(p.coco["images"]), 10)
+
     def test_given_category_count(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
@@ -208,6 +458,46 @@ class TestCocoMergeTool(unittest.TestCase):
         len_anno = 13
         self.assertEqual(result, len_anno)
 
+    def test_validate_bboxes(self):
+        images = [{"id": 1, "width": 100, "height": 50}, {"id": 2, "file_name": "no_size.jpg"}]
+        bboxes = [
+            [10, 10, 20, 20],  # valid
+            [90, 40, 20, 20],  # out of image, clipped to [90, 40, 10, 10]
+            [-5, 0, 10.5, 10],  # out of image, clipped to [0, 0, 5.5, 10]
+            [120, 10, 5, 5],  # out of image, nothing left after clipping
+            [10, 10, 0, 5],  # non positive size
+            [float("nan"), 1, 2, 3],  # not finite
+            [1, 2, 3],  # malformed
+            None,  # malformed
+            [1000, 1000, 5, 5],  # image size unknown, valid
+            ["10", 10, 20, 20],  # malformed, numeric string
+            [True, 10, 20, 20],  # malformed, boolean
+        ]
+        annotations = [
+            {"id": i, "image_id": 2 if i == 8 else 1, "category_id": 1, "bbox": bbox, "area": 1}
+            for i, bbox in enumerate(bboxes)
+        ]
+        coco = {"images": images, "annotations": annotations, "categories": []}
+        expected = {"malformed": 4, "not_finite": 1, "non_positive_size": 1, "out_of_image": 3}
+        p = PreProcess(copy.deepcopy(coco))
+        self.assertEqual(p.validate_bboxes(action="report"), dict(expected, clipped=0, removed=0))
+        self.assertEqual(len(p.coco["annotations"]), len(bboxes))
+        p = PreProcess(copy.deepcopy(coco))
+        self.assertEqual(p.validate_bboxes(action="remove"), dict(expected, clipped=0, removed=9))
+        self.assertEqual([ann["id"] for ann in p.coco["annotations"]], [0, 8])
+
+        p = PreProcess(copy.deepcopy(coco))
+        self.assertEqual(p.validate_bboxes(), dict(expected, clipped=2, removed=7))
+        self.assertEqual([ann["id"] for ann in p.coco["annotations"]], [0, 1, 2, 8])
+        self.assertEqual(p.coco["annotations"][1]["bbox"], [90, 40, 10, 10])
+        self.assertEqual(p.coco["annotations"][1]["area"], 100)
+        self.assertEqual(p.coco["annotations"][2]["bbox"], [0.0, 0.0, 5.5, 10.0])
+        self.assertEqual(p.coco["annotations"][0]["area"], 1)
+        p.validate_bboxes(recompute_area=True)
+        self.assertEqual([ann["area"] for ann in p.coco["annotations"]], [400, 100, 55, 25])
+        self.assertIsInstance(p.coco["annotations"][0]["area"], int)
+        self.assertIsInstance(p.coco["annotations"][2]["area"], float)
+
     def test_unite_classes(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
@@ -223,6 +513,17 @@ class TestCocoMergeTool(unittest.TestCase):
 
         self.assertTrue(result)
 
+        # The united class comes last and is created even if no given class exists
+        coco = PreProcess.reader(path, plain=True)
+        p = PreProcess(coco)
+        p.unite_classes(class_names=["stop", "crosswalk"], new_class_name="sign")
+        result = [(cat["id"], cat["name"]) for cat in p.coco["categories"]]
+        self.assertEqual(result, [(0, "Background"), (1, "trafficlight"), (2, "sign")])
+        self.assertEqual(sum(ann["category_id"] == 2 for ann in p.coco["annotations"]), 7)
+        p.unite_classes(class_names=["missing"], new_class_name="other")
+        self.assertEqual(p.coco["categories"][-1]["name"], "other")
+        self.assertEqual(len(p.coco["categories"]), 4)
+
     def test_save_coco_file(self):
         path = "tests/coco_dataset/annotations/coco.json"
         coco = PreProcess.reader(path)
@@ -237,6 +538,437 @@ class TestCocoMergeTool(unittest.TestCase):
 
         self.assertTrue(result)
 
+    def test_reader_plain(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path, plain=True)
+        self.assertIs(type(coco), dict)
+        self.assertIs(type(coco["annotations"][0]), dict)
+        self.assertEqual(coco, PreProcess.reader(path).to_dict())
+
+    def test_coco_index(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path)
+        p = PreProcess(coco)
+        index = p.index
+        image_id = coco["annotations"][0]["image_id"]
+        expected = [ann for ann in coco["annotations"] if ann["image_id"] == image_id]
+        self.assertEqual(index.annotations_of_image(image_id), expected)
+        self.assertEqual(len(index.annotations_of_category(3)), 4)
+        file_name = coco["images"][0]["file_name"]
+        self.assertIs(index.images_by_file_name[file_name], coco["images"][0])
+        self.assertIs(p.index, index)
+
+        p.coco["annotations"] = p.coco["annotations"][:1]
+        self.assertIsNot(p.index, index)
+        self.assertEqual(sum(len(v) for v in p.index.image_annotations.values()), 1)
+
+    def test_annotation_table(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path)
+        annotations = coco.to_dict()["annotations"]
+        annotations[0]["segmentation"] = [[1.5, 2, 3, 4], [5, 6, 7, 8, 9, 10]]
+        annotations[1]["segmentation"] = {"counts": "abc", "size": [2, 2]}
+        annotations[2]["bbox"] = [1, 2, 3]
+        annotations[3]["ignore"] = 0
+        annotations[4]["bbox"] = [1, 2.5, 3, 4]
+        annotations[5]["segmentation"] = [[1, 2.5, 3, 4, 5, 6]]
+        table = AnnotationTable.from_annotations(annotations)
+        self.assertEqual(table.to_annotations(), annotations)
+        # Integer values keep their type through the round trip, also in lists mixed with floats
+        self.assertEqual(json.dumps(table.to_annotations(), sort_keys=True), json.dumps(annotations, sort_keys=True))
+        self.assertFalse(table.flags[2] & HAS_BBOX)
+
+    def test_sidecar_cache(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        with open(path) as f:
+            expected = json.load(f)
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_path = os.path.join(tmp, "coco.json")
+            shutil.copy(path, tmp_path)
+            self.assertEqual(cache.load_coco(tmp_path, min_size=0), expected)
+            self.assertTrue(cache.is_valid(tmp_path))
+            self.assertEqual(cache.load_coco(tmp_path, min_size=0), expected)
+
+            rest, table = cache.load_table(tmp_path)
+            self.assertIsInstance(table.ids, np.memmap)
+            self.assertEqual(len(table), len(expected["annotations"]))
+
+            # Missing or damaged sidecar files fall back to parsing and a new sidecar
+            for damaged in ["bboxes.npy", "rest.json"]:
+                damaged_path = os.path.join(cache.cache_dir(tmp_path), damaged)
+                with open(damaged_path, "rb") as f:
+                    content = f.read()
+                with open(damaged_path, "wb") as f:
+                    f.write(content[: len(content) // 2])
+                self.assertEqual(cache.load_coco(tmp_path, min_size=0), expected)
+                self.assertIsNotNone(cache.load_table(tmp_path))
+            os.remove(os.path.join(cache.cache_dir(tmp_path), "ids.npy"))
+            self.assertEqual(cache.load_coco(tmp_path, min_size=0), expected)
+            self.assertTrue(os.path.isfile(os.path.join(cache.cache_dir(tmp_path), "ids.npy")))
+
+            # Only mtime changed: content hash keeps the sidecar valid
+            os.utime(tmp_path, ns=(0, 0))
+            self.assertTrue(cache.is_valid(tmp_path))
+
+            expected["annotations"] = expected["annotations"][:2]
+            with open(tmp_path, "w") as f:
+                json.dump(expected, f)
+            self.assertFalse(cache.is_valid(tmp_path))
+            self.assertEqual(cache.load_coco(tmp_path, min_size=0), expected)
+
+            cache.clear_cache(tmp_path)
+            self.assertEqual(cache.load_coco(tmp_path, cache=False, min_size=0), expected)
+            self.assertFalse(os.path.exists(cache.cache_dir(tmp_path)))
+
+            # A file rewritten while it is parsed gets no sidecar
+            json_load = json.load
+
+            def load_and_rewrite(f):
+                coco = json_load(f)
+                with open(tmp_path, "w") as g:
+                    json.dump(dict(coco, annotations=[]), g)
+                return coco
+
+            with mock.patch("coco_toolkit.helper.cache.json.load", side_effect=load_and_rewrite):
+                cache.load_coco(tmp_path, min_size=0)
+            self.assertFalse(os.path.exists(cache.cache_dir(tmp_path)))
+
+    def test_stream_reader(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        with open(path) as f:
+            expected = json.load(f)
+        result: dict = {}
+        for key, item in iter_coco(path, chunk_size=7):
+            if isinstance(expected[key], list):
+                result.setdefault(key, []).append(item)
+            else:
+                result[key] = item
+        for key, value in expected.items():
+            self.assertEqual(result.get(key, []), value)
+
+        annotations = [item for _, item in PreProcess.stream(path, keys=("annotations",))]
+        self.assertEqual(annotations, expected["annotations"])
+
+        # Numbers cut by a chunk boundary after "." or "e" are read whole
+        text = '{"n": 12.5, "images": [1.25e3, 7, -0.5E-2, true, null], "m": -3e+2 , "info": {"v": 1.0}}'
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_path = os.path.join(tmp, "numbers.json")
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            for chunk_size in range(1, len(text) + 1):
+                items = list(iter_coco(tmp_path, chunk_size=chunk_size))
+                self.assertEqual(items[:2], [("n", 12.5), ("images", 1250.0)], chunk_size)
+                self.assertEqual([item for _, item in items[2:]], [7, -0.005, True, None, -300.0, {"v": 1.0}])
+
+        counts = count_items(path)
+        self.assertEqual(counts["annotations"], len(expected["annotations"]))
+        self.assertEqual(counts["category_annotations"][3], 4)
+
+    def test_streaming_writer(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path)
+        coco["annotations"][0]["bbox"] = [1.23456, 2, 3.5, 4.25]
+        with tempfile.TemporaryDirectory() as tmp:
+            p = PreProcess(coco)
+            p.save_coco_file(directory=tmp, file_name="chunked")
+            with open(os.path.join(tmp, "chunked.json")) as f:
+                self.assertEqual(json.load(f), coco.to_dict())
+
+            with open(os.path.join(tmp, "rounded.json"), "wb") as f:
+                writer.write_coco(coco, f, chunk_size=3, precision=2)
+            with open(os.path.join(tmp, "rounded.json")) as f:
+                rounded = json.load(f)
+
+            with mock.patch.object(writer, "orjson", None):
+                writer.save_coco(coco, os.path.join(tmp, "stdlib.json"), chunk_size=4)
+            with open(os.path.join(tmp, "stdlib.json")) as f:
+                self.assertEqual(json.load(f), coco.to_dict())
+        self.assertEqual(rounded["annotations"][0]["bbox"], [1.23, 2, 3.5, 4.25])
+        self.assertEqual(len(rounded["annotations"]), len(coco["annotations"]))
+        self.assertEqual(coco["annotations"][0]["bbox"][0], 1.23456)
+
+        # Both backends write non finite floats as null and non ascii text as utf-8
+        value = {"name": "şehir", "bbox": [float("nan"), 1.5, float("inf")], "area": np.float64("nan")}
+        expected = '{"name":"şehir","bbox":[null,1.5,null],"area":null}'.encode("utf-8")
+        self.assertEqual(writer.encode(value), expected)
+        with mock.patch.object(writer, "orjson", None):
+            self.assertEqual(writer.encode(value), expected)
+
+    def test_compressed_io(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path)
+        p = PreProcess(coco)
+        with tempfile.TemporaryDirectory() as tmp:
+            for compression in ["gz", "bz2", "xz"]:
+                p.save_coco_file(directory=tmp, file_name="compressed", compression=compression)
+                compressed_path = os.path.join(tmp, f"compressed.json.{compression}")
+                self.assertEqual(PreProcess.reader(compressed_path), coco)
+                annotations = [item for _, item in PreProcess.stream(compressed_path, keys=("annotations",))]
+                self.assertEqual(annotations, coco["annotations"])
+
+            # Text mode is utf-8 whatever the locale is, like the raw utf-8 the writer emits
+            plain_path = os.path.join(tmp, "plain.json")
+            with open_file(plain_path, "w") as f:
+                self.assertEqual(f.encoding, "utf-8")
+                f.write('{"name": "şehir"}')
+            with open_file(plain_path) as f:
+                self.assertEqual(json.load(f), {"name": "şehir"})
+
+    def test_copy_engine(self):
+        img_path = "tests/coco_dataset/images"
+        names = sorted(os.listdir(img_path))
+        with tempfile.TemporaryDirectory() as tmp:
+            report = copy_images(names + ["missing.png"], img_path, tmp, workers=4, progress=False)
+            self.assertEqual(report.copied, len(names))
+            self.assertEqual(len(report.errors), 1)
+            self.assertEqual(sorted(os.listdir(tmp)), names)
+            self.assertEqual(report.bytes, sum(os.path.getsize(os.path.join(img_path, n)) for n in names))
+
+            report = copy_images(names, img_path, tmp, progress=False)
+            self.assertEqual((report.copied, report.skipped), (0, len(names)))
+
+            pairs = [(os.path.join(img_path, names[0]), os.path.join(tmp, "renamed.png"))]
+            self.assertEqual(copy_files(pairs, skip_existing=False, progress=False).copied, 1)
+
+    def test_materialize_modes(self):
+        names = sorted(os.listdir("tests/coco_dataset/images"))
+        with tempfile.TemporaryDirectory() as tmp:
+            # Links need source and destination on the same filesystem
+            img_path = os.path.join(tmp, "images")
+            shutil.copytree("tests/coco_dataset/images", img_path)
+            for mode in ["hardlink", "symlink", "reflink", "manifest"]:
+                out = os.path.join(tmp, mode)
+                os.makedirs(out)
+                report = copy_images(names, img_path, out, materialize=mode, progress=False)
+                self.assertEqual((report.copied, len(report.errors)), (len(names), 0))
+            self.assertEqual(os.stat(os.path.join(tmp, "hardlink", names[0])).st_nlink, 2)
+            self.assertTrue(os.path.islink(os.path.join(tmp, "symlink", names[0])))
+            with open(os.path.join(tmp, "reflink", names[0]), "rb") as f:
+                with open(os.path.join(img_path, names[0]), "rb") as g:
+                    self.assertEqual(f.read(), g.read())
+            self.assertEqual(os.listdir(os.path.join(tmp, "manifest")), ["manifest.tsv"])
+            with open(os.path.join(tmp, "manifest", "manifest.tsv")) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], f"{names[0]}\t{os.path.abspath(os.path.join(img_path, names[0]))}")
+
+            # Reruns replace manifest rows and links left by symlink mode
+            copy_images(names, img_path, os.path.join(tmp, "manifest"), materialize="manifest", progress=False)
+            with open(os.path.join(tmp, "manifest", "manifest.tsv")) as f:
+                self.assertEqual(f.read().splitlines(), lines)
+            report = copy_images(names, img_path, os.path.join(tmp, "symlink"), progress=False)
+            self.assertEqual((report.copied, report.skipped), (len(names), 0))
+            self.assertFalse(os.path.islink(os.path.join(tmp, "symlink", names[0])))
+            with open(os.path.join(tmp, "symlink", names[0]), "rb") as f:
+                with open(os.path.join(img_path, names[0]), "rb") as g:
+                    self.assertEqual(f.read(), g.read())
+
+    def test_copy_errors_raise(self):
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            img_path = os.path.join(tmp, "images")
+            shutil.copytree("tests/coco_dataset/images", img_path)
+            os.remove(os.path.join(img_path, coco["images"][0]["file_name"]))
+            out_path = os.path.join(tmp, "out")
+            with self.assertRaises(copier.CopyError) as raised:
+                PreProcess(coco).extract_data_by_class_name(["stop"], img_path, out_path)
+            self.assertEqual(len(raised.exception.report.errors), 1)
+            # The json file is not saved
+            (dataset,) = os.listdir(out_path)
+            self.assertEqual(os.listdir(os.path.join(out_path, dataset, "annotations")), [])
+
+    def test_image_split(self):
+        names = sorted(os.listdir("tests/coco_dataset/images"))
+        with tempfile.TemporaryDirectory() as tmp:
+            img_path = os.path.join(tmp, "images")
+            shutil.copytree("tests/coco_dataset/images", img_path)
+            plan = PreProcess.image_split(img_path, 20, 30, seed=3, dry_run=True)
+            self.assertEqual(sorted(os.listdir(tmp)), ["images"])
+            self.assertEqual([plan[name]["count"] for name in ["train", "test", "validation"]], [5, 2, 3])
+            total = sum(os.path.getsize(os.path.join(img_path, name)) for name in names)
+            self.assertEqual(sum(split_report["bytes"] for split_report in plan.values()), total)
+
+            report = PreProcess.image_split(img_path, 20, 30, seed=3, materialize="hardlink")
+            placed = []
+            for name, split_report in report.items():
+                self.assertEqual(split_report["bytes"], plan[name]["bytes"])
+                files = os.listdir(split_report["path"])
+                self.assertEqual(len(files), plan[name]["count"])
+                placed += files
+            self.assertEqual(sorted(placed), names)
+            with self.assertRaises(ValueError):
+                PreProcess.image_split(img_path, 20, 30, materialize="move")
+
+    def test_train_test_validation_split(self):
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        p = PreProcess(coco)
+        train, test, validation = p.train_test_validation_split(None, 20, 30, seed=7)
+        self.assertEqual([len(s["images"]) for s in (train, test, validation)], [5, 2, 3])
+        self.assertEqual(sum(len(s["annotations"]) for s in (train, test, validation)), len(coco["annotations"]))
+        for subset in (train, test, validation):
+            ids = {img["id"] for img in subset["images"]}
+            self.assertTrue(all(ann["image_id"] in ids for ann in subset["annotations"]))
+        again = p.split(20, 30, seed=7)
+        self.assertEqual([img["id"] for img in again[1]["images"]], [img["id"] for img in test["images"]])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            saved = p.train_test_validation_split(
+                "tests/coco_dataset/images", 20, 30, out_path=tmp, seed=7, materialize="manifest"
+            )
+            (exit_path,) = os.listdir(tmp)
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp, exit_path))), ["test", "train", "validation"])
+            self.assertEqual([img["id"] for img in saved[0]["images"]], [1, 2, 3, 4, 5])
+            # Source dataset keeps its ids
+            self.assertEqual([img["id"] for img in train["images"]], [img["id"] for img in again[0]["images"]])
+
+    def test_stratified_split(self):
+        # 100 images with a common class, every tenth image also has a rare class
+        images = [{"id": i, "file_name": f"{i}.jpg"} for i in range(100)]
+        annotations = [{"id": i, "image_id": i, "category_id": 1} for i in range(100)]
+        annotations += [{"id": 100 + i, "image_id": i, "category_id": 2} for i in range(0, 100, 10)]
+        p = PreProcess({"images": images, "annotations": annotations, "categories": []})
+        for seed in range(5):
+            subsets = p.split(20, 20, seed=seed, stratify=True)
+            self.assertEqual([len(s["images"]) for s in subsets], [60, 20, 20])
+            rare = [sum(ann["category_id"] == 2 for ann in s["annotations"]) for s in subsets]
+            self.assertEqual(rare, [6, 2, 2])
+            self.assertEqual(split.class_ratio_deviation(subsets, 20, 20)["max"], 0.0)
+        first = p.split(20, 20, seed=3, stratify=True)
+        self.assertEqual(first[2]["images"], p.split(20, 20, seed=3, stratify=True)[2]["images"])
+
+    def test_group_split(self):
+        # 30 sequences of 10 frames each
+        images = [{"id": i, "file_name": f"seq{i // 10:03d}_frame{i % 10:02d}.jpg", "seq": i // 10} for i in range(300)]
+        p = PreProcess({"images": images, "annotations": [], "categories": []})
+        for group_by in ["seq", re.compile(r"^(seq\d+)_"), lambda img: img["file_name"][:6]]:
+            subsets = p.split(20, 10, seed=1, group_by=group_by)
+            sequences = [{img["seq"] for img in s["images"]} for s in subsets]
+            self.assertEqual(sum(len(s) for s in sequences), 30)
+            self.assertEqual([len(s["images"]) for s in subsets], [210, 60, 30])
+        with self.assertLogs(level="WARNING") as logs:
+            keys = split.group_keys([{"id": 7, "file_name": "x.jpg"}, {"id": 8, "file_name": "y.jpg", "seq": 1}], "seq")
+        self.assertEqual(keys, [("image", 7), 1])
+        self.assertIn("1 of 2 images", logs.output[0])
+        # Typos and uncompiled patterns are not silently random splits
+        with self.assertRaises(KeyError):
+            p.split(20, 10, seed=1, group_by="sequence")
+        with self.assertRaises(KeyError):
+            p.split(20, 10, seed=1, group_by=r"^(seq\d+)_")
+        with self.assertRaises(ValueError):
+            p.split(20, 10, seed=1, group_by=re.compile(r"^(drive\d+)_"))
+        self.assertEqual(p.split(20, 10, seed=1, group_by="seq")[1], p.split(20, 10, seed=1, group_by="seq")[1])
+        with self.assertRaises(ValueError):
+            p.split(20, 10, stratify=True, group_by="seq")
+
+    def test_near_duplicates(self):
+        rng = np.random.default_rng(0)
+        values = [int(v) for v in rng.integers(0, 1 << 62, 300)]
+        tree = near_duplicate.BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+        query = values[0] ^ 0b1011
+        expected = {i for i, value in enumerate(values) if near_duplicate.hamming(query, value) <= 20}
+        self.assertEqual({i for i, _ in tree.search(query, 20)}, expected)
+
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        first = coco["images"][0]
+        coco["images"].append(dict(first, id=100, file_name="near.jpg"))
+        coco["annotations"].append({"id": 100, "image_id": 100, "category_id": 1, "bbox": [0, 0, 1, 1]})
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copytree("tests/coco_dataset/images", tmp, dirs_exist_ok=True)
+            with Image.open(os.path.join(tmp, first["file_name"])) as img:
+                img.convert("RGB").save(os.path.join(tmp, "near.jpg"), quality=70)
+            files = sorted(os.listdir(tmp))
+            p = PreProcess(coco)
+            with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(
+                os.environ, {"COCO_TOOLKIT_CACHE_DIR": cache_dir}
+            ):
+                self.assertEqual(p.remove_near_duplicates(tmp, workers=2), {100: first["id"]})
+                self.assertEqual(len(p.coco["images"]), 10)
+                self.assertNotIn(100, [ann["image_id"] for ann in p.coco["annotations"]])
+                cache_path = near_duplicate.perceptual_hash_cache(tmp)
+                self.assertTrue(os.path.isfile(cache_path))
+                self.assertEqual(os.path.dirname(cache_path), cache_dir)
+                self.assertEqual(sorted(os.listdir(tmp)), files)
+                self.assertEqual(PreProcess(coco).find_near_duplicates(tmp, workers=2), {100: first["id"]})
+
+    def test_reduce_class(self):
+        path = "tests/coco_dataset/annotations/coco.json"
+        coco = PreProcess.reader(path, plain=True)
+        annotated = {ann["image_id"] for ann in coco["annotations"]}
+        p = PreProcess(coco)
+        p.reduce_class(100)
+        self.assertEqual({img["id"] for img in p.coco["images"]}, annotated)
+
+        p = PreProcess(coco)
+        p.reduce_class(1)
+        kept = {img["id"] for img in p.coco["images"]}
+        for category_id in {ann["category_id"] for ann in coco["annotations"]}:
+            counts = {}
+            for ann in coco["annotations"]:
+                if ann["category_id"] == category_id:
+                    counts[ann["image_id"]] = counts.get(ann["image_id"], 0) + 1
+            best = max(counts.values())
+            self.assertTrue(any(counts.get(image_id) == best for image_id in kept))
+        self.assertLessEqual(len(kept), 3)
+        self.assertTrue(all(ann["image_id"] in kept for ann in p.coco["annotations"]))
+        self.assertEqual(PreProcess.reduce_class_file(path, 1)["images"], p.coco["images"])
+
+        # Other top level arrays stay lists, empty ones included
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_path = os.path.join(tmp, "coco.json")
+            with open(tmp_path, "w") as f:
+                json.dump(dict(coco, videos=[{"id": 1}, {"id": 2}], licenses=[]), f)
+            reduced = PreProcess.reduce_class_file(tmp_path, 1)
+        self.assertEqual(reduced["videos"], [{"id": 1}, {"id": 2}])
+        self.assertEqual(reduced["licenses"], [])
+        self.assertEqual(reduced["categories"], coco["categories"])
+
+        counter = reduce.PairCounter(chunk_size=4)
+        for ann in coco["annotations"]:
+            counter.add([ann["image_id"]], [ann["category_id"]])
+        self.assertEqual(int(counter.pairs()[2].sum()), len(coco["annotations"]))
+
+    def test_validate_dataset(self):
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        images = coco["images"]
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copytree("tests/coco_dataset/images", tmp, dirs_exist_ok=True)
+            os.remove(os.path.join(tmp, images[0]["file_name"]))
+            with open(os.path.join(tmp, images[1]["file_name"]), "wb") as f:
+                f.write(b"not an image")
+            with open(os.path.join(tmp, "orphan.png"), "wb") as f:
+                f.write(b"")
+            images[2]["width"] += 1
+            coco["annotations"].append({"id": 999, "image_id": 999, "category_id": 1, "bbox": [0, 0, 1, 1]})
+
+            report = PreProcess(coco).validate_dataset(tmp, workers=2, progress=False)
+            self.assertFalse(report["valid"])
+            self.assertEqual(report["missing_files"], [images[0]["file_name"]])
+            self.assertEqual([c["file_name"] for c in report["corrupt_files"]], [images[1]["file_name"]])
+            self.assertEqual(report["orphan_files"], ["orphan.png"])
+            self.assertEqual(report["size_mismatch"][0]["recorded"][0], report["size_mismatch"][0]["actual"][0] + 1)
+            self.assertEqual(report["dangling_annotations"], 1)
+
+            output = os.path.join(tmp, "report.json")
+            argv = ["validate", "tests/coco_dataset/annotations/coco.json", "tests/coco_dataset/images"]
+            self.assertEqual(coco_toolkit_main(argv + ["--output", output]), 0)
+            with open(output) as f:
+                self.assertTrue(json.load(f)["valid"])
+
+        # File names with a subfolder part
+        coco = PreProcess.reader("tests/coco_dataset/annotations/coco.json", plain=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            for position, img in enumerate(coco["images"]):
+                folder = f"seq{position % 2:02d}"
+                os.makedirs(os.path.join(tmp, folder), exist_ok=True)
+                shutil.copy(os.path.join("tests/coco_dataset/images", img["file_name"]), os.path.join(tmp, folder))
+                img["file_name"] = f"{folder}/{img['file_name']}"
+            with open(os.path.join(tmp, "seq01", "orphan.png"), "wb") as f:
+                f.write(b"")
+            report = PreProcess(coco).validate_dataset(tmp, workers=2, progress=False)
+            self.assertEqual((report["missing_files"], report["corrupt_files"]), ([], []))
+            self.assertEqual(report["orphan_files"], ["seq01/orphan.png"])
+
 
 class TestCocoConvertorsTool(unittest.TestCase):
     # TODO